@@ -0,0 +1,243 @@
+import io
+import os
+import glob
+import time
+import threading
+import numpy as np
+import logger
+import storage
+import data_cache
+
+# 受験結果の列指向ログ (全セッション分)
+# 1回の試験 = 1チャンク (data/attempts/part-*.npz)。文字列列は strings.json の辞書で整数コード化して持つ。
+# 集計は全チャンクを連結した NumPy 配列に対して bincount で行う (並べ替え不要・O(n))。
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.path.join(BASE_DIR, "data")
+ATTEMPT_DIR = os.path.join(DATA_DIR, "attempts")
+STRINGS_FILE = os.path.join(ATTEMPT_DIR, "strings.json")
+BASE_FILE = os.path.join(ATTEMPT_DIR, "base.npz")
+
+# 辞書コード化する列
+DIMENSIONS = ["ref", "chapter", "level", "model", "user", "kind"]
+# 受験の種類 (kind 列)。項目分析は通常の試験 (KIND_EXAM) だけを対象にする。
+# kind 列の無い古いチャンクはコード -1 (種類不明) として読む
+KIND_EXAM = "exam"      # ランダム出題・試験コードによる試験
+KIND_REVIEW = "review"  # 復習優先モード (履歴から期限切れ・苦手な問題を選ぶ)
+KIND_RETEST = "retest"  # 結果画面の「間違えた問題だけ復習する」(解説を見た直後の再受験)
+# 数値列と dtype
+NUMERIC = {"attempt": np.int64, "ts": np.float64, "correct": np.int8, "choice": np.int8, "time_spent": np.float32}
+COMPACT_THRESHOLD = 200  # part ファイルがこの数を超えたら base.npz に統合する
+# 回答時間の分位点はヒストグラムで近似する (0.5秒刻み・600秒以上は最終ビン)
+TIME_BIN_SEC = 0.5
+MAX_TIME_SEC = 600.0
+HIST_CELLS = 4_000_000  # ヒストグラムの最大セル数 (グループ数が多い場合はビンを粗くする)
+
+def _encode(values_by_dim):
+    """
+    ロック下で文字列辞書を更新し、各列の整数コード配列を返す
+    """
+    codes = {}
+    def update(tables):
+        tables = tables or {}
+        changed = False
+        for dim, values in values_by_dim.items():
+            table = tables.setdefault(dim, [])
+            lookup = {v: i for i, v in enumerate(table)}
+            arr = np.empty(len(values), dtype=np.int32)
+            for i, v in enumerate(values):
+                code = lookup.get(v)
+                if code is None:
+                    code = lookup[v] = len(table)
+                    table.append(v)
+                    changed = True
+                arr[i] = code
+            codes[dim] = arr
+        return tables if changed else None
+    storage.update_json(STRINGS_FILE, update, default={})
+    return codes
+
+def _save_npz(path, columns):
+    # メモリ上で npz を組み立て、storage の原子的書き込み (fsync 付き) で保存する
+    buf = io.BytesIO()
+    np.savez(buf, **columns)
+    storage.atomic_write_bytes(path, buf.getvalue())
+
+def append_attempt(user_answers, user="ゲスト", ts=None, kind=KIND_EXAM):
+    """
+    1回分の試験結果 (view_exam の user_answers) を1チャンクとして追記する (kind: 受験の種類 KIND_*)
+    """
+    if not user_answers: return 0
+    ts = ts or time.time()
+    attempt_id = time.time_ns() // 1000
+    n = len(user_answers)
+    values = {dim: [] for dim in DIMENSIONS}
+    choice = np.zeros(n, dtype=np.int8)
+    correct = np.zeros(n, dtype=np.int8)
+    spent = np.zeros(n, dtype=np.float32)
+    for i, log in enumerate(user_answers):
+        q = log['q']
+        values["ref"].append(data_cache.question_ref(q))
+        values["chapter"].append(str(q.get('chapter', 'その他')))
+        values["level"].append(str(q.get('level', '')))
+        values["model"].append(str(q.get('source_model', 'unknown')))
+        values["user"].append(str(user))
+        values["kind"].append(kind)
+        choice[i] = int(log['u']) if str(log.get('u', '')).isdigit() else 0
+        correct[i] = 1 if log['ok'] else 0
+        spent[i] = float(log.get('t', 0.0))
+    try:
+        codes = _encode(values)
+        columns = {f"{dim}_code": codes[dim] for dim in DIMENSIONS}
+        columns.update({
+            "attempt": np.full(n, attempt_id, dtype=np.int64),
+            "ts": np.full(n, ts, dtype=np.float64),
+            "correct": correct, "choice": choice, "time_spent": spent,
+        })
+        path = os.path.join(ATTEMPT_DIR, f"part-{attempt_id}-{os.getpid()}.npz")
+        _save_npz(path, columns)
+        logger.log(f"Attempt logged: {n} answers", "ATTEMPT")
+    except Exception as e:
+        logger.error(e, "Attempt log write failed")
+        return 0
+    if len(_part_files()) > COMPACT_THRESHOLD:
+        try: compact()
+        except Exception as e: logger.error(e, "Attempt log compaction failed")
+    return n
+
+def _part_files():
+    return sorted(glob.glob(os.path.join(ATTEMPT_DIR, "part-*.npz")))
+
+def _read_npz(path):
+    with np.load(path) as z:
+        return {k: z[k] for k in z.files}
+
+def _concat(chunks):
+    keys = [f"{dim}_code" for dim in DIMENSIONS] + list(NUMERIC)
+    if not chunks:
+        out = {f"{dim}_code": np.zeros(0, dtype=np.int32) for dim in DIMENSIONS}
+        out.update({k: np.zeros(0, dtype=t) for k, t in NUMERIC.items()})
+        return out
+    def column(c, k):
+        if k in c: return c[k]
+        return np.full(len(c["correct"]), -1, dtype=np.int32)  # 後から追加した列 (kind) が無い古いチャンク
+    return {k: np.concatenate([column(c, k) for c in chunks]) for k in keys}
+
+def compact():
+    """
+    part ファイルを base.npz に統合する (ロック下)
+    """
+    with storage.file_lock(BASE_FILE):
+        parts = _part_files()
+        if not parts: return 0
+        chunks = [_read_npz(BASE_FILE)] if os.path.exists(BASE_FILE) else []
+        chunks += [_read_npz(p) for p in parts]
+        _save_npz(BASE_FILE, _concat(chunks))
+        for p in parts:
+            try: os.remove(p)
+            except OSError: pass
+    logger.log(f"Compacted {len(parts)} attempt chunks", "ATTEMPT")
+    return len(parts)
+
+class AttemptTable:
+    """
+    全チャンクを連結した列 (cols) と文字列辞書 (strings)
+    """
+    def __init__(self, cols, strings):
+        self.cols = cols
+        self.strings = strings
+
+    def __len__(self):
+        return len(self.cols["correct"])
+
+    def mask(self, user=None, level=None, model=None, kind=None):
+        m = np.ones(len(self), dtype=bool)
+        for dim, value in (("user", user), ("level", level), ("model", model), ("kind", kind)):
+            if value is None: continue
+            table = self.strings.get(dim, [])
+            code = table.index(value) if value in table else -1
+            m &= self.cols[f"{dim}_code"] == code
+        return m
+
+    def subset(self, mask):
+        """
+        mask に一致する回答だけの AttemptTable を返す
+        """
+        return AttemptTable({k: v[mask] for k, v in self.cols.items()}, self.strings)
+
+    def aggregate(self, dim, mask=None):
+        """
+        dim 別の正解率と回答時間分布を返す
+        [{"name", "answers", "correct", "accuracy", "time_mean", "time_p50", "time_p90"}]
+        """
+        codes = self.cols[f"{dim}_code"]
+        correct = self.cols["correct"]
+        spent = self.cols["time_spent"]
+        if mask is not None:
+            codes, correct, spent = codes[mask], correct[mask], spent[mask]
+        if len(codes) == 0: return []
+        names = self.strings.get(dim, [])
+        size = max(len(names), int(codes.max()) + 1)
+        n = np.bincount(codes, minlength=size)
+        c = np.bincount(codes, weights=correct, minlength=size)
+        t_sum = np.bincount(codes, weights=spent, minlength=size)
+        # 分位点: 並べ替えの代わりに (コード, 時間ビン) の2次元ヒストグラムを bincount で作り、累積から求める (O(n))
+        present = np.nonzero(n)[0]
+        bins = int(min(MAX_TIME_SEC / TIME_BIN_SEC, max(10, HIST_CELLS // size)))
+        bin_width = MAX_TIME_SEC / bins
+        t_bin = np.minimum((spent / bin_width).astype(np.int64), bins - 1)
+        hist = np.bincount(codes.astype(np.int64) * bins + t_bin, minlength=size * bins).reshape(size, bins)[present]
+        cum = np.cumsum(hist, axis=1)
+        p50 = (np.argmax(cum >= (n[present] * 0.5)[:, None], axis=1) + 0.5) * bin_width
+        p90 = (np.argmax(cum >= (n[present] * 0.9)[:, None], axis=1) + 0.5) * bin_width
+        rows = []
+        for j, code in enumerate(present):
+            rows.append({
+                "name": names[code] if code < len(names) else str(code),
+                "answers": int(n[code]),
+                "correct": int(c[code]),
+                "accuracy": float(c[code] / n[code]),
+                "time_mean": float(t_sum[code] / n[code]),
+                "time_p50": float(p50[j]),
+                "time_p90": float(p90[j]),
+            })
+        return rows
+
+    def attempt_count(self, mask=None):
+        a = self.cols["attempt"] if mask is None else self.cols["attempt"][mask]
+        return int(len(np.unique(a)))
+
+_cache_lock = threading.Lock()
+_cache = {"key": None, "table": None}
+
+def _files():
+    return ([BASE_FILE] if os.path.exists(BASE_FILE) else []) + _part_files()
+
+def _cache_key(files):
+    try:
+        return tuple((f, os.path.getmtime(f)) for f in files + [STRINGS_FILE] if os.path.exists(f))
+    except OSError:
+        return None
+
+def load_table():
+    """
+    列ログを読み込む。ファイル構成が変わっていなければ前回の結果を再利用する
+    """
+    key = _cache_key(_files())
+    with _cache_lock:
+        if key is not None and _cache["key"] == key:
+            return _cache["table"]
+    # 統合 (compact) の途中で一覧を取ると、新しい base と削除前の part を両方読んで二重計上するため、
+    # 一覧の取得と読み込みは compact と同じロック下で行う
+    chunks = []
+    with storage.file_lock(BASE_FILE):
+        files = _files()
+        key = _cache_key(files)
+        for f in files:
+            try: chunks.append(_read_npz(f))
+            except Exception as e: logger.error(e, f"Attempt chunk read failed {os.path.basename(f)}")
+    strings = storage.read_json(STRINGS_FILE, {}) or {}
+    table = AttemptTable(_concat(chunks), strings)
+    with _cache_lock:
+        _cache["key"], _cache["table"] = key, table
+    return table
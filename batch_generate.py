@@ -0,0 +1,257 @@
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import logger  # 共通ログを使用
+import storage
+import exam_config
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.path.join(BASE_DIR, "data")
+API_KEY_FILE = os.path.join(BASE_DIR, "apikey.txt")
+LOCK_PATH = os.path.join(DATA_DIR, "batch_generate")
+PROGRESS_INTERVAL_SEC = 5.0  # 進捗イベントの最短間隔 (タスクの状態が変わったときはすぐに出す)
+
+EXIT_OK = 0
+EXIT_FAILED = 1  # 失敗したジョブがある
+EXIT_USAGE = 2
+EXIT_LOCKED = 3  # 別の実行が動いている
+
+# 問題のバッチ生成 (画面を使わずに generator_logic.run_generation を実行する)
+# モデル × レベルを1単位として、--parallel 個まで並行に生成する (同じプロセス内なので PDF のアップロードは共有される)。
+# 進捗・結果は標準出力に JSON Lines で出し、通常のログは標準エラーに出す。
+# 同時に1つしか動かないよう data/batch_generate.lock を取るため、cron などから定期実行しても重ならない。
+#
+#   python batch_generate.py --model gemini-2.5-flash --level 二等 --sets 2 --chapter 4=10 --chapter 5=10
+#   python batch_generate.py --job-file jobs.json
+#
+# ジョブファイル:
+#   {"parallel": 2,
+#    "jobs": [{"model": "gemini-2.5-flash", "levels": ["二等"], "sets": 2, "per_chapter": 5, "batch": true},
+#             {"model": "gemini-2.5-pro", "levels": ["一等"], "targets": {"一等": {"4": 10, "5": 5}}},
+#             {"models": ["gemini-2.5-flash", "gemini-2.5-pro"], "levels": ["二等"], "fan_out": 100},
+#             {"models": ["gemini-2.5-flash"], "fill_gaps": 10}]}
+# targets はレベルごとの {章番号: 1セットあたりの問題数}、per_chapter は全章に同じ数、どちらも無ければ設定の配分 (weights)。
+# fan_out はレベルごとの合計問題数を、過去の実績 (問/分) に比例して models に振り分ける (generator_logic.fan_out_targets)。
+# fill_gaps は章ごとの目標在庫 (出題数 × 指定の倍率) に足りない分だけを作る (generator_logic.plan_gaps。
+# "pooled": true なら全モデル合計の在庫に対する不足を models に振り分ける)。cron での定期補充はこれを使う。
+
+def load_api_key(explicit=None):
+    """
+    APIキー: 引数 → 環境変数 (GEMINI_API_KEY / GOOGLE_API_KEY) → apikey.txt の順
+    """
+    key = explicit or os.environ.get("GEMINI_API_KEY") or os.environ.get("GOOGLE_API_KEY")
+    if not key and os.path.exists(API_KEY_FILE):
+        with open(API_KEY_FILE, 'r', encoding='utf-8-sig') as f: key = f.read().strip()
+    return key or None
+
+def parse_chapter_targets(items):
+    """
+    ["4=10", "5=20"] → {"4": 10, "5": 20}
+    """
+    targets = {}
+    for item in items or []:
+        ch, sep, n = str(item).partition("=")
+        if not sep or not n.strip().isdigit():
+            raise ValueError(f"章の指定は 章番号=問題数 の形式です: {item}")
+        targets[exam_config.chapter_num(ch) or ch.strip()] = int(n)
+    return targets
+
+def expand_jobs(jobs, config=None):
+    """
+    fan_out / fill_gaps 指定のジョブを、モデルごとの問題数 (targets) を持つ1モデルずつのジョブに展開する
+    """
+    import generator_logic
+    config = config or exam_config.get_config()
+    expanded = []
+    for job in jobs:
+        if job.get("fan_out") is None and job.get("fill_gaps") is None:
+            expanded.append(job)
+            continue
+        models = job.get("models") or ([job["model"]] if job.get("model") else [])
+        if not models: raise ValueError(f"models が指定されていないジョブがあります: {job}")
+        levels = job.get("levels") or list(config.levels)
+        if isinstance(levels, str): levels = [levels]
+        for level in levels:
+            if level not in config: raise ValueError(f"不明なレベルです: {level}")
+        batch = bool(job.get("batch", False))
+        if job.get("fill_gaps") is not None:
+            plan = generator_logic.plan_gaps(models, levels, depth=int(job["fill_gaps"]), pooled=bool(job.get("pooled", False)), batch_mode=batch)
+            for m in models:
+                # 不足の無いレベルは targets に載らないため、生成対象のレベルだけを渡す
+                if plan[m]: expanded.append({"model": m, "levels": list(plan[m]), "sets": 1, "batch": batch, "targets": plan[m]})
+            continue
+        for level in levels:
+            targets = generator_logic.fan_out_targets(models, level, int(job["fan_out"]), batch_mode=batch)
+            for m in models:
+                expanded.append({"model": m, "levels": [level], "sets": 1, "batch": batch, "targets": {level: targets[m]}})
+    return expanded
+
+def build_units(jobs, config=None):
+    """
+    ジョブの一覧を (モデル, レベル) 単位の実行単位に分ける。作る問題が無い単位は除く
+    """
+    import generator_logic
+    config = config or exam_config.get_config()
+    units = []
+    for job in expand_jobs(jobs, config):
+        model = job.get("model")
+        if not model: raise ValueError(f"model が指定されていないジョブがあります: {job}")
+        levels = job.get("levels") or list(config.levels)
+        if isinstance(levels, str): levels = [levels]
+        sets = int(job.get("sets", 1))
+        for level in levels:
+            if level not in config: raise ValueError(f"不明なレベルです: {level}")
+            targets = (job.get("targets") or {}).get(level)
+            if targets is None and job.get("per_chapter") is not None:
+                targets = {spec.num or spec.file_id: int(job["per_chapter"]) for spec in config.level(level).chapters}
+            chapter_targets = {level: {str(k): int(v) for k, v in targets.items()}} if targets is not None else None
+            per_set = sum(generator_logic.chapter_count(spec, level, chapter_targets) for spec in config.level(level).chapters)
+            if per_set <= 0 or sets <= 0: continue
+            units.append({
+                "model": model, "level": level, "sets": sets, "batch": bool(job.get("batch", False)),
+                "chapter_targets": chapter_targets, "planned": per_set * sets,
+            })
+    return units
+
+class ProgressWriter:
+    """
+    JSON Lines のイベントを書き出す (スレッド間で共有)
+    """
+    def __init__(self, stream):
+        self.stream = stream
+        self._lock = threading.Lock()
+
+    def emit(self, event, **fields):
+        line = json.dumps(dict(event=event, ts=time.strftime("%Y-%m-%d %H:%M:%S"), **fields), ensure_ascii=False, default=str)
+        with self._lock:
+            self.stream.write(line + "\n")
+            self.stream.flush()
+
+    def callback(self, unit_no, unit):
+        """
+        run_generation に渡す進捗コールバック。タスクの状態が変わったときと PROGRESS_INTERVAL_SEC ごとに出す
+        """
+        last = {"t": 0.0, "states": None}
+        def update(tasks, time_info, progress):
+            states = tuple(t.get("status") for t in tasks)
+            now = time.time()
+            if states == last["states"] and now - last["t"] < PROGRESS_INTERVAL_SEC: return
+            last.update(t=now, states=states)
+            info = time_info if isinstance(time_info, dict) else {}
+            self.emit(
+                "progress", unit=unit_no, model=unit["model"], level=unit["level"],
+                total=round(progress.get("total", 0.0), 3), status=info.get("status"), eta=info.get("eta_total"),
+                accepted=(info.get("telemetry") or {}).get("accepted"),
+                tasks_done=sum(1 for t in tasks if str(t.get("status", "")).startswith("✅")), tasks=len(tasks),
+            )
+        return update
+
+def run_units(units, api_key, parallel, progress):
+    """
+    実行単位を parallel 個まで並行に生成し、単位ごとの結果を返す
+    """
+    import generator_logic
+
+    def run(unit_no):
+        unit = units[unit_no]
+        progress.emit("unit_start", unit=unit_no, model=unit["model"], level=unit["level"], sets=unit["sets"], planned=unit["planned"])
+        t0 = time.time()
+        try:
+            err = generator_logic.run_generation(
+                api_key, unit["model"], [unit["level"]], unit["sets"], progress.callback(unit_no, unit),
+                batch_mode=unit["batch"], chapter_targets=unit["chapter_targets"],
+            )
+        except Exception as e:
+            logger.error(e, f"Batch generation failed: {unit['model']} {unit['level']}")
+            err = str(e)
+        result = {"unit": unit_no, "model": unit["model"], "level": unit["level"], "ok": not err, "error": err,
+                  "elapsed_sec": round(time.time() - t0, 1)}
+        progress.emit("unit_done", **result)
+        return result
+
+    with ThreadPoolExecutor(max_workers=max(1, parallel), thread_name_prefix="batch-gen") as pool:
+        return list(pool.map(run, range(len(units))))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="問題を画面なしで生成する (進捗は標準出力に JSON Lines)")
+    parser.add_argument("--model", action="append", default=[], help="生成に使うモデル (複数指定可)")
+    parser.add_argument("--level", action="append", default=[], help="レベル (複数指定可、省略時は全レベル)")
+    parser.add_argument("--sets", type=int, default=1, help="セット数")
+    parser.add_argument("--per-chapter", type=int, default=None, help="1セットあたり各章で作る問題数 (省略時は設定の配分)")
+    parser.add_argument("--chapter", action="append", default=[], metavar="章番号=問題数", help="章ごとの1セットあたりの問題数 (指定した章だけ作る)")
+    parser.add_argument("--batch", action="store_true", help="まとめて生成モード")
+    parser.add_argument("--fan-out", type=int, default=None, metavar="問題数", help="レベルごとの合計問題数を、実績の処理能力に比例して --model の各モデルに振り分ける")
+    parser.add_argument("--fill-gaps", action="store_true", help="章ごとの目標在庫 (出題数 × --depth) に足りない分だけを作る")
+    parser.add_argument("--depth", type=int, default=None, help="--fill-gaps の目標在庫の倍率 (既定 generator_logic.DEFAULT_DEPTH_FACTOR)")
+    parser.add_argument("--pooled", action="store_true", help="--fill-gaps で全モデル合計の在庫に対する不足を各モデルに振り分ける")
+    parser.add_argument("--job-file", help="ジョブファイル (JSON)")
+    parser.add_argument("--parallel", type=int, default=None, help="並行に実行する (モデル, レベル) の数 (既定 1)")
+    parser.add_argument("--api-key", help="APIキー (省略時は GEMINI_API_KEY / GOOGLE_API_KEY / apikey.txt)")
+    parser.add_argument("--wait-lock", type=float, default=0, help="別の実行が終わるのを待つ秒数 (既定は待たずに終了)")
+    parser.add_argument("--dry-run", action="store_true", help="実行単位を表示するだけで生成しない")
+    args = parser.parse_args(argv)
+
+    # 標準出力はイベント専用にし、ログ (print) は標準エラーへ回す
+    progress = ProgressWriter(sys.stdout)
+    sys.stdout = sys.stderr
+
+    try:
+        parallel = args.parallel
+        if args.job_file:
+            with open(args.job_file, 'r', encoding='utf-8-sig') as f:
+                spec = json.load(f)
+            jobs = spec.get("jobs", []) if isinstance(spec, dict) else spec
+            if parallel is None and isinstance(spec, dict): parallel = spec.get("parallel")
+        else:
+            targets = parse_chapter_targets(args.chapter)
+            jobs = [{
+                "model": m, "levels": args.level or None, "sets": args.sets, "batch": args.batch,
+                "per_chapter": args.per_chapter, "targets": {lv: targets for lv in (args.level or exam_config.get_config().levels)} if targets else None,
+            } for m in args.model]
+            if args.fan_out is not None:
+                jobs = [{"models": args.model, "levels": args.level or None, "batch": args.batch, "fan_out": args.fan_out}]
+            elif args.fill_gaps:
+                import generator_logic
+                jobs = [{"models": args.model, "levels": args.level or None, "batch": args.batch, "pooled": args.pooled,
+                         "fill_gaps": args.depth or generator_logic.DEFAULT_DEPTH_FACTOR}]
+        units = build_units(jobs)
+    except (OSError, ValueError) as e:
+        progress.emit("error", error=str(e))
+        return EXIT_USAGE
+    parallel = int(parallel or 1)
+    if not units:
+        if jobs and all(job.get("fill_gaps") is not None for job in jobs):
+            # 補充の必要が無いのは正常終了 (cron から毎回呼ばれる)
+            progress.emit("done", units=0, failed=0, elapsed_sec=0.0)
+            return EXIT_OK
+        progress.emit("error", error="生成する問題がありません (--model またはジョブファイルを指定してください)")
+        return EXIT_USAGE
+    progress.emit("plan", parallel=parallel, units=[{k: u[k] for k in ("model", "level", "sets", "batch", "planned")} for u in units])
+    if args.dry_run: return EXIT_OK
+
+    api_key = load_api_key(args.api_key)
+    if not api_key:
+        progress.emit("error", error="APIキーがありません")
+        return EXIT_USAGE
+
+    t0 = time.time()
+    try:
+        with storage.file_lock(LOCK_PATH, timeout=args.wait_lock):
+            if any(job.get("fill_gaps") is not None for job in jobs):
+                # ロック待ちの間に別の実行が補充したかもしれないため、在庫を読み直して計画し直す
+                units = build_units(jobs)
+                progress.emit("plan", parallel=parallel, units=[{k: u[k] for k in ("model", "level", "sets", "batch", "planned")} for u in units])
+            results = run_units(units, api_key, parallel, progress)
+    except storage.LockTimeout:
+        progress.emit("locked", lock=os.path.relpath(LOCK_PATH + ".lock", BASE_DIR))
+        return EXIT_LOCKED
+    failed = [r for r in results if not r["ok"]]
+    progress.emit("done", units=len(results), failed=len(failed), elapsed_sec=round(time.time() - t0, 1))
+    return EXIT_FAILED if failed else EXIT_OK
+
+if __name__ == "__main__":
+    sys.exit(main())
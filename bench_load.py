@@ -0,0 +1,302 @@
+import os
+import sys
+import json
+import glob
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import threading
+import subprocess
+import logger  # 共通ログを使用
+import storage
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.path.join(BASE_DIR, "data")
+RESULT_FILE = os.path.join(DATA_DIR, "bench_load.jsonl")
+
+# 模擬試験の同時受験の負荷試験
+# 作業用フォルダにアプリ一式と合成した問題データを用意し、別プロセス (--procs 個) の中で
+# N スレッドのユーザーが Streamlit の AppTest で MENU → EXAM (全問回答) → RESULT をたどる。
+# キャッシュはプロセス内で、データファイルとそのロックは全プロセスで共有される。
+# AppTest は同じプロセス内で同時に実行できないため、同じプロセスのユーザーの再実行は1つずつ順番に処理される
+# (= 直列化された N 人であり、1プロセスの結果はロックの競合の指標にならない)。
+# 実際に同時に動くのはプロセスの数までなので、ファイルロック・キャッシュの競合を見るには --procs をユーザー数まで増やす。
+# ステップの遅延は直列化の待ち時間込み、exec は再実行そのものの時間。
+# 実データ (data/) には触れない。結果は処理能力・ステップ別の遅延 (p50/p95/p99)・プロセスのメモリを報告する。
+
+APP_FILES = ["*.py", "exam_config.json"]
+APP_DIRS = ["components", ".streamlit"]
+CORPUS_MODELS = ["bench-model-a", "bench-model-b"]
+STEPS = ["menu", "start", "answer", "next", "finish"]
+
+def make_workspace(per_chapter):
+    """
+    アプリ一式をコピーし、data/ に合成の問題データを作った作業用フォルダのパスを返す
+    """
+    work = tempfile.mkdtemp(prefix="drone_load_")
+    for pattern in APP_FILES:
+        for path in glob.glob(os.path.join(BASE_DIR, pattern)):
+            shutil.copy2(path, work)
+    for name in APP_DIRS:
+        src = os.path.join(BASE_DIR, name)
+        if os.path.isdir(src): shutil.copytree(src, os.path.join(work, name))
+    make_corpus(os.path.join(work, "data"), per_chapter)
+    return work
+
+def make_corpus(data_dir, per_chapter):
+    """
+    モデル × レベル × 章ごとに per_chapter 問の合成問題ファイルを作る (章構成は exam_config.json に従う)
+    """
+    os.makedirs(data_dir, exist_ok=True)
+    with open(os.path.join(BASE_DIR, "exam_config.json"), 'r', encoding='utf-8') as f:
+        config = json.load(f)
+    rng = random.Random(0)
+    total = 0
+    for model in CORPUS_MODELS:
+        for level, cfg in config.items():
+            if not isinstance(cfg, dict): continue
+            for ch_num, chapter in enumerate(cfg.get("weights", {}), start=1):
+                num = chapter.split("章")[0].replace("第", "") or str(ch_num)
+                qs = [{
+                    "id": i + 1, "level": level, "chapter": chapter,
+                    "question": f"[{model}] {chapter} 合成問題{i + 1}: 次の記述のうち正しいものはどれか。",
+                    "options": {k: f"選択肢{k} ({rng.randint(0, 9999)})" for k in ("1", "2", "3")},
+                    "answer": str(rng.randint(1, 3)),
+                    "explanation": f"合成問題{i + 1}の解説。" * 3,
+                } for i in range(per_chapter)]
+                storage.atomic_write_json(os.path.join(data_dir, f"db_{model}_{level}_ch{num}.json"), qs, fsync=False)
+                total += len(qs)
+    return total
+
+def _rss_mb():
+    """
+    このプロセスの現在の常駐メモリ (MB)。取得できない環境では None
+    """
+    try:
+        with open("/proc/self/status", 'r') as f:
+            for line in f:
+                if line.startswith("VmRSS:"): return round(int(line.split()[1]) / 1024, 1)
+    except OSError: pass
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+    except ImportError:
+        return None
+
+def _percentiles(values):
+    if not values: return {"count": 0}
+    v = sorted(values)
+    pick = lambda p: logger.percentile(v, p)
+    return {"count": len(v), "p50": round(pick(50), 1), "p95": round(pick(95), 1), "p99": round(pick(99), 1), "max": round(v[-1], 1)}
+
+_run_lock = threading.Lock()  # AppTest の再実行を直列化する
+
+def _wait_barrier(barrier, procs, timeout):
+    """
+    全ワーカープロセスの準備 (起動・初回の読み込み) ができるまで待つ (barrier フォルダに準備済みの印を置く)
+    """
+    os.makedirs(barrier, exist_ok=True)
+    open(os.path.join(barrier, f"ready-{os.getpid()}"), 'w').close()
+    deadline = time.time() + timeout
+    while len(os.listdir(barrier)) < procs and time.time() < deadline:
+        time.sleep(0.05)
+
+def _simulate_user(user_no, rounds, level, practice, timeout, samples, errors, lock):
+    from streamlit.testing.v1 import AppTest
+    rng = random.Random(user_no)
+
+    def step(name, fn):
+        t0 = time.perf_counter()
+        with _run_lock:
+            t1 = time.perf_counter()
+            try:
+                at = fn()
+            except Exception as e:
+                with lock: errors.append(f"user{user_no} {name}: {e}")
+                raise
+        t2 = time.perf_counter()
+        with lock:
+            samples[name].append((t2 - t0) * 1000)
+            samples["exec"].append((t2 - t1) * 1000)
+            if at.exception: errors.append(f"user{user_no} {name}: {at.exception[0].value}")
+        return at
+
+    for _ in range(rounds):
+        at = AppTest.from_file(os.path.join(BASE_DIR, "main_ui.py"), default_timeout=timeout)
+        at = step("menu", at.run)
+        if at.exception: return
+        at.text_input[0].set_value(f"load{user_no}")
+        [r for r in at.radio if r.label == "試験タイプ"][0].set_value(level)
+        at.checkbox[0].set_value(not practice)
+        at = step("start", [b for b in at.button if b.label == "試験開始"][0].click().run)
+        while at.session_state.exam_state == "EXAM" and not at.exception:
+            choice = f"{rng.randint(1, 3)}. "
+            buttons = [b for b in at.button if b.label.startswith(choice)]
+            if not buttons: break
+            last = at.session_state.current_index + 1 >= len(at.session_state.questions)
+            at = step("finish" if last and not practice else "answer", buttons[0].click().run)
+            if practice:
+                nexts = [b for b in at.button if b.label.startswith("次へ")]
+                if not nexts: break
+                at = step("finish" if last else "next", nexts[0].click().run)
+        if at.session_state.exam_state != "RESULT":
+            with lock: errors.append(f"user{user_no}: ended in {at.session_state.exam_state}")
+
+def run_load(users, rounds, level, practice, timeout, user_offset=0, barrier=None, procs=1):
+    """
+    (作業用フォルダの中で呼ぶ) users 人が rounds 回ずつ受験し、結果の dict を返す。
+    複数プロセスで実行する場合は barrier で開始をそろえ、まとめて集計するための生の計測値 (raw) も返す
+    """
+    import data_cache
+    samples = {name: [] for name in STEPS + ["exec"]}
+    errors = []
+    lock = threading.Lock()
+    # 起動直後のメモリを基準にする (Streamlit とアプリの読み込み分)
+    from streamlit.testing.v1 import AppTest
+    with _run_lock: AppTest.from_file(os.path.join(BASE_DIR, "main_ui.py"), default_timeout=timeout).run()
+    rss_start = _rss_mb()
+    rss_peak = rss_start
+    stop = threading.Event()
+    def sample_memory():
+        nonlocal rss_peak
+        while not stop.wait(0.2):
+            rss = _rss_mb()
+            if rss is not None and (rss_peak is None or rss > rss_peak): rss_peak = rss
+
+    sampler = threading.Thread(target=sample_memory, daemon=True)
+    sampler.start()
+    if barrier: _wait_barrier(barrier, procs, timeout * 5)
+    t0 = time.perf_counter()
+    def user_thread(u):
+        try: _simulate_user(u, rounds, level, practice, timeout, samples, errors, lock)
+        except Exception: pass  # 記録済み。このユーザーだけ中断する
+    threads = [threading.Thread(target=user_thread, args=(u,)) for u in range(user_offset, user_offset + users)]
+    for t in threads: t.start()
+    for t in threads: t.join()
+    wall = time.perf_counter() - t0
+    stop.set()
+
+    reruns = len(samples["exec"])
+    exams = len(samples["finish"])
+    spans = logger.get_metrics()["histograms"]
+    return {
+        "users": users, "procs": 1, "rounds": rounds, "level": level, "mode": "practice" if practice else "real",
+        "questions": sum(e["count"] for e in data_cache.get_catalog().values()),
+        "wall_sec": round(wall, 2),
+        "exams_per_min": round(exams / wall * 60, 2) if wall else None,
+        "reruns_per_sec": round(reruns / wall, 2) if wall else None,
+        "steps": {name: _percentiles(v) for name, v in samples.items() if v},
+        "spans": {k: v for k, v in spans.items() if k.startswith(("quiz.", "render.", "cache."))},
+        "rss_start_mb": rss_start, "rss_peak_mb": rss_peak,
+        "errors": errors[:20], "error_count": len(errors),
+        "raw": samples if barrier else None,
+    }
+
+def merge_results(results):
+    """
+    ワーカープロセスごとの結果をまとめる。ステップの分位点は全プロセスの生の計測値から求め直し、
+    メモリは合計、スパンの分位点はプロセスごとの値の最大を使う
+    """
+    if len(results) == 1: return dict(results[0], raw=None)
+    samples = {}
+    for r in results:
+        for name, v in (r["raw"] or {}).items(): samples.setdefault(name, []).extend(v)
+    wall = max(r["wall_sec"] for r in results)
+    reruns = len(samples.get("exec", []))
+    exams = len(samples.get("finish", []))
+    spans = {}
+    for r in results:
+        for k, v in r["spans"].items():
+            m = spans.setdefault(k, {"count": 0, "p50": 0, "p95": 0})
+            m["count"] += v["count"]
+            m["p50"], m["p95"] = max(m["p50"], v["p50"]), max(m["p95"], v["p95"])
+    rss = lambda key: round(sum(r[key] for r in results), 1) if all(r[key] is not None for r in results) else None
+    return dict(results[0],
+        users=sum(r["users"] for r in results), procs=len(results),
+        wall_sec=wall,
+        exams_per_min=round(exams / wall * 60, 2) if wall else None,
+        reruns_per_sec=round(reruns / wall, 2) if wall else None,
+        steps={name: _percentiles(v) for name, v in samples.items() if v},
+        spans=spans,
+        rss_start_mb=rss("rss_start_mb"), rss_peak_mb=rss("rss_peak_mb"),
+        errors=[e for r in results for e in r["errors"]][:20],
+        error_count=sum(r["error_count"] for r in results),
+        raw=None,
+    )
+
+def print_report(r):
+    print(f"同時ユーザー {r['users']}人 × {r['rounds']}回 ({r['level']}, {r['mode']}) / 問題数 {r['questions']}")
+    print(f"実行: {r['procs']}プロセス (同じプロセス内の再実行は直列化されるため、同時に動くのは最大{r['procs']}件)")
+    print(f"所要 {r['wall_sec']}s  受験 {r['exams_per_min']}回/分  再実行 {r['reruns_per_sec']}回/秒")
+    print(f"メモリ {r['rss_start_mb']}MB → 最大 {r['rss_peak_mb']}MB")
+    print(f"{'ステップ':<10}{'回数':>8}{'p50(ms)':>10}{'p95(ms)':>10}{'p99(ms)':>10}{'max(ms)':>10}")
+    for name, s in r["steps"].items():
+        print(f"{name:<10}{s['count']:>8}{s['p50']:>10}{s['p95']:>10}{s['p99']:>10}{s['max']:>10}")
+    for name, s in sorted(r["spans"].items()):
+        print(f"    {name:<28}{s['count']:>8}{s['p50']:>10}{s['p95']:>10}")
+    if r["error_count"]:
+        print(f"❌ エラー {r['error_count']}件")
+        for e in r["errors"]: print(f"    {e}")
+
+def record(result):
+    storage.append_line(RESULT_FILE, json.dumps({"ts": time.strftime("%Y-%m-%d %H:%M:%S"), "result": result}, ensure_ascii=False))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="模擬試験の同時受験をシミュレートして処理能力・遅延・メモリを計測する")
+    parser.add_argument("--users", type=int, default=10, help="同時ユーザー数")
+    parser.add_argument("--procs", type=int, default=1, help="ユーザーを振り分けるプロセス数 (同じプロセス内の再実行は直列化される。ロックの競合を見るにはユーザー数まで増やす)")
+    parser.add_argument("--rounds", type=int, default=1, help="1ユーザーあたりの受験回数")
+    parser.add_argument("--per-chapter", type=int, default=200, help="合成データの 1ファイル (モデル×レベル×章) あたりの問題数")
+    parser.add_argument("--level", default="二等", help="受験するレベル")
+    parser.add_argument("--practice", action="store_true", help="練習モード (回答ごとに解説 → 次へ) で受験する")
+    parser.add_argument("--timeout", type=float, default=60, help="1回の再実行のタイムアウト秒")
+    parser.add_argument("--keep", action="store_true", help="作業用フォルダを削除しない")
+    parser.add_argument("--json", action="store_true", help="結果をJSONで出力")
+    parser.add_argument("--record", action="store_true", help=f"結果を {os.path.relpath(RESULT_FILE, BASE_DIR)} に追記")
+    parser.add_argument("--run", action="store_true", help=argparse.SUPPRESS)  # 作業用フォルダ内での実行 (内部用)
+    parser.add_argument("--user-offset", type=int, default=0, help=argparse.SUPPRESS)
+    parser.add_argument("--barrier", default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        # 作業用フォルダのコピーとして実行されている: 計測して結果を JSON で標準出力へ
+        res = run_load(args.users, args.rounds, args.level, args.practice, args.timeout,
+                       user_offset=args.user_offset, barrier=args.barrier, procs=args.procs)
+        print("--RESULT--" + json.dumps(res, ensure_ascii=False))
+        sys.exit(0)
+
+    work = make_workspace(args.per_chapter)
+    logger.log(f"Workspace: {work}", "BENCH")
+    try:
+        # ユーザーをプロセスに振り分け、全プロセスの準備ができてから同時に開始する
+        procs = max(1, min(args.procs, args.users))
+        counts = [args.users // procs + (1 if i < args.users % procs else 0) for i in range(procs)]
+        barrier = os.path.join(work, "barrier") if procs > 1 else None
+        workers = []
+        for i, n in enumerate(counts):
+            cmd = [sys.executable, os.path.join(work, "bench_load.py"), "--run",
+                   "--users", str(n), "--user-offset", str(sum(counts[:i])), "--procs", str(procs),
+                   "--rounds", str(args.rounds), "--level", args.level, "--timeout", str(args.timeout)]
+            if args.practice: cmd.append("--practice")
+            if barrier: cmd += ["--barrier", barrier]
+            workers.append(subprocess.Popen(cmd, cwd=work, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                            text=True, encoding="utf-8", errors="replace"))
+        results = []
+        for w in workers:
+            out, err = w.communicate()
+            marker = out.rfind("--RESULT--")
+            if w.returncode != 0 or marker < 0:
+                print(err[-3000:], file=sys.stderr)
+                sys.exit(2)
+            results.append(json.loads(out[marker + len("--RESULT--"):].strip()))
+        res = merge_results(results)
+    finally:
+        if not args.keep: shutil.rmtree(work, ignore_errors=True)
+
+    if args.json: print(json.dumps(res, ensure_ascii=False, indent=2))
+    else: print_report(res)
+    if args.record: record(res)
+    sys.exit(1 if res["error_count"] else 0)
@@ -0,0 +1,144 @@
+import os
+import ast
+import sys
+import json
+import time
+import argparse
+import subprocess
+import logger  # 共通ログを使用
+import storage
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.path.join(BASE_DIR, "data")
+RESULT_FILE = os.path.join(DATA_DIR, "bench_startup.jsonl")
+MAIN_UI_FILE = os.path.join(BASE_DIR, "main_ui.py")
+
+def startup_imports(path=MAIN_UI_FILE):
+    """
+    main_ui がモジュールの先頭レベルで import するモジュール (ルーティング分岐内の遅延 import は含めない)
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        tree = ast.parse(f.read(), path)
+    modules = []
+    for node in tree.body:
+        if isinstance(node, ast.Import):
+            modules += [a.name for a in node.names]
+        elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+            modules.append(node.module)
+    return [m for i, m in enumerate(modules) if m not in modules[:i]]
+
+# 計測対象: (名前, importするモジュール, 予算ms)。予算は実測 (data_cache の numpy 遅延読み込み後) のおよそ2倍
+# 「起動時」は main_ui が先頭で読み込むもの (main_ui.py から求める)。各画面はページ選択時に追加で読み込まれる。
+TARGETS = [
+    ("起動時 (main_ui)", startup_imports(), 600),
+    ("📚 模擬試験", ["view_exam"], 200),
+    ("📈 学習分析", ["view_analytics"], 1000),
+    ("📝 問題作成", ["view_generator"], 2500),
+    ("📊 データ管理・保守", ["view_manager"], 1000),
+]
+RERUN_LOOPS = 1000
+
+def parse_importtime(stderr_text):
+    """
+    python -X importtime の出力を解析し [(module, self_us, cumulative_us, depth)] を返す
+    """
+    rows = []
+    for line in stderr_text.splitlines():
+        if not line.startswith("import time:"): continue
+        parts = line[len("import time:"):].split("|")
+        if len(parts) != 3: continue
+        try:
+            self_us = int(parts[0].strip())
+            cum_us = int(parts[1].strip())
+        except ValueError:
+            continue  # ヘッダ行
+        name = parts[2].rstrip()
+        depth = (len(name) - len(name.lstrip(" "))) // 2
+        rows.append((name.strip(), self_us, cum_us, depth))
+    return rows
+
+def measure_cold(modules, preload=()):
+    """
+    新しいプロセスで modules を import し、importtime の内訳を返す。
+    preload は計測前に読み込み済みとするモジュール (起動時に読み込まれる分を差し引く)
+    """
+    code = "; ".join([f"import {m}" for m in preload] + ["import sys; sys.stderr.write('--MARK--\\n')"] + [f"import {m}" for m in modules])
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=BASE_DIR, capture_output=True, text=True, encoding="utf-8", errors="replace"
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else "import failed")
+    after_mark = proc.stderr.split("--MARK--", 1)[-1]
+    rows = parse_importtime(after_mark)
+    total_us = sum(cum for _, _, cum, depth in rows if depth == 0)
+    return total_us, rows
+
+def measure_rerun(modules):
+    """
+    読み込み済みモジュールを再度 import するコスト (Streamlit再実行時の相当分) を μs/回 で返す
+    """
+    code = (
+        "import importlib, time\n"
+        f"mods = {list(modules)!r}\n"
+        "for m in mods: importlib.import_module(m)\n"
+        "t = time.perf_counter()\n"
+        f"for _ in range({RERUN_LOOPS}):\n"
+        "    for m in mods: importlib.import_module(m)\n"
+        f"print((time.perf_counter() - t) / {RERUN_LOOPS} * 1e6)\n"
+    )
+    proc = subprocess.run([sys.executable, "-c", code], cwd=BASE_DIR, capture_output=True, text=True)
+    if proc.returncode != 0: return None
+    try: return float(proc.stdout.strip())
+    except ValueError: return None
+
+def run_benchmark(top=5):
+    results = []
+    startup_modules = TARGETS[0][1]
+    for i, (name, modules, budget_ms) in enumerate(TARGETS):
+        preload = () if i == 0 else startup_modules
+        try:
+            total_us, rows = measure_cold(modules, preload)
+        except Exception as e:
+            logger.log(f"{name}: 計測失敗 ({e})", "BENCH")
+            results.append({"name": name, "modules": modules, "error": str(e)})
+            continue
+        heaviest = sorted((r for r in rows if r[3] <= 1), key=lambda r: r[2], reverse=True)[:top]
+        results.append({
+            "name": name,
+            "modules": modules,
+            "cold_ms": round(total_us / 1000, 1),
+            "rerun_us": measure_rerun(modules),
+            "budget_ms": budget_ms,
+            "over_budget": total_us / 1000 > budget_ms,
+            "heaviest": [{"module": m, "cumulative_ms": round(c / 1000, 1)} for m, _, c, _ in heaviest],
+        })
+    return results
+
+def print_report(results):
+    print(f"{'ページ':<24}{'cold(ms)':>10}{'rerun(us)':>11}{'budget':>9}")
+    for r in results:
+        if "error" in r:
+            print(f"{r['name']:<24}{'ERROR':>10}  {r['error']}")
+            continue
+        rerun = f"{r['rerun_us']:.1f}" if r['rerun_us'] is not None else "-"
+        mark = " ❌" if r['over_budget'] else ""
+        print(f"{r['name']:<24}{r['cold_ms']:>10.1f}{rerun:>11}{r['budget_ms']:>9}{mark}")
+        for h in r['heaviest']:
+            print(f"    {h['cumulative_ms']:>8.1f} ms  {h['module']}")
+
+def record(results):
+    storage.append_line(RESULT_FILE, json.dumps({"ts": time.strftime("%Y-%m-%d %H:%M:%S"), "results": results}, ensure_ascii=False))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="起動時・ページ別の import コストを計測する (python -X importtime 形式)")
+    parser.add_argument("--json", action="store_true", help="結果をJSONで出力")
+    parser.add_argument("--record", action="store_true", help=f"結果を {os.path.relpath(RESULT_FILE, BASE_DIR)} に追記")
+    parser.add_argument("--top", type=int, default=5, help="表示する重いモジュールの件数")
+    args = parser.parse_args()
+
+    res = run_benchmark(args.top)
+    if args.json: print(json.dumps(res, ensure_ascii=False, indent=2))
+    else: print_report(res)
+    if args.record: record(res)
+    sys.exit(1 if any(r.get("over_budget") for r in res) else 0)
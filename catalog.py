@@ -0,0 +1,124 @@
+import os
+import glob
+import json
+import time
+import hashlib
+import logger
+import storage
+
+# 問題ファイルのカタログ (data/catalog.json)
+# db_*.json ごとに モデル・レベル・章・問題数・ID範囲・内容ハッシュ・更新時刻 を保持する。
+# 問題ファイルを書き換える処理はファイルのロックを持ったまま record() を呼び、カタログも同時に更新する。
+# 読み出し側は stat だけで鮮度を確認し、外部で書き換えられたファイルだけを読み直す。
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.path.join(BASE_DIR, "data")
+MANIFEST_FILE = os.path.join(DATA_DIR, "catalog.json")
+
+def list_db_files():
+    files = glob.glob(os.path.join(DATA_DIR, "db_*.json"))
+    return sorted(f for f in files if os.path.basename(f) != "db_status.json")
+
+def parse_db_filename(fname):
+    """
+    db_{model}_{level}_{chapter}.json を (model, level, chapter) に分解する。
+    モデル名にアンダースコアが含まれても崩れないよう後ろから解析する (カタログに無いファイル用)
+    """
+    core_name = fname[3:-5]  # "db_" と ".json" を除く
+    parts = core_name.split('_')
+    if len(parts) >= 3:
+        return "_".join(parts[:-2]), parts[-2], parts[-1]
+    return "unknown", None, None
+
+def _stat_key(path):
+    st = os.stat(path)
+    return st.st_mtime_ns, st.st_size
+
+def _describe(path, data, text, known=None):
+    """
+    問題リストとファイル内容からカタログの1エントリを作る
+    """
+    fname = os.path.basename(path)
+    known = known or {}
+    model, level, chapter = parse_db_filename(fname)
+    mtime_ns, size = _stat_key(path)
+    ids = [q["id"] for q in data if isinstance(q, dict) and isinstance(q.get("id"), int)] if isinstance(data, list) else []
+    return {
+        "model": known.get("model") or model,
+        "level": known.get("level") or level,
+        "chapter": known.get("chapter") or chapter,
+        "count": len(data) if isinstance(data, list) else 0,
+        "id_min": min(ids) if ids else None,
+        "id_max": max(ids) if ids else None,
+        "hash": hashlib.sha1(text.encode("utf-8")).hexdigest(),
+        "mtime_ns": mtime_ns,
+        "size": size,
+    }
+
+def record(path, data, text=None, model=None, level=None, chapter=None):
+    """
+    問題ファイルを書き込んだ直後に呼ぶ (そのファイルのロックを持ったまま呼ぶこと)。
+    text は書き込んだ内容 (省略時はファイルから読む)。model 等を省略した場合は既存エントリ → ファイル名の順で補う
+    """
+    if text is None:
+        with open(path, 'r', encoding='utf-8') as f: text = f.read()
+    fname = os.path.basename(path)
+    def update(manifest):
+        manifest = manifest or {}
+        files = manifest.setdefault("files", {})
+        known = dict(files.get(fname) or {})
+        known.update({k: v for k, v in (("model", model), ("level", level), ("chapter", chapter)) if v})
+        files[fname] = _describe(path, data, text, known)
+        manifest["updated_at"] = time.strftime("%Y-%m-%d %H:%M:%S")
+        return manifest
+    try:
+        storage.update_json(MANIFEST_FILE, update, default={})
+    except Exception as e:
+        # カタログはファイルの stat から自己修復できるため、書き込み自体は失敗させない
+        logger.error(e, f"Catalog update failed {fname}")
+
+def get_entries():
+    """
+    {ファイル名: エントリ} を返す。stat が一致するエントリはそのまま使い、
+    カタログに無い・外部で変更された問題ファイルだけを読み直してカタログを直す
+    """
+    manifest = storage.read_json(MANIFEST_FILE, {}) or {}
+    files = manifest.get("files", {})
+    entries = {}
+    stale = []
+    for path in list_db_files():
+        fname = os.path.basename(path)
+        entry = files.get(fname)
+        try:
+            key = _stat_key(path)
+        except OSError:
+            continue
+        if entry and (entry.get("mtime_ns"), entry.get("size")) == key:
+            entries[fname] = entry
+        else:
+            stale.append(path)
+    removed = set(files) - set(entries) - {os.path.basename(p) for p in stale}
+
+    if stale or removed:
+        rebuilt = {}
+        for path in stale:
+            fname = os.path.basename(path)
+            try:
+                with open(path, 'r', encoding='utf-8') as f: text = f.read()
+                rebuilt[fname] = _describe(path, json.loads(text), text, files.get(fname))
+            except Exception as e:
+                logger.error(e, f"Catalog scan failed {fname}")
+        logger.log(f"Catalog refreshed: {len(rebuilt)} rescanned, {len(removed)} removed", "CATALOG")
+        def update(manifest):
+            manifest = manifest or {}
+            cur = manifest.setdefault("files", {})
+            for fname in removed: cur.pop(fname, None)
+            for fname, entry in rebuilt.items():
+                # 読み直しの間に書き込み側が新しいエントリを記録していたらそちらを残す
+                if cur.get(fname, {}).get("mtime_ns", 0) <= entry["mtime_ns"]: cur[fname] = entry
+            manifest["updated_at"] = time.strftime("%Y-%m-%d %H:%M:%S")
+            return manifest
+        try: storage.update_json(MANIFEST_FILE, update, default={})
+        except Exception as e: logger.error(e, "Catalog update failed")
+        entries.update(rebuilt)
+    return entries
@@ -1,16 +1,23 @@
 import os
 import json
-import glob
 import logger  # 共通ログを使用
+import data_cache
+import storage
+import catalog
+import question_schema
+import grounding
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 DATA_DIR = os.path.join(BASE_DIR, "data")
 STATUS_FILE = os.path.join(DATA_DIR, "db_status.json")
+GROUNDING_STATUS_FILE = os.path.join(DATA_DIR, "grounding_status.json")  # 教則との照合結果 (不備とは別の参考情報)
 
+@logger.span("check.check_and_clean")
 def check_and_clean(silent=True):
     logger.log("Starting DB Check...", "CHECK")
     logs = []
     error_details = []
+    grounding_flags = []
     
     def log(msg):
         if not silent: print(msg)
@@ -20,54 +27,21 @@ def check_and_clean(silent=True):
         logger.log("Data dir missing", "ERROR")
         return ["❌ 'data' フォルダが見つかりません。"], 0, []
 
-    files = glob.glob(os.path.join(DATA_DIR, "*.json"))
-    files = [f for f in files if "db_status.json" not in f]
+    files = catalog.list_db_files()
     
     if not files:
         return ["⚠️ データベースファイル(.json)がありません。"], 0, []
 
     total_fixed = 0
+    grounding.get_index()  # 照合用インデックスの準備 (初回のみ PDF から作成)
 
     for filepath in files:
         filename = os.path.basename(filepath)
         try:
-            with open(filepath, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-            
-            if not isinstance(data, list): continue
-
-            ids = [q['id'] for q in data if 'id' in q and isinstance(q['id'], int)]
-            max_id = max(ids) if ids else 0
-            file_modified = False
-            
-            for q in data:
-                if 'id' not in q:
-                    max_id += 1
-                    q['id'] = max_id
-                    file_modified = True
-                
-                missing = []
-                required = ["question", "options", "answer", "explanation"]
-                for k in required:
-                    if k not in q or not q[k]: missing.append(k)
-                
-                if "options" in q and isinstance(q["options"], dict):
-                    if not q["options"].get("1") or not q["options"].get("2") or not q["options"].get("3"):
-                        missing.append("options(1-3)")
-                elif "options" not in q:
-                    missing.append("options")
-
-                if missing:
-                    error_details.append({
-                        "ファイル名": filename,
-                        "ID": q.get('id', '不明'),
-                        "不備項目": ", ".join(missing),
-                        "状態": "要修正"
-                    })
-
+            # 生成・インポートと並行しても修復結果が失われないよう、ファイル単位でロックする
+            with storage.file_lock(filepath):
+                file_modified = _check_file(filepath, filename, error_details, grounding_flags)
             if file_modified:
-                with open(filepath, 'w', encoding='utf-8') as f:
-                    json.dump(data, f, indent=4, ensure_ascii=False)
                 total_fixed += 1
                 logger.log(f"Fixed ID in {filename}", "CHECK")
 
@@ -80,18 +54,84 @@ def check_and_clean(silent=True):
                 "状態": "読込不可"
             })
 
-    if error_details:
-        try:
-            with open(STATUS_FILE, 'w', encoding='utf-8') as f:
-                json.dump(error_details, f, indent=4, ensure_ascii=False)
-            logger.log(f"Found {len(error_details)} errors", "CHECK")
-        except: pass
-    else:
-        if os.path.exists(STATUS_FILE):
-            os.remove(STATUS_FILE)
-        logger.log("No errors found", "CHECK")
+    storage.cleanup_temp_files(DATA_DIR)
+    changed = total_fixed > 0
+    try:
+        changed |= _save_status(STATUS_FILE, error_details)
+    except Exception as e:
+        logger.error(e, "DB status save failed")
+    logger.log(f"Found {len(error_details)} errors" if error_details else "No errors found", "CHECK")
+    # 照合結果は推定なので不備 (error_details) には含めず、別ファイルに保存する
+    try:
+        changed |= _save_status(GROUNDING_STATUS_FILE, grounding_flags)
+        if grounding_flags: logger.log(f"Grounding flags: {len(grounding_flags)}", "CHECK")
+    except Exception as e:
+        logger.error(e, "Grounding status save failed")
 
+    # 修復・診断結果が変わったときだけキャッシュに反映させる (バージョンを変えると問題プール・索引・作り置きの試験も作り直しになる)
+    if changed: data_cache.bump_data_version("check")
     return logs, total_fixed, error_details
 
+def _save_status(path, rows):
+    """
+    診断結果を保存する (空ならファイルを消す)。内容が変わった場合 True を返す
+    """
+    try: old = storage.read_json(path, None)
+    except Exception: old = False  # 読めないファイルは書き直す
+    if old == (rows or None): return False
+    if rows: storage.atomic_write_json(path, rows)
+    else: storage.remove_file(path)
+    return True
+
+def _check_file(filepath, filename, error_details, grounding_flags):
+    """
+    1ファイルを診断し、IDの自動付与を行った場合は書き戻して True を返す (ロック下で呼ぶこと)。
+    スキーマ・構造の不備は error_details に、教則との照合で疑いのある問題は grounding_flags に追加する
+    """
+    with open(filepath, 'r', encoding='utf-8') as f:
+        text = f.read()
+    data = json.loads(text)
+    
+    if not isinstance(data, list): return False
+
+    ids = [q['id'] for q in data if 'id' in q and isinstance(q['id'], int)]
+    max_id = max(ids) if ids else 0
+    file_modified = False
+    
+    for q in data:
+        if 'id' not in q:
+            max_id += 1
+            q['id'] = max_id
+            file_modified = True
+        
+        # 生成時と同じスキーマで検証する
+        missing = question_schema.validate_question(q)
+        if missing:
+            error_details.append({
+                "ファイル名": filename,
+                "ID": q.get('id', '不明'),
+                "不備項目": ", ".join(missing),
+                "状態": "要修正"
+            })
+
+    # 教則PDFと照合し、指定章から外れた・根拠の見当たらない問題を報告する (ファイルは書き換えない。不備とは別扱い)
+    chapter = grounding.chapter_of(catalog.parse_db_filename(filename)[2])
+    for q, result in zip(data, grounding.check_questions(data, chapter) or []):
+        if not result or not result["flags"]: continue
+        best = f"第{result['best']}章" if result["best"] else "該当なし"
+        for flag in result["flags"]:
+            grounding_flags.append({
+                "ファイル名": filename,
+                "ID": q.get('id', '不明'),
+                "疑い": grounding.FLAG_LABELS[flag],
+                "照合結果": f"最も近い章: {best} (一致度 {result['ratio'] if result['ratio'] is not None else '-'}, 被覆率 {result['coverage']})",
+            })
+
+    if file_modified:
+        text = storage.atomic_write_json(filepath, data)
+    # 読み込んだ (または書き戻した) 内容でカタログを最新にしておく
+    catalog.record(filepath, data, text)
+    return file_modified
+
 if __name__ == "__main__":
     check_and_clean(silent=False)
\ No newline at end of file
@@ -0,0 +1,243 @@
+import os
+import json
+import time
+import threading
+from collections import defaultdict
+import streamlit as st
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+import logger
+import storage
+import exam_config
+import catalog
+# pool_snapshot / search_index は numpy を読み込むため、初回利用時に import する (起動時間を抑える。計測: python bench_startup.py)
+
+# プロセス全体で共有するデータアクセス層
+# 問題プール・在庫統計・設定・DB診断結果をセッション/再実行をまたいでキャッシュする。
+# 無効化は data/data_version.txt のトークン1つで行い、生成・インポート・診断の後に bump_data_version() で更新する。
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.path.join(BASE_DIR, "data")
+STATUS_FILE = os.path.join(DATA_DIR, "db_status.json")
+GROUNDING_STATUS_FILE = os.path.join(DATA_DIR, "grounding_status.json")
+VERSION_FILE = os.path.join(DATA_DIR, "data_version.txt")
+ITEM_STATS_FILE = os.path.join(DATA_DIR, "item_stats.json")
+
+_metrics_lock = threading.Lock()
+_metrics = defaultdict(lambda: {"calls": 0, "miss": 0})
+
+def _count(name, miss=False):
+    with _metrics_lock:
+        _metrics[name]["miss" if miss else "calls"] += 1
+    logger.incr(f"cache.{name}.{'miss' if miss else 'calls'}")
+
+def get_metrics():
+    """
+    キャッシュのヒット/ミス統計を返す {name: {"calls", "hit", "miss", "hit_rate"}}
+    """
+    with _metrics_lock:
+        out = {}
+        for name, m in _metrics.items():
+            hit = max(0, m["calls"] - m["miss"])
+            out[name] = {
+                "calls": m["calls"], "hit": hit, "miss": m["miss"],
+                "hit_rate": round(hit / m["calls"], 3) if m["calls"] else 0.0
+            }
+        return out
+
+# --- スクリプト実行スレッド外からの読み込み ---
+# st.cache_data / st.cache_resource はスクリプト実行スレッドで使う前提のため、
+# exam_queue の補充スレッドやバッチ (CLI) からは、データバージョンをキーにした単純なキャッシュで同じ読み込み関数を使う
+_plain_lock = threading.Lock()
+_plain_cache = {}  # name → (version, value)
+
+def _load(name, loader, version):
+    """
+    loader (st.cache_* で包んだ読み込み関数) の結果を返す。スクリプト実行スレッド外では Streamlit のキャッシュを通さない
+    """
+    if get_script_run_ctx(suppress_warning=True) is not None:
+        return loader(version)
+    with _plain_lock:
+        hit = _plain_cache.get(name)
+        if hit is not None and hit[0] == version:
+            return hit[1]
+    value = loader.__wrapped__(version)
+    with _plain_lock:
+        _plain_cache[name] = (version, value)
+    return value
+
+# --- データバージョン ---
+def get_data_version():
+    try:
+        with open(VERSION_FILE, 'r', encoding='utf-8') as f:
+            return f.read().strip() or "0"
+    except OSError:
+        return "0"
+
+def bump_data_version(reason=""):
+    token = str(time.time_ns())
+    storage.atomic_write_text(VERSION_FILE, token, fsync=False)
+    logger.log(f"Data version -> {token} ({reason})", "CACHE")
+    return token
+
+def question_ref(q):
+    """
+    問題を一意に指す参照キー "{model}|{level}|{章番号}|{id}" を返す (履歴・分析で共通に使う)
+    """
+    ch = exam_config.chapter_num(q.get('chapter', '')) or "X"
+    return f"{q.get('source_model', 'unknown')}|{q.get('level', '')}|{ch}|{q.get('id', '')}"
+
+# --- カタログ ---
+@st.cache_data(show_spinner=False, max_entries=4)
+def _load_catalog(version):
+    _count("catalog", miss=True)
+    return catalog.get_entries()
+
+def get_catalog():
+    """
+    問題ファイルのカタログ {ファイル名: {"model", "level", "chapter", "count", "id_min", "id_max", "hash", ...}} を返す
+    """
+    _count("catalog")
+    return _load("catalog", _load_catalog, get_data_version())
+
+# --- 問題プール ---
+@st.cache_resource(show_spinner=False, max_entries=2)
+@logger.span("cache.load_pool")
+def _load_pool(version):
+    _count("pool", miss=True)
+    logger.log(f"Loading question pool (version={version})...", "CACHE")
+    pool = []
+    _count("catalog")
+    for fname, entry in sorted(_load("catalog", _load_catalog, version).items()):
+        model, level, chapter = entry["model"], entry["level"], entry["chapter"]
+        try:
+            with open(os.path.join(DATA_DIR, fname), 'r', encoding='utf-8') as fp:
+                data = json.load(fp)
+        except Exception as e:
+            logger.error(e, f"Read error {fname}")
+            continue
+        if not isinstance(data, list): continue
+        for q in data:
+            # ★重要: 出典情報をデータに注入する
+            q['source_model'] = model
+        pool.append({"file": fname, "model": model, "level": level, "chapter": chapter, "questions": data})
+    return pool
+
+def get_question_pool():
+    """
+    全問題ファイルの読み込み結果 [{"file", "model", "level", "chapter", "questions"}] を返す。
+    プロセス全体で共有されるため、呼び出し側で問題dictを書き換えないこと (必要ならコピーする)
+    """
+    _count("pool")
+    return _load("pool", _load_pool, get_data_version())
+
+# --- 問題プールのスナップショット (mmap) ---
+@st.cache_resource(show_spinner=False, max_entries=2)
+def _load_snapshot(version):
+    _count("snapshot", miss=True)
+    _count("catalog")
+    try:
+        import pool_snapshot
+        return pool_snapshot.open_snapshot(_load("catalog", _load_catalog, version))
+    except Exception as e:
+        logger.error(e, "Pool snapshot unavailable")
+        return None
+
+def get_pool_snapshot():
+    """
+    問題プールの mmap スナップショット (pool_snapshot.PoolSnapshot) を返す。
+    作成・読み込みに失敗した場合は None (呼び出し側は get_question_pool() に切り替える)
+    """
+    _count("snapshot")
+    return _load("snapshot", _load_snapshot, get_data_version())
+
+# --- 全文検索 ---
+_search_index = None
+_search_index_lock = threading.Lock()
+
+def get_search_index():
+    """
+    問題の全文検索インデックスを返す。データバージョンが変わっていれば、変更のあったファイルだけ索引し直す
+    """
+    global _search_index
+    _count("search_index")
+    if _search_index is None:
+        with _search_index_lock:
+            if _search_index is None:
+                import search_index
+                _search_index = search_index.SearchIndex()
+    version = get_data_version()
+    if _search_index.version != version:
+        _count("search_index", miss=True)
+        _count("catalog")
+        _search_index.refresh(_load("catalog", _load_catalog, version), version)
+    return _search_index
+
+# --- 在庫統計 ---
+@st.cache_data(show_spinner=False, max_entries=4)
+def _load_stock_stats(version):
+    _count("stock_stats", miss=True)
+    _count("catalog")
+    # 問題ファイルは開かず、カタログの件数だけで集計する
+    entries = _load("catalog", _load_catalog, version)
+    stats = defaultdict(lambda: {'total': 0, '二等': 0, '一等': 0})
+    for entry in entries.values():
+        count = entry["count"]
+        model = entry["model"]
+        stats[model]['total'] += count
+        if entry["level"] in stats[model]:
+            stats[model][entry["level"]] += count
+    return {"models": dict(stats), "files": len(entries)}
+
+def get_stock_stats():
+    """
+    {"models": {model: {'total', '二等', '一等'}}, "files": ファイル数} を返す
+    """
+    _count("stock_stats")
+    return _load("stock_stats", _load_stock_stats, get_data_version())
+
+# --- DB診断結果 ---
+@st.cache_data(show_spinner=False, max_entries=4)
+def _load_db_status(version):
+    _count("db_status", miss=True)
+    if os.path.exists(STATUS_FILE):
+        try:
+            with open(STATUS_FILE, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except: pass
+    return []
+
+def get_db_status():
+    _count("db_status")
+    return _load("db_status", _load_db_status, get_data_version())
+
+# --- 教則との照合結果 (DB診断時に作成) ---
+@st.cache_data(show_spinner=False, max_entries=2)
+def _load_grounding_status(version):
+    _count("grounding_status", miss=True)
+    return storage.read_json(GROUNDING_STATUS_FILE, []) or []
+
+def get_grounding_status():
+    """
+    章外・根拠不明の疑いがある問題の一覧 [{"ファイル名", "ID", "疑い", "照合結果"}]
+    """
+    _count("grounding_status")
+    return _load("grounding_status", _load_grounding_status, get_data_version())
+
+# --- 項目分析結果 ---
+@st.cache_data(show_spinner=False, max_entries=2)
+def _load_item_stats(version):
+    _count("item_stats", miss=True)
+    if os.path.exists(ITEM_STATS_FILE):
+        try:
+            with open(ITEM_STATS_FILE, 'r', encoding='utf-8') as f:
+                return json.load(f).get("items", {})
+        except Exception as e:
+            logger.error(e, "Item stats load failed")
+    return {}
+
+def get_item_stats():
+    """
+    item_analysis の結果 {ref: {"n", "p", "r_pb", "choice_rates", "flags", "excluded"}} を返す
+    """
+    _count("item_stats")
+    return _load("item_stats", _load_item_stats, get_data_version())
@@ -0,0 +1,158 @@
+import os
+import time
+import random
+import base64
+import hashlib
+import threading
+import logger
+import storage
+import data_cache
+import quiz_logic
+
+# 試験コード: シード付きで作った試験を短いコード (例: "K7QX-2MPA") で共有・再受験できるようにする。
+# コード → {レベル, モデル, 問題数, シード, データバージョン, 問題の参照キー一覧} を data/exam_codes.json に保存する。
+# 同じシード・同じデータバージョンなら quiz_logic は同じ試験を作るが、データの更新や項目分析 (出題除外の変更) で
+# バージョンが変わると同じシードでも試験は変わる。そのため再受験はシードからは作り直さず、保存した参照キーから問題を引く
+# (コードごとの参照キーとレコード番号はプロセス内でもキャッシュする)。
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.path.join(BASE_DIR, "data")
+CODES_FILE = os.path.join(DATA_DIR, "exam_codes.json")
+MAX_CODES = 5000  # 保存するコード数の上限 (古いものから消す)
+MAX_SEED_TRIES = 5  # コードの衝突時にシードを引き直す回数
+
+_entries = {}  # コード → 保存内容 (作成後は変わらない)
+_resolved = {}  # (コード, スナップショット) → レコード番号の一覧
+_lock = threading.Lock()
+
+def new_seed():
+    return random.getrandbits(32)
+
+def make_code(level, model, count, seed, version):
+    """
+    試験の条件から8文字のコードを作る (Base32、4文字ずつ区切る)
+    """
+    digest = hashlib.sha1(f"{level}|{model}|{count}|{seed}|{version}".encode("utf-8")).digest()
+    code = base64.b32encode(digest[:5]).decode("ascii")
+    return f"{code[:4]}-{code[4:]}"
+
+def normalize_code(code):
+    c = "".join(ch for ch in str(code or "").upper() if ch.isalnum())
+    return f"{c[:4]}-{c[4:]}" if len(c) == 8 else None
+
+def _same_exam(a, b):
+    return all(a.get(k) == b.get(k) for k in ("level", "model", "count", "seed", "data_version", "refs"))
+
+def register(level, model, count, seed, version, questions):
+    """
+    作った試験を保存してコードを返す。別の試験が同じコードを使っていれば (40ビットの衝突) 保存せず None を返す
+    (呼び出し側はシードを引き直して作り直す)
+    """
+    code = make_code(level, model, count, seed, version)
+    entry = {
+        "level": level, "model": model, "count": count, "seed": seed, "data_version": version,
+        "refs": [data_cache.question_ref(q) for q in questions],
+        "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+    }
+    collided = []
+    def update(codes):
+        codes = codes or {}
+        if code in codes:
+            if not _same_exam(codes[code], entry): collided.append(code)
+            return None
+        codes[code] = entry
+        if len(codes) > MAX_CODES:
+            for old in sorted(codes, key=lambda c: codes[c].get("created", ""))[:len(codes) - MAX_CODES]:
+                codes.pop(old, None)
+        return codes
+    with _lock:
+        known = _entries.get(code)
+    if known is not None and not _same_exam(known, entry):
+        collided.append(code)
+    else:
+        try:
+            storage.update_json(CODES_FILE, update, default={})
+        except Exception as e:
+            logger.error(e, "Exam code save failed")
+    if collided:
+        logger.log(f"Exam code collision: {code} (seed={seed})", "WARN")
+        return None
+    with _lock:
+        _entries.setdefault(code, entry)
+    return code
+
+def create(level, count, model, seed=None):
+    """
+    シード付きで試験を作って保存し、(コード, 問題リスト) を返す (問題が無ければ (None, []))。
+    コードが他の試験と衝突した場合はシードを引き直して作り直す
+    """
+    seed = new_seed() if seed is None else seed
+    version = data_cache.get_data_version()
+    for _ in range(MAX_SEED_TRIES):
+        questions = quiz_logic.get_exam_questions(level, count, model, seed=seed)
+        if not questions: return None, []
+        code = register(level, model, count, seed, version, questions)
+        if code is not None: return code, questions
+        seed = new_seed()
+    return None, questions
+
+def get_entry(code):
+    """
+    コードの保存内容 (無ければ None)
+    """
+    code = normalize_code(code)
+    if not code: return None
+    with _lock:
+        entry = _entries.get(code)
+    if entry is None:
+        entry = (storage.read_json(CODES_FILE, {}) or {}).get(code)
+        if entry:
+            with _lock: _entries[code] = entry
+    return entry
+
+def is_outdated(entry):
+    """
+    コードの作成後に問題データが更新されているか (問題は保存した参照キーから引くが、内容の修正・削除が反映されている場合がある)
+    """
+    return entry.get("data_version") != data_cache.get_data_version()
+
+def resolve(code):
+    """
+    コードの試験を (保存内容, 問題リスト) で返す。削除された問題は除く。コードが無ければ (None, [])。
+    「全モデル」の試験は出典 (source_models) も付け直す
+    """
+    entry = get_entry(code)
+    if entry is None: return None, []
+    code = normalize_code(code)
+    all_models = entry.get("model") == quiz_logic.ALL_MODELS
+    snap = data_cache.get_pool_snapshot()
+    if snap is not None:
+        key = (code, snap.path)
+        with _lock: records = _resolved.get(key)
+        if records is None:
+            records = [i for i in snap.lookup(entry["refs"]) if i is not None]
+            with _lock:
+                if len(_resolved) >= MAX_CODES: _resolved.clear()
+                _resolved[key] = records
+        if all_models:
+            questions = [dict(snap.question(i), source_models=snap.source_models(i)) for i in records]
+        else:
+            questions = [snap.question(i) for i in records]
+    else:
+        wanted = set(entry["refs"])
+        if all_models:
+            # 出典の一覧は同じレベルの全モデルの問題から重複をまとめ直して求める
+            candidates = quiz_logic.unique_questions(q for pool_entry in data_cache.get_question_pool()
+                                                     for q in pool_entry["questions"] if q.get('level') == entry["level"])
+        else:
+            candidates = (q for pool_entry in data_cache.get_question_pool() for q in pool_entry["questions"])
+        by_ref = {}
+        for q in candidates:
+            ref = data_cache.question_ref(q)
+            if ref in wanted: by_ref[ref] = q
+        questions = [dict(by_ref[r]) for r in entry["refs"] if r in by_ref]
+    if len(questions) < len(entry["refs"]):
+        logger.log(f"Exam code {code}: {len(entry['refs']) - len(questions)} questions no longer exist", "WARN")
+    if is_outdated(entry):
+        logger.log(f"Exam code {code}: data version changed since creation ({entry.get('data_version')})", "WARN")
+    return entry, questions
@@ -0,0 +1,183 @@
+import os
+import re
+import json
+import string
+import textwrap
+import threading
+import functools
+from collections import namedtuple
+from types import MappingProxyType
+import logger
+
+# 試験設定 (exam_config.json) の読み込み・検証・事前コンパイル
+# 読み込みはプロセスで1回だけ行い、ファイルの更新時刻が変わったときだけ読み直す。
+# 章番号・ファイル名用ID・生成プロンプトは読み込み時に計算済みの不変オブジェクトとして保持する。
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+CONFIG_FILE = os.path.join(BASE_DIR, "exam_config.json")
+
+# 設定ファイルに無い場合の既定値 (章別の出題数には既定値を置かない。無ければ章を問わずランダムに出題する)
+DEFAULT_EXAM_SIZE = {"二等": 50, "一等": 70}
+DEFAULT_TIME_LIMIT_MIN = {"二等": 30, "一等": 75}
+DEFAULT_SCOPE = "基本範囲"
+
+# 生成プロンプト (${count} は呼び出し時に埋める)
+PROMPT_TEMPLATE = textwrap.dedent("""
+    あなたはドローン国家資格(${level})の試験作成者です。
+    PDFの目次や見出しを確認し、「${chapter}」のセクションに書かれている内容のみを使って、三択問題を【${count}問】作成してください。
+
+    【絶対厳守: 出題範囲の限定】
+    ・「${chapter}」以外の章（例えばリスク管理や法律など、他の章の内容）は一切含めないでください。
+    ・その章に書かれていない知識は使わないでください。
+    ・範囲詳細: ${scope}
+
+    【形式】
+    出力は以下のJSON形式のみ。余計な会話は不要。
+    [{"question":"...","options":{"1":"..","2":"..","3":".."},"answer":"1","explanation":"..."}]
+    """)
+
+# 複数章をまとめて生成するプロンプト (${chapters} は呼び出し時に「章ID: 章名 から N問」の一覧を埋める)
+BATCH_PROMPT_TEMPLATE = textwrap.dedent("""
+    あなたはドローン国家資格(${level})の試験作成者です。
+    PDFの目次や見出しを確認し、以下の各章について、その章のセクションに書かれている内容のみを使って三択問題を作成してください。
+    ${chapters}
+
+    【絶対厳守: 出題範囲の限定】
+    ・各問題は指定された章の内容だけから作成し、他の章の内容を混ぜないでください。
+    ・その章に書かれていない知識は使わないでください。
+    ・範囲詳細: ${scope}
+
+    【形式】
+    出力は章ID (例: ch4) をキー、その章の問題の配列を値とするJSONオブジェクトのみ。余計な会話は不要。
+    {"ch4":[{"question":"...","options":{"1":"..","2":"..","3":".."},"answer":"1","explanation":"..."}]}
+    """)
+
+_CHAPTER_RE = re.compile(r'第(\d+)章')
+
+@functools.lru_cache(maxsize=4096)
+def chapter_num(text):
+    """
+    "第4章 ..." → "4" (章番号が無ければ None)
+    """
+    m = _CHAPTER_RE.search(str(text))
+    return m.group(1) if m else None
+
+# name: 章名 (設定のキー), num: 章番号, file_id: ファイル名用ID (ch4), weight: 出題数, prompt: string.Template (${count} のみ未置換)
+Chapter = namedtuple("Chapter", ["name", "num", "file_id", "weight", "prompt"])
+# batch_prompt: string.Template (${chapters} のみ未置換)
+Level = namedtuple("Level", ["name", "description", "scope", "exam_size", "time_limit_min", "chapters", "weights", "batch_prompt"])
+
+class ExamConfig:
+    """
+    検証・コンパイル済みの試験設定 (読み取り専用)
+    """
+    __slots__ = ("_levels", "mtime", "errors")
+
+    def __init__(self, levels, mtime, errors):
+        object.__setattr__(self, "_levels", MappingProxyType(levels))
+        object.__setattr__(self, "mtime", mtime)
+        object.__setattr__(self, "errors", tuple(errors))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("ExamConfig is immutable")
+
+    @property
+    def levels(self):
+        return tuple(self._levels)
+
+    def __contains__(self, level):
+        return level in self._levels
+
+    def level(self, name):
+        """
+        レベルの設定。設定ファイルに無いレベルは既定値から作る
+        """
+        lv = self._levels.get(name)
+        return lv if lv is not None else _default_level(name)
+
+@functools.lru_cache(maxsize=16)
+def _default_level(name):
+    return _compile_level(name, {}, [])
+
+def _compile_level(name, raw, errors):
+    if not isinstance(raw, dict):
+        errors.append(f"{name}: 設定がオブジェクトではありません")
+        raw = {}
+    scope = raw.get("scope_instruction") or DEFAULT_SCOPE
+    weights = raw.get("weights")
+    if not isinstance(weights, dict) or not weights:
+        # 他のレベルの配分で黙って代用せず、章別配分なし (ランダム出題) として問題を報告する
+        errors.append(f"{name}: 章別の出題数 (weights) が設定されていません (章を問わずランダムに出題します)")
+        weights = {}
+    exam_size = raw.get("exam_size", DEFAULT_EXAM_SIZE.get(name))
+    time_limit = raw.get("time_limit_min", DEFAULT_TIME_LIMIT_MIN.get(name))
+
+    chapters = []
+    seen = {}
+    for ch_name, weight in weights.items():
+        num = chapter_num(ch_name)
+        if num is None:
+            errors.append(f"{name}: 章名「{ch_name}」から章番号を読み取れません")
+        elif num in seen:
+            errors.append(f"{name}: 第{num}章が重複しています (「{seen[num]}」と「{ch_name}」)")
+        else:
+            seen[num] = ch_name
+        if not isinstance(weight, int) or isinstance(weight, bool) or weight < 0:
+            errors.append(f"{name}: 「{ch_name}」の出題数 {weight!r} が0以上の整数ではありません")
+            weight = 0
+        prompt = string.Template(string.Template(PROMPT_TEMPLATE).safe_substitute(level=name, chapter=ch_name, scope=scope))
+        chapters.append(Chapter(ch_name, num, f"ch{num}" if num else "chX", weight, prompt))
+
+    total = sum(ch.weight for ch in chapters)
+    if exam_size is None:
+        exam_size = total
+    elif chapters and total != exam_size:
+        errors.append(f"{name}: 出題数の合計 {total} が試験の問題数 {exam_size} と一致しません")
+
+    return Level(
+        name, raw.get("description", name), scope, exam_size, time_limit,
+        tuple(chapters), MappingProxyType({ch.name: ch.weight for ch in chapters}),
+        string.Template(string.Template(BATCH_PROMPT_TEMPLATE).safe_substitute(level=name, scope=scope))
+    )
+
+def compile_config(raw, mtime=0, errors=None):
+    """
+    exam_config.json の内容を検証して ExamConfig にする (問題点は errors に入る)
+    """
+    errors = list(errors or [])
+    levels = {}
+    if not isinstance(raw, dict):
+        errors.append("設定ファイルの最上位がオブジェクトではありません")
+        raw = {}
+    for name, lv_raw in raw.items():
+        levels[name] = _compile_level(name, lv_raw, errors)
+    return ExamConfig(levels, mtime, errors)
+
+_lock = threading.Lock()
+_current = {"mtime": None, "config": None}
+
+def get_config():
+    """
+    現在の設定を返す。ファイルの更新時刻が前回と同じなら読み直さない
+    """
+    try: mtime = os.path.getmtime(CONFIG_FILE)
+    except OSError: mtime = 0
+    with _lock:
+        if _current["config"] is not None and _current["mtime"] == mtime:
+            return _current["config"]
+    raw = {}
+    errors = []
+    if mtime:
+        try:
+            with open(CONFIG_FILE, 'r', encoding='utf-8') as f:
+                raw = json.load(f)
+        except Exception as e:
+            logger.error(e, "Config load failed")
+            errors.append(f"設定ファイルを読み込めません: {e}")
+    config = compile_config(raw, mtime, errors)
+    for err in config.errors:
+        logger.log(f"Config: {err}", "WARN")
+    logger.incr("config.reload")
+    with _lock:
+        _current["mtime"], _current["config"] = mtime, config
+    return config
@@ -0,0 +1,126 @@
+import threading
+from collections import deque
+import logger
+import data_cache
+import exam_config
+import quiz_logic
+import exam_codes
+
+# 作成済み試験のキュー
+# (モデル, レベル) ごとに、ランダム出題の試験を EXAMS_PER_KEY 件まで先に作っておく。
+# 「試験開始」は take() でキューから1件取り出すだけになり、取り出した分はバックグラウンドのスレッドが補充する。
+# データバージョンが変わったら作り置きを捨てて作り直す。復習優先モードは履歴に依存するため対象外。
+# 作り置きはシード付きで作り、取り出した時点で試験コードを登録する (exam_codes)。
+
+EXAMS_PER_KEY = 3
+REFRESH_INTERVAL_SEC = 5.0  # データ更新の確認間隔 (take() の後はすぐに補充する)
+
+class ExamQueue:
+    def __init__(self, depth=EXAMS_PER_KEY):
+        self.depth = depth
+        self._queues = {}  # (model, level) → deque[(data_version, シード, 試験)]
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self.stats = {"hit": 0, "miss": 0, "built": 0, "dropped": 0}
+
+    def start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="exam-queue", daemon=True)
+                self._thread.start()
+        return self
+
+    def _keys(self):
+        # 在庫のある (モデル, レベル) と、これまでに要求された組み合わせ
+        levels = exam_config.get_config().levels
+        keys = {(model, level) for model, counts in data_cache.get_stock_stats()["models"].items() for level in levels if counts.get(level)}
+        with self._lock:
+            keys.update(self._queues)
+        return sorted(keys)
+
+    def _fill_once(self):
+        """
+        足りないキューを1件ずつ補充する。補充した件数を返す
+        """
+        version = data_cache.get_data_version()
+        built = 0
+        for model, level in self._keys():
+            with self._lock:
+                q = self._queues.setdefault((model, level), deque())
+                stale = sum(1 for item in q if item[0] != version)
+                if stale:
+                    self._queues[(model, level)] = q = deque(item for item in q if item[0] == version)
+                    self.stats["dropped"] += stale
+                if len(q) >= self.depth: continue
+            seed = exam_codes.new_seed()
+            exam = quiz_logic.get_exam_questions(level, exam_config.get_config().level(level).exam_size, model, seed=seed)
+            if not exam: continue
+            with self._lock:
+                self._queues[(model, level)].append((version, seed, exam))
+                self.stats["built"] += 1
+            built += 1
+        return built
+
+    def _run(self):
+        while True:
+            try:
+                # 1周で1件ずつ補充し、満杯になるまで続ける
+                while self._fill_once(): pass
+            except Exception as e:
+                logger.error(e, "Exam queue refill failed")
+            self._wake.wait(REFRESH_INTERVAL_SEC)
+            self._wake.clear()
+
+    def take(self, level, model):
+        """
+        作成済みの試験 (data_version, シード, 問題リスト) を1件取り出す (無ければ None)。取り出したら補充を促す
+        """
+        version = data_cache.get_data_version()
+        exam = None
+        with self._lock:
+            q = self._queues.setdefault((model, level), deque())
+            while q:
+                item = q.popleft()
+                if item[0] == version:
+                    exam = item
+                    break
+                self.stats["dropped"] += 1
+            self.stats["hit" if exam else "miss"] += 1
+        self._wake.set()
+        return exam
+
+    def get_metrics(self):
+        with self._lock:
+            return dict(self.stats, ready={f"{m}|{lv}": len(q) for (m, lv), q in self._queues.items()})
+
+_queue = None
+_queue_lock = threading.Lock()
+
+def get_queue():
+    """
+    プロセス全体で共有するキュー (初回呼び出しで補充スレッドを起動する)
+    """
+    global _queue
+    with _queue_lock:
+        if _queue is None: _queue = ExamQueue()
+    return _queue.start()
+
+def get_exam(level, total_count_request, target_model=None, mode=quiz_logic.MODE_RANDOM, user=None):
+    """
+    (問題リスト, 試験コード) を返す。ランダム出題で標準の問題数なら作り置きから取り出し、
+    それ以外・在庫切れは その場で作る。復習優先モードは再現できないためコードは None
+    """
+    if mode != quiz_logic.MODE_RANDOM:
+        return quiz_logic.get_exam_questions(level, total_count_request, target_model, mode=mode, user=user), None
+    if target_model and total_count_request == exam_config.get_config().level(level).exam_size:
+        item = get_queue().take(level, target_model)
+        if item is not None:
+            logger.incr("exam_queue.hit")
+            version, seed, exam = item
+            code = exam_codes.register(level, target_model, total_count_request, seed, version, exam)
+            if code is not None: return exam, code
+            # コードが衝突した作り置きは使わず、シードを引き直してその場で作る
+        logger.incr("exam_queue.miss")
+    code, exam = exam_codes.create(level, total_count_request, target_model)
+    return exam, code
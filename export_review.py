@@ -1,8 +1,8 @@
 import json
-import glob
 import os
 import csv
 import logger  # 共通ログを使用
+import catalog
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 DATA_DIR = os.path.join(BASE_DIR, "data")
@@ -12,13 +12,13 @@ def clean_text(text):
     if not text: return ""
     return str(text).replace("\n", " ").replace("\r", "")
 
+@logger.span("review.export")
 def run_export():
     logger.log("Starting Export...", "EXPORT")
     if not os.path.exists(DATA_DIR): return 0, 0, "データフォルダなし"
     if not os.path.exists(CSV_DIR): os.makedirs(CSV_DIR)
 
-    files = glob.glob(os.path.join(DATA_DIR, "db_*.json"))
-    files = [f for f in files if "db_status.json" not in f]
+    files = catalog.list_db_files()
 
     file_count = 0
     total_questions = 0
@@ -0,0 +1,173 @@
+import os
+import json
+import time
+import threading
+from collections import defaultdict
+import logger
+import storage
+import exam_config
+
+# 問題生成のテレメトリ
+# リクエストごとの 所要時間・トークン数・採用数・重複/形式不正/JSON解析失敗・429・章外/根拠不明 を
+# data/gen_requests.jsonl に1行ずつ記録し、モデル × (レベル|章番号) 別の累計を data/gen_telemetry.json に保持する。
+# 累計は「採用1問あたり」のコストと ETA の見積もりに使う。
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.path.join(BASE_DIR, "data")
+TELEMETRY_FILE = os.path.join(DATA_DIR, "gen_telemetry.json")
+REQUEST_LOG_FILE = os.path.join(DATA_DIR, "gen_requests.jsonl")
+
+FIELDS = (
+    "requests", "failed_requests", "rate_limited", "parse_failures", "wasted_requests",
+    "returned", "invalid", "duplicates", "accepted", "off_chapter", "ungrounded",
+    "latency_ms", "wall_ms", "prompt_tokens", "output_tokens", "total_tokens",
+)
+MIN_ACCEPTED_FOR_ESTIMATE = 5  # これ未満の実績しかない区分は見積もりに使わない
+
+def _empty():
+    return dict.fromkeys(FIELDS, 0)
+
+def chapter_key(level, chapter):
+    """
+    集計キー "二等|4" (章番号が取れなければ章名そのもの)
+    """
+    return f"{level}|{exam_config.chapter_num(chapter or '') or chapter}"
+
+def usage_from_response(resp):
+    """
+    応答の usage_metadata から (prompt, output, total) トークン数を取り出す (無ければ 0)
+    """
+    usage = getattr(resp, "usage_metadata", None)
+    if usage is None: return 0, 0, 0
+    prompt = int(getattr(usage, "prompt_token_count", 0) or 0)
+    output = int(getattr(usage, "candidates_token_count", 0) or 0)
+    total = int(getattr(usage, "total_token_count", 0) or 0) or prompt + output
+    return prompt, output, total
+
+class GenerationTelemetry:
+    """
+    1回の run_generation 分の計測値を溜め、flush() で累計ファイルにまとめて加算する
+    """
+    def __init__(self, model):
+        self.model = model
+        self._lock = threading.Lock()
+        self._pending = defaultdict(_empty)
+        self.run = _empty()
+        self.run_by_key = defaultdict(_empty)
+
+    def record(self, level, chapter, **values):
+        key = chapter_key(level, chapter)
+        with self._lock:
+            for target in (self._pending[key], self.run, self.run_by_key[key]):
+                for name, v in values.items():
+                    if name in target: target[name] += v
+        row = {"ts": round(time.time(), 3), "model": self.model, "key": key}
+        row.update({k: (round(v, 3) if isinstance(v, float) else v) for k, v in values.items()})
+        try:
+            storage.append_line(REQUEST_LOG_FILE, json.dumps(row, ensure_ascii=False))
+        except Exception as e:
+            logger.error(e, "Telemetry write failed")
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, defaultdict(_empty)
+        if not pending: return
+        def merge(data):
+            data = data or {}
+            by_key = data.setdefault("models", {}).setdefault(self.model, {})
+            for key, values in pending.items():
+                acc = by_key.setdefault(key, _empty())
+                for name, v in values.items():
+                    acc[name] = acc.get(name, 0) + v
+            data["updated_at"] = time.strftime("%Y-%m-%d %H:%M:%S")
+            return data
+        try:
+            storage.update_json(TELEMETRY_FILE, merge, default={})
+        except Exception as e:
+            logger.error(e, "Telemetry flush failed")
+
+def summarize(c):
+    """
+    累計値から 採用数/分・採用数/1kトークン・採用数/リクエスト などの指標を計算する
+    """
+    req = c.get("requests", 0)
+    acc = c.get("accepted", 0)
+    wall_min = c.get("wall_ms", 0) / 60000
+    tokens = c.get("total_tokens", 0)
+    returned = c.get("returned", 0)
+    return {
+        "requests": req,
+        "accepted": acc,
+        "per_min": round(acc / wall_min, 2) if wall_min > 0 else None,
+        "per_1k_tokens": round(acc / tokens * 1000, 2) if tokens else None,
+        "per_request": round(acc / req, 2) if req else None,
+        "avg_latency_sec": round(c.get("latency_ms", 0) / req / 1000, 1) if req else None,
+        "tokens_per_question": round(tokens / acc) if acc and tokens else None,
+        "duplicate_rate": round(c.get("duplicates", 0) / returned, 3) if returned else None,
+        "parse_fail_rate": round(c.get("parse_failures", 0) / req, 3) if req else None,
+        "invalid_rate": round(c.get("invalid", 0) / returned, 3) if returned else None,
+        "wasted_rate": round(c.get("wasted_requests", 0) / req, 3) if req else None,
+        "off_chapter_rate": round(c.get("off_chapter", 0) / acc, 3) if acc else None,
+        "ungrounded_rate": round(c.get("ungrounded", 0) / acc, 3) if acc else None,
+        "rate_limited": c.get("rate_limited", 0),
+    }
+
+def load_totals():
+    return (storage.read_json(TELEMETRY_FILE, {}) or {}).get("models", {})
+
+def _add(dst, src):
+    for name in FIELDS: dst[name] += src.get(name, 0)
+    return dst
+
+def get_report(totals=None):
+    """
+    [{"model", "key", 指標...}] — key が "(全体)" の行はモデル全体の合計
+    """
+    totals = load_totals() if totals is None else totals
+    rows = []
+    for model, by_key in sorted(totals.items()):
+        overall = _empty()
+        for key, c in sorted(by_key.items()):
+            _add(overall, c)
+            rows.append({"model": model, "key": key, **summarize(c)})
+        rows.append({"model": model, "key": "(全体)", **summarize(overall)})
+    return rows
+
+def model_summary(model, totals=None):
+    """
+    モデル全体の指標 (実績が少なければ None)
+    """
+    totals = load_totals() if totals is None else totals
+    by_key = totals.get(model)
+    if not by_key: return None
+    overall = _empty()
+    for c in by_key.values(): _add(overall, c)
+    if overall["accepted"] < MIN_ACCEPTED_FOR_ESTIMATE: return None
+    return summarize(overall)
+
+def seconds_per_question(model, level=None, chapter=None, totals=None):
+    """
+    採用1問あたりの所要秒数 (待機込み)。章の実績が少なければモデル全体の値で代用する
+    """
+    totals = load_totals() if totals is None else totals
+    by_key = totals.get(model) or {}
+    if level is not None and chapter is not None:
+        c = by_key.get(chapter_key(level, chapter))
+        if c and c.get("accepted", 0) >= MIN_ACCEPTED_FOR_ESTIMATE:
+            return c["wall_ms"] / 1000 / c["accepted"]
+    overall = _empty()
+    for c in by_key.values(): _add(overall, c)
+    if overall["accepted"] < MIN_ACCEPTED_FOR_ESTIMATE: return None
+    return overall["wall_ms"] / 1000 / overall["accepted"]
+
+def estimate_seconds(model, plan, totals=None):
+    """
+    plan = [(level, chapter, 問題数)] の生成にかかる秒数を見積もる (実績が無ければ None)
+    """
+    totals = load_totals() if totals is None else totals
+    total = 0.0
+    for level, chapter, count in plan:
+        spq = seconds_per_question(model, level, chapter, totals)
+        if spq is None: return None
+        total += spq * count
+    return total
@@ -2,20 +2,41 @@ import os
 import json
 import re
 import time
+import hashlib
+import threading
 import traceback
 import google.generativeai as genai
+import logger
+import data_cache
+import storage
+import gen_telemetry
+import exam_config
+import catalog
+import question_schema
+import grounding
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 DATA_DIR = os.path.join(BASE_DIR, "data")
 PDF_PATH = os.path.join(BASE_DIR, "rules.pdf")
-CONFIG_FILE = os.path.join(BASE_DIR, "exam_config.json")
+MODEL_CATALOG_FILE = os.path.join(DATA_DIR, "model_catalog.json")
+MODEL_CATALOG_TTL_SEC = 24 * 3600  # モデル一覧の再取得間隔
+# 生成結果の書き込みバッファ閾値 (件数 / 秒)
+FLUSH_MAX_ITEMS = 20
+FLUSH_MAX_AGE_SEC = 30.0
+# まとめて生成モード: 1リクエストで作る問題数の上限と、1章あたりの上限
+BATCH_MAX_QUESTIONS = 15
+BATCH_PER_CHAPTER = 5
+BATCH_TELEMETRY_SUFFIX = " [batch]"
+# 不足分の補充: 章ごとの目標在庫 = 出題数 (weights) × この倍率
+DEFAULT_DEPTH_FACTOR = 10
 
 def log_cmd(msg, is_error=False):
-    timestamp = time.strftime("%H:%M:%S")
+    # 出力は共通ロガー経由 (DRONE_LOG_JSON 指定時は JSON Lines にも残る)
     try:
-        print(f"[{timestamp}] {msg}", flush=True)
+        logger.log(msg, "ERROR" if is_error else "GEN")
         if is_error:
-            print(f"[{timestamp}] [ERROR TRACE] 👇", flush=True)
+            logger.incr("generation.errors")
+            print(f"[{time.strftime('%H:%M:%S')}] [ERROR TRACE] 👇", flush=True)
             traceback.print_exc()
             print("-" * 60, flush=True)
     except: pass
@@ -25,23 +46,100 @@ def format_time(seconds):
     m, s = divmod(int(seconds), 60)
     return f"{m}分{s:02d}秒"
 
-def load_config():
-    if os.path.exists(CONFIG_FILE):
-        try:
-            with open(CONFIG_FILE, 'r', encoding='utf-8') as f: return json.load(f)
-        except: pass
-    return {}
-
-def clean_json_text(text):
-    # マークダウン記法削除
-    text = re.sub(r'```json\s*', '', text)
-    text = re.sub(r'```\s*', '', text)
-    # 最初の [ から 最後の ] までを抽出 (余計な末尾のコメント対策)
-    match = re.search(r'\[.*\]', text, re.DOTALL)
-    if match: return match.group(0)
-    return text
-
-def get_models(api_key):
+def merge_questions(json_path, new_qs, level, chapter_name=None, model=None):
+    """
+    ロック下で json_path の最新内容を読み、重複を除いて新しい問題を追記する。
+    IDはファイル内の最大IDから採番する。書き込みと同じロック下でカタログも更新する。追加件数を返す
+    """
+    added = []
+    def merge(db_data):
+        db_data = db_data if isinstance(db_data, list) else []
+        existing = {e.get('question') for e in db_data}
+        ids = [q['id'] for q in db_data if isinstance(q.get('id'), int)]
+        current_max_id = max(ids) if ids else 0
+        for q in new_qs:
+            # 重複チェック
+            if q['question'] in existing: continue
+            # ★章番号の強制正規化 (AIが "4" や "Chapter4" と出しても "第4章" に統一)
+            if chapter_name:
+                q['chapter'] = chapter_name
+            current_max_id += 1
+            q['id'] = current_max_id
+            q['level'] = level
+            db_data.append(q)
+            existing.add(q['question'])
+            added.append(q)
+        return db_data if added else None
+    storage.update_json(json_path, merge, default=[],
+                        on_write=lambda path, data, text: catalog.record(path, data, text, model=model, level=level))
+    return len(added)
+
+def telemetry_name(model_name, batch_mode=False):
+    """
+    テレメトリの集計名 (まとめて生成モードは別集計)
+    """
+    return model_name + BATCH_TELEMETRY_SUFFIX if batch_mode else model_name
+
+def model_file_prefix(model_name):
+    """
+    モデル名から問題ファイル名・カタログの model に使う名前を作る
+    """
+    return model_name.replace(":", "").replace("/", "")
+
+def _db_path(file_prefix, level, spec):
+    return os.path.join(DATA_DIR, f"db_{file_prefix}_{level}_{spec.file_id}.json")
+
+def _filter_new_questions(new_qs, known_questions, stat, chapter=None):
+    """
+    スキーマ違反・重複 (既存 + 未書き込み分) を除いた問題を返し、件数を stat に加算する。
+    採用した問題は教則PDFと照合し、結果を q["grounding"] に付ける (章外・根拠不明は除外せず件数だけ数える)
+    """
+    fresh_qs = []
+    for q in new_qs:
+        q = question_schema.normalize_question(q)
+        if not question_schema.is_valid_question(q):
+            stat["invalid"] = stat.get("invalid", 0) + 1
+            continue
+        if q['question'] in known_questions:
+            stat["duplicates"] = stat.get("duplicates", 0) + 1
+            continue
+        known_questions.add(q['question'])
+        fresh_qs.append(q)
+    for q, result in zip(fresh_qs, (grounding.check_questions(fresh_qs, chapter) or []) if fresh_qs else []):
+        if result is None: continue
+        q["grounding"] = result
+        for flag in result["flags"]: stat[flag] = stat.get(flag, 0) + 1
+    stat["returned"] = stat.get("returned", 0) + len(new_qs)
+    stat["accepted"] = stat.get("accepted", 0) + len(fresh_qs)
+    logger.incr("generation.accepted", len(fresh_qs))
+    if len(new_qs) > len(fresh_qs): logger.incr("generation.rejected", len(new_qs) - len(fresh_qs))
+    return fresh_qs
+
+def _read_known_questions(json_path):
+    try:
+        return {q.get('question') for q in (storage.read_json(json_path, []) or [])}
+    except Exception:
+        return set()
+
+def _flush_questions(key, items):
+    json_path, level, chapter_name, model = key
+    return merge_questions(json_path, items, level, chapter_name, model)
+
+def _buffer_write(write, *args):
+    """
+    バッファへの追加・書き出し (write) を行う。書き込みに失敗しても問題はバッファに残り次回の書き出しで再試行されるため、
+    API エラーとは別に記録して生成は続ける
+    """
+    try:
+        write(*args)
+    except Exception as e:
+        logger.incr("generation.write_errors")
+        log_cmd(f"Write Error: {e}", is_error=True)
+
+def _fetch_models(api_key):
+    """
+    Google API からモデル一覧を取得し、推奨モデルだけに絞って並べ替える (ネットワークアクセスあり)
+    """
     log_cmd("Fetching model list from Google API...")
     genai.configure(api_key=api_key)
     models = []
@@ -50,7 +148,7 @@ def get_models(api_key):
         "competition", "tts", "robotics", "image", "learned", 
         "computer", "exp", "experimental", "legacy", "preview"
     ]
-    try:
+    with logger.span("generation.list_models"):
         for m in genai.list_models():
             if 'generateContent' not in m.supported_generation_methods: continue
             name = m.name.replace("models/", "")
@@ -60,9 +158,6 @@ def get_models(api_key):
             if re.search(r'-\d{3}$', name): continue
             if re.search(r'-\d{2}-\d{2}', name) or re.search(r'-\d{4}', name): continue
             models.append(name)
-    except Exception as e:
-        log_cmd(f"Failed to fetch models: {e}", is_error=True)
-        return []
     
     models.sort(key=lambda x: (
         re.findall(r'\d+\.\d+', x)[0] if re.findall(r'\d+\.\d+', x) else "0.0",
@@ -72,7 +167,196 @@ def get_models(api_key):
     ), reverse=True)
     return models
 
-def run_generation(api_key, model_name, target_levels, num_sets, update_ui_callback):
+# --- モデル一覧のディスクキャッシュ ---
+# APIキーごと (キーそのものではなくハッシュで識別) に、絞り込み済みのモデル一覧と取得時刻を保存する。
+# TTL を過ぎた一覧はそのまま返しつつ、裏でスレッドが再取得する。
+_refresh_lock = threading.Lock()
+_refreshing = set()
+
+def _catalog_key(api_key):
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16]
+
+def _save_catalog(api_key, models):
+    def update(catalog):
+        catalog = catalog or {}
+        catalog[_catalog_key(api_key)] = {"models": models, "fetched_at": time.time()}
+        return catalog
+    storage.update_json(MODEL_CATALOG_FILE, update, default={})
+
+def get_cached_models(api_key):
+    """
+    キャッシュ済みのモデル一覧 (models, fetched_at) を返す。ネットワークにはアクセスしない
+    """
+    entry = (storage.read_json(MODEL_CATALOG_FILE, {}) or {}).get(_catalog_key(api_key or ""))
+    if not entry: return [], None
+    return entry.get("models", []), entry.get("fetched_at")
+
+def _refresh_in_background(api_key):
+    key = _catalog_key(api_key)
+    with _refresh_lock:
+        if key in _refreshing: return
+        _refreshing.add(key)
+    def worker():
+        try:
+            models = _fetch_models(api_key)
+            if models: _save_catalog(api_key, models)
+        except Exception as e:
+            log_cmd(f"Background model refresh failed: {e}")
+        finally:
+            with _refresh_lock: _refreshing.discard(key)
+    threading.Thread(target=worker, name="model-catalog-refresh", daemon=True).start()
+
+def get_models(api_key, force_refresh=False):
+    """
+    推奨モデル一覧を返す。キャッシュが TTL 内ならそのまま、期限切れなら古い一覧を返して裏で更新する。
+    キャッシュが無い場合と force_refresh=True の場合はその場で取得する
+    """
+    if not api_key: return []
+    models, fetched_at = get_cached_models(api_key)
+    if models and not force_refresh:
+        if time.time() - fetched_at > MODEL_CATALOG_TTL_SEC:
+            _refresh_in_background(api_key)
+        return models
+    try:
+        fresh = _fetch_models(api_key)
+    except Exception as e:
+        log_cmd(f"Failed to fetch models: {e}", is_error=True)
+        return models  # 取得に失敗したらキャッシュ (あれば) を使う
+    if fresh: _save_catalog(api_key, fresh)
+    return fresh or models
+
+_pdf_lock = threading.Lock()
+_pdf_upload = {}  # 同じプロセス内で並行・連続して実行する生成で、アップロード済みの PDF を使い回す
+
+def _upload_pdf(update_ui_callback):
+    """
+    教則PDFをアップロードして (ファイル, エラー文) を返す。
+    このプロセスでアップロード済みで、PDFが変わっておらず処理済み (ACTIVE) のままならそれを使う。
+    削除するのはこのプロセスがアップロードして使えなくなったファイルだけ (同じAPIキーを使う他の実行・プロセスの
+    ファイルは生成中の可能性があるため、表示名が同じでも消さない。残ったファイルはAPI側で期限切れになる)
+    """
+    target_filename = "rules.pdf"
+    st_pdf = os.stat(PDF_PATH)
+    key = (st_pdf.st_mtime_ns, st_pdf.st_size)
+    with _pdf_lock:
+        cached = _pdf_upload.get("file")
+        if cached is not None and _pdf_upload.get("key") == key:
+            try:
+                if genai.get_file(cached.name).state.name == "ACTIVE":
+                    log_cmd("Reusing uploaded PDF.")
+                    return cached, None
+                # 処理に失敗した (ACTIVE でない) 自分のファイルは誰も使えないので消す
+                genai.delete_file(cached.name)
+                log_cmd("Deleted unusable PDF upload.")
+            except Exception: pass
+        # PDF が変わった場合の古いファイルは、このプロセスで実行中の生成が使っている可能性があるため消さない
+        _pdf_upload.clear()
+
+        try:
+            update_ui_callback([], {"status": "⬆️ PDFをアップロード中..."}, {'total': 0.05, 'chapter': 0.0})
+            with logger.span("generation.pdf_upload"):
+                uploaded_file = genai.upload_file(PDF_PATH, mime_type="application/pdf", display_name=target_filename)
+
+                while True:
+                    file_status = genai.get_file(uploaded_file.name)
+                    if file_status.state.name == "ACTIVE": break
+                    if file_status.state.name == "FAILED":
+                        try: genai.delete_file(uploaded_file.name)
+                        except Exception: pass
+                        return None, "PDF処理失敗"
+                    time.sleep(2)
+        except Exception as e:
+            return None, f"Upload Error: {str(e)}"
+        _pdf_upload.update(file=uploaded_file, key=key)
+        return uploaded_file, None
+
+def chapter_count(spec, level, chapter_targets=None):
+    """
+    1セットあたりにこの章で作る問題数。chapter_targets {レベル: {章番号 or ファイル名用ID: 問題数}} に
+    そのレベルがあれば指定値 (載っていない章は 0)、無ければ設定の配分 (weights)
+    """
+    if chapter_targets and level in chapter_targets:
+        targets = chapter_targets[level]
+        return int(targets.get(spec.num, targets.get(spec.file_id, 0)) or 0)
+    return spec.weight
+
+def apportion(total, weights):
+    """
+    total を weights の比で整数に分ける (最大剰余法。合計は total になる)
+    """
+    weights = [max(0.0, float(w)) for w in weights]
+    if not weights: return []
+    if sum(weights) <= 0: weights = [1.0] * len(weights)
+    quotas = [total * w / sum(weights) for w in weights]
+    counts = [int(q) for q in quotas]
+    for i in sorted(range(len(quotas)), key=lambda i: counts[i] - quotas[i])[:total - sum(counts)]:
+        counts[i] += 1
+    return counts
+
+def throughput_weights(models, batch_mode=False, totals=None):
+    """
+    複数モデルに振り分けるときの比率 {モデル: 過去の実績の 問/分}。
+    実績の無いモデルは実績のあるモデルの平均、どのモデルにも実績が無ければ均等
+    """
+    totals = gen_telemetry.load_totals() if totals is None else totals
+    rates = {}
+    for m in models:
+        s = gen_telemetry.model_summary(telemetry_name(m, batch_mode), totals) or gen_telemetry.model_summary(m, totals)
+        rates[m] = s["per_min"] if s and s.get("per_min") else None
+    known = [r for r in rates.values() if r]
+    fallback = sum(known) / len(known) if known else 1.0
+    return {m: r or fallback for m, r in rates.items()}
+
+def fan_out_targets(models, level, total, batch_mode=False, totals=None):
+    """
+    level の問題 total 問を、処理能力に比例してモデルに、設定の配分 (weights) に比例して章に振り分ける。
+    {モデル: {章番号 or ファイル名用ID: 問題数}} (chapter_targets[level] にそのまま渡せる形)
+    """
+    weights = throughput_weights(models, batch_mode, totals)
+    chapters = exam_config.get_config().level(level).chapters
+    targets = {}
+    for m, n in zip(models, apportion(total, [weights[m] for m in models])):
+        counts = apportion(n, [spec.weight for spec in chapters])
+        targets[m] = {spec.num or spec.file_id: c for spec, c in zip(chapters, counts) if c > 0}
+    return targets
+
+def stock_by_chapter(entries=None):
+    """
+    カタログから在庫数を数える {(ファイル名用モデル名, レベル, ファイル名用章ID): 問題数}
+    """
+    entries = catalog.get_entries() if entries is None else entries
+    stock = {}
+    for entry in entries.values():
+        key = (entry.get("model"), entry.get("level"), entry.get("chapter"))
+        stock[key] = stock.get(key, 0) + int(entry.get("count") or 0)
+    return stock
+
+def plan_gaps(models, levels, depth=DEFAULT_DEPTH_FACTOR, pooled=False, batch_mode=False, entries=None, totals=None):
+    """
+    章ごとの目標在庫 (出題数 × depth) に足りない分だけを生成する計画を作る。
+    {モデル: {レベル: {章番号 or ファイル名用ID: 問題数}}} (各モデルの chapter_targets としてそのまま使える。不足の無いレベルは含めない)。
+    pooled=True なら全モデル合計の在庫 (「全モデル」出題) に対する不足を、処理能力の比で models に振り分ける
+    """
+    config = exam_config.get_config()
+    stock = stock_by_chapter(entries)
+    weights = throughput_weights(models, batch_mode, totals) if pooled else None
+    plan = {m: {} for m in models}
+    for level in levels:
+        for spec in config.level(level).chapters:
+            if spec.weight <= 0: continue
+            key = spec.num or spec.file_id
+            target = spec.weight * depth
+            if pooled:
+                have = sum(n for (_, lv, ch), n in stock.items() if lv == level and ch == spec.file_id)
+                deficits = apportion(max(0, target - have), [weights[m] for m in models])
+            else:
+                deficits = [max(0, target - stock.get((model_file_prefix(m), level, spec.file_id), 0)) for m in models]
+            for m, n in zip(models, deficits):
+                if n > 0: plan[m].setdefault(level, {})[key] = n
+    return plan
+
+@logger.span("generation.run")
+def run_generation(api_key, model_name, target_levels, num_sets, update_ui_callback, batch_mode=False, chapter_targets=None):
     log_cmd("=== Generation Process Started ===")
     genai.configure(api_key=api_key)
     
@@ -83,42 +367,24 @@ def run_generation(api_key, model_name, target_levels, num_sets, update_ui_callb
     if not os.path.exists(PDF_PATH):
         return "PDFが見つかりません。rules.pdfを配置してください。"
 
-    target_filename = "rules.pdf"
-    log_cmd("Checking existing PDF cache...")
-    try:
-        for f in genai.list_files():
-            if f.display_name == target_filename:
-                genai.delete_file(f.name)
-                log_cmd("Deleted old PDF cache.")
-                break
-    except: pass
+    uploaded_file, err = _upload_pdf(update_ui_callback)
+    if err: return err
 
-    try:
-        update_ui_callback([], {"status": "⬆️ PDFをアップロード中..."}, {'total': 0.05, 'chapter': 0.0})
-        uploaded_file = genai.upload_file(PDF_PATH, mime_type="application/pdf", display_name=target_filename)
-        
-        while True:
-            file_status = genai.get_file(uploaded_file.name)
-            if file_status.state.name == "ACTIVE": break
-            if file_status.state.name == "FAILED": return "PDF処理失敗"
-            time.sleep(2)
-    except Exception as e:
-        return f"Upload Error: {str(e)}"
+    # 照合用インデックスを先に用意しておく (初回は PDF からの作成に数秒かかる)
+    grounding.get_index()
 
     model = genai.GenerativeModel(model_name)
-    config_data = load_config()
-    file_prefix = model_name.replace(":", "").replace("/", "")
+    config = exam_config.get_config()
+    file_prefix = model_file_prefix(model_name)
     
     tasks = []
+    task_specs = []  # tasks[i] の章設定 (exam_config.Chapter)
     task_id = 0
     for set_num in range(1, num_sets + 1):
         for level in target_levels:
-            if level in config_data:
-                weights = config_data[level].get("weights", {})
-            else:
-                weights = {"第2章":3, "第3章":17, "第4章":15, "第5章":7, "第6章":8}
-            
-            for ch_name, count in weights.items():
+            for spec in config.level(level).chapters:
+                ch_name, count = spec.name, chapter_count(spec, level, chapter_targets)
+                if count <= 0: continue
                 tasks.append({
                     "id": task_id,
                     "name": f"セット{set_num} [{level}] {ch_name}",
@@ -126,134 +392,286 @@ def run_generation(api_key, model_name, target_levels, num_sets, update_ui_callb
                     "progress_text": f"0/{count} (0%)",
                     "target_count": count,
                     "level": level,
-                    "chapter": ch_name
+                    "chapter": ch_name,
+                    "set": set_num
                 })
+                task_specs.append(spec)
                 task_id += 1
     
     total_tasks = len(tasks)
     start_time_total = time.time()
+    # 過去の実績 (採用1問あたりの秒数) から ETA を見積もる。今回の実績が溜まったらそちらを優先する
+    # まとめて生成モードの実績は別名で集計し、通常モードと比較できるようにする
+    telemetry = gen_telemetry.GenerationTelemetry(telemetry_name(model_name, batch_mode))
+    history = gen_telemetry.load_totals()
+    spq_by_task = [gen_telemetry.seconds_per_question(telemetry.model, t["level"], t["chapter"], history) for t in tasks]
     
-    for i, task in enumerate(tasks):
-        task["status"] = "🔄 生成中..."
-        level = task["level"]
-        ch_name = task["chapter"] # 例: "第4章 無人航空機のシステム"
-        target_count = task["target_count"]
-        
-        # ターゲットとなる章番号を抽出 (例: 4)
-        m_target = re.search(r'第(\d+)章', ch_name)
-        target_ch_num = m_target.group(1) if m_target else None
-        
-        # ファイル名用のID (ch4)
-        ch_id = f"ch{target_ch_num}" if target_ch_num else "chX"
-
-        if level in config_data:
-            scope = config_data[level].get("scope_instruction", "")
+    # 採用した問題は write-behind バッファに溜め、件数・時間の閾値またはタスク完了時にまとめて書き込む
+    buffer = storage.WriteBehindBuffer(_flush_questions, max_items=FLUSH_MAX_ITEMS, max_age_sec=FLUSH_MAX_AGE_SEC)
+    try:
+        if batch_mode:
+            _run_batched(model, uploaded_file, file_prefix, tasks, task_specs, config, buffer, telemetry, update_ui_callback)
         else:
-            scope = "基本範囲"
+            for i, task in enumerate(tasks):
+                task["status"] = "🔄 生成中..."
+                level = task["level"]
+                ch_name = task["chapter"] # 例: "第4章 無人航空機のシステム"
+                target_count = task["target_count"]
+                spec = task_specs[i]  # 章番号 (4)・ファイル名用ID (ch4)・プロンプトは設定読み込み時に計算済み
 
-        json_path = os.path.join(DATA_DIR, f"db_{file_prefix}_{level}_{ch_id}.json")
+                json_path = _db_path(file_prefix, level, spec)
+                buffer_key = (json_path, level, ch_name if spec.num else None, file_prefix)
+                known_questions = _read_known_questions(json_path)
         
-        db_data = []
-        current_max_id = 0
-        if os.path.exists(json_path):
-            try:
-                with open(json_path, 'r', encoding='utf-8') as f:
-                    db_data = json.load(f)
-                    ids = [q['id'] for q in db_data if 'id' in q]
-                    if ids: current_max_id = max(ids)
-            except: pass
+                added = 0
+                failures = 0
+                start_time_chapter = time.time()
 
-        added = 0
-        failures = 0
-        start_time_chapter = time.time()
-
-        while added < target_count:
-            now = time.time()
-            elapsed_total = now - start_time_total
-            elapsed_chapter = now - start_time_chapter
-            chapter_percent = added / target_count
-            total_percent = (i + chapter_percent) / total_tasks
+                while added < target_count:
+                    now = time.time()
+                    elapsed_total = now - start_time_total
+                    elapsed_chapter = now - start_time_chapter
+                    chapter_percent = added / target_count
+                    total_percent = (i + chapter_percent) / total_tasks
             
-            # ETA計算
-            total_eta = (elapsed_total / total_percent) - elapsed_total if total_percent > 0.01 else None
-            chapter_eta = (elapsed_chapter / chapter_percent) - elapsed_chapter if chapter_percent > 0.1 else None
+                    # ETA計算: 今回の実績 (10問以上) → 過去の実績 → 進捗率からの外挿 の順に使う
+                    run = telemetry.run
+                    run_spq = run["wall_ms"] / 1000 / run["accepted"] if run["accepted"] >= 10 else None
+                    remaining = [(t["target_count"], spq_by_task[j]) for j, t in enumerate(tasks) if j > i]
+                    if run_spq or (spq_by_task[i] and all(spq for _, spq in remaining)):
+                        total_eta = (target_count - added) * (run_spq or spq_by_task[i]) + sum(n * (run_spq or spq) for n, spq in remaining)
+                    else:
+                        total_eta = (elapsed_total / total_percent) - elapsed_total if total_percent > 0.01 else None
+                    if run_spq or spq_by_task[i]:
+                        chapter_eta = (target_count - added) * (run_spq or spq_by_task[i])
+                    else:
+                        chapter_eta = (elapsed_chapter / chapter_percent) - elapsed_chapter if chapter_percent > 0.1 else None
 
-            time_info = {
-                "status": f"現在: {task['name']}",
-                "elapsed_total": format_time(elapsed_total),
-                "eta_total": format_time(total_eta) if total_eta else "計算中...",
-                "elapsed_chapter": format_time(elapsed_chapter),
-                "eta_chapter": format_time(chapter_eta) if chapter_eta else "計算中..."
-            }
-            task["progress_text"] = f"{added}/{target_count} ({int(chapter_percent*100)}%)"
-            update_ui_callback(tasks, time_info, {'total': min(0.99, total_percent), 'chapter': chapter_percent})
+                    time_info = {
+                        "status": f"現在: {task['name']}",
+                        "elapsed_total": format_time(elapsed_total),
+                        "eta_total": format_time(total_eta) if total_eta else "計算中...",
+                        "elapsed_chapter": format_time(elapsed_chapter),
+                        "eta_chapter": format_time(chapter_eta) if chapter_eta else "計算中...",
+                        "telemetry": gen_telemetry.summarize(run),
+                    }
+                    task["progress_text"] = f"{added}/{target_count} ({int(chapter_percent*100)}%)"
+                    update_ui_callback(tasks, time_info, {'total': min(0.99, total_percent), 'chapter': chapter_percent})
 
-            needed = target_count - added
-            req = min(5, needed)
-            if req <= 0: break
+                    needed = target_count - added
+                    req = min(5, needed)
+                    if req <= 0: break
             
-            # ★強化されたプロンプト
-            prompt = f"""
-            あなたはドローン国家資格({level})の試験作成者です。
-            PDFの目次や見出しを確認し、「{ch_name}」のセクションに書かれている内容のみを使って、三択問題を【{req}問】作成してください。
+                    prompt = spec.prompt.substitute(count=req)
             
-            【絶対厳守: 出題範囲の限定】
-            ・「{ch_name}」以外の章（例えばリスク管理や法律など、他の章の内容）は一切含めないでください。
-            ・その章に書かれていない知識は使わないでください。
-            ・範囲詳細: {scope}
-            
-            【形式】
-            出力は以下のJSON形式のみ。余計な会話は不要。
-            [{{"question":"...","options":{{"1":"..","2":"..","3":".."}},"answer":"1","explanation":"..."}}]
-            """
+                    # 1リクエスト分の計測値 (待機時間も wall_ms に含める)
+                    stat = {"requests": 1}
+                    t_req = time.perf_counter()
+                    fresh_qs = []
+                    try:
+                        with logger.span("generation.api_call", model=model_name):
+                            resp = model.generate_content(
+                                [prompt, uploaded_file],
+                                generation_config={"response_mime_type": "application/json", "response_schema": question_schema.list_schema(), "temperature": 0.7}
+                            )
+                        stat["latency_ms"] = (time.perf_counter() - t_req) * 1000
+                        stat["prompt_tokens"], stat["output_tokens"], stat["total_tokens"] = gen_telemetry.usage_from_response(resp)
+                        try:
+                            # response_schema で形式を強制しているため、応答はそのまま JSON として読む
+                            with logger.span("generation.parse"):
+                                new_qs = json.loads(resp.text)
+                            if not isinstance(new_qs, list): raise ValueError("response is not a list")
+                        except ValueError:
+                            stat["parse_failures"] = 1
+                            logger.incr("generation.parse_failures")
+                            new_qs = []
+                        fresh_qs = _filter_new_questions(new_qs, known_questions, stat, spec.num)
+                        if not fresh_qs:
+                            failures += 1
+                            time.sleep(1) # 少し待機
+
+                    except Exception as e:
+                        failures += 1
+                        stat["failed_requests"] = 1
+                        stat.setdefault("latency_ms", (time.perf_counter() - t_req) * 1000)
+                        log_cmd(f"API Error: {e}", is_error=True)
+                        if "429" in str(e):
+                            stat["rate_limited"] = 1
+                            logger.incr("generation.rate_limited")
+                            task["status"] = "⏳ 制限待機中"
+                            _buffer_write(buffer.flush)  # 長い待機の前に溜まっている分を書き出す
+                            time.sleep(60)
+                    if fresh_qs:
+                        # 書き込みはバッファに任せる (閾値到達・タスク完了時にまとめて1回書き込む)。
+                        # 書き込みの失敗は API エラーとは扱わない (問題はバッファに残るため、数え直して作り直すと重複する)
+                        _buffer_write(buffer.add, buffer_key, fresh_qs)
+                        added += len(fresh_qs)
+                        failures = 0
+                    if not stat.get("accepted"): stat["wasted_requests"] = 1  # 1問も採用できなかったリクエスト
+                    stat["wall_ms"] = (time.perf_counter() - t_req) * 1000
+                    telemetry.record(level, ch_name, **stat)
             
+                    if failures >= 5:
+                        # 無限ループ防止: 生成できなくても次へ進む
+                        break
+        
+                # タスク完了時に書き出し、追加分を試験側のキャッシュに反映させる
+                _buffer_write(buffer.flush)
+                telemetry.flush()
+                if added > 0: data_cache.bump_data_version("generation")
+                task["status"] = "✅ 完了"
+                task["progress_text"] = f"{target_count}/{target_count} (100%)"
+                time_info["write_behind"] = buffer.get_metrics()
+                update_ui_callback(tasks, time_info, {'total': (i + 1) / total_tasks, 'chapter': 1.0})
+
+    finally:
+        # 中断 (再実行・例外) 時も溜まっている分を失わない
+        buffer.close()
+        telemetry.flush()
+        log_cmd(f"Write-behind metrics: {buffer.get_metrics()}")
+        log_cmd(f"Generation telemetry: {gen_telemetry.summarize(telemetry.run)}")
+
+    return None
+
+def _run_batched(model, uploaded_file, file_prefix, tasks, task_specs, config, buffer, telemetry, update_ui_callback):
+    """
+    まとめて生成モード: セット×レベルごとに、残りのある複数章の問題を1リクエストで生成する。
+    応答は章IDをキーにした response_schema で受け取り、各章のファイルに振り分ける
+    """
+    start_time = time.time()
+    total_target = sum(t["target_count"] for t in tasks) or 1
+    state = []
+    for task, spec in zip(tasks, task_specs):
+        json_path = _db_path(file_prefix, task["level"], spec)
+        state.append({"added": 0, "json_path": json_path, "buffer_key": (json_path, task["level"], task["chapter"] if spec.num else None, file_prefix)})
+    known_by_path = {}
+
+    groups = {}
+    for i, task in enumerate(tasks):
+        groups.setdefault((task["set"], task["level"]), []).append(i)
+
+    def added_total():
+        return sum(s["added"] for s in state)
+
+    time_info = {}
+    for (set_num, level), idxs in groups.items():
+        level_cfg = config.level(level)
+        for i in idxs:
+            tasks[i]["status"] = "🔄 生成中..."
+            path = state[i]["json_path"]
+            if path not in known_by_path: known_by_path[path] = _read_known_questions(path)
+        group_target = sum(tasks[i]["target_count"] for i in idxs)
+        group_added = 0
+        failures = 0
+
+        while True:
+            pending = [i for i in idxs if state[i]["added"] < tasks[i]["target_count"]]
+            if not pending: break
+            # 残りの多い章から順に、1リクエストの上限まで割り当てる
+            alloc = []
+            budget = BATCH_MAX_QUESTIONS
+            for i in sorted(pending, key=lambda i: state[i]["added"] - tasks[i]["target_count"]):
+                n = min(BATCH_PER_CHAPTER, tasks[i]["target_count"] - state[i]["added"], budget)
+                if n <= 0: break
+                alloc.append((i, n))
+                budget -= n
+            requested = sum(n for _, n in alloc)
+
+            # 進捗表示 (ETA は今回の実績 → 過去の実績 → 進捗率からの外挿)
+            elapsed = time.time() - start_time
+            done = added_total()
+            run = telemetry.run
+            spq = run["wall_ms"] / 1000 / run["accepted"] if run["accepted"] >= 10 else gen_telemetry.seconds_per_question(telemetry.model)
+            if spq: eta_total, eta_group = (total_target - done) * spq, (group_target - group_added) * spq
+            elif done / total_target > 0.01: eta_total, eta_group = elapsed / (done / total_target) - elapsed, None
+            else: eta_total, eta_group = None, None
+            names = "、".join(task_specs[i].file_id for i, _ in alloc)
+            time_info = {
+                "status": f"現在: セット{set_num} [{level}] {names} ({requested}問をまとめて生成)",
+                "elapsed_total": format_time(elapsed),
+                "eta_total": format_time(eta_total) if eta_total else "計算中...",
+                "elapsed_chapter": format_time(elapsed),
+                "eta_chapter": format_time(eta_group) if eta_group else "計算中...",
+                "telemetry": gen_telemetry.summarize(run),
+            }
+            for i in idxs:
+                t = tasks[i]
+                t["progress_text"] = f"{state[i]['added']}/{t['target_count']} ({int(state[i]['added'] / t['target_count'] * 100)}%)"
+            update_ui_callback(tasks, time_info, {'total': min(0.99, done / total_target), 'chapter': group_added / max(1, group_target)})
+
+            chapter_list = "\n".join(f"・{task_specs[i].file_id}: 「{tasks[i]['chapter']}」から【{n}問】" for i, n in alloc)
+            prompt = level_cfg.batch_prompt.substitute(chapters=chapter_list)
+            schema = question_schema.batch_schema([task_specs[i].file_id for i, _ in alloc])
+
+            # リクエスト全体の計測値 (章ごとには依頼数の比率で按分して記録する)
+            shared = {"requests": 1}
+            per_chapter = {i: {} for i, _ in alloc}
+            t_req = time.perf_counter()
+            got = 0
+            accepted = []  # [(タスク番号, 採用した問題)]
             try:
-                resp = model.generate_content(
-                    [prompt, uploaded_file],
-                    generation_config={"response_mime_type": "application/json", "temperature": 0.7}
-                )
-                new_qs = json.loads(clean_json_text(resp.text))
-                
-                ok_count = 0
-                for q in new_qs:
-                    if all(k in q for k in ["question", "options", "answer"]):
-                        # 重複チェック
-                        if any(e['question'] == q['question'] for e in db_data):
-                            continue
-                            
-                        # ★章番号の強制正規化 (AIが "4" や "Chapter4" と出しても "第4章" に統一)
-                        if target_ch_num:
-                            # どんな値が入っていても、ターゲットの章名で上書きする
-                            q['chapter'] = ch_name 
-                        
-                        current_max_id += 1
-                        q['id'] = current_max_id
-                        q['level'] = level
-                        db_data.append(q)
-                        ok_count += 1
-                
-                if ok_count > 0:
-                    with open(json_path, 'w', encoding='utf-8') as f:
-                        json.dump(db_data, f, indent=4, ensure_ascii=False)
-                    added += ok_count
-                    failures = 0
-                else:
+                with logger.span("generation.api_call", model=telemetry.model):
+                    resp = model.generate_content(
+                        [prompt, uploaded_file],
+                        generation_config={"response_mime_type": "application/json", "response_schema": schema, "temperature": 0.7}
+                    )
+                shared["latency_ms"] = (time.perf_counter() - t_req) * 1000
+                shared["prompt_tokens"], shared["output_tokens"], shared["total_tokens"] = gen_telemetry.usage_from_response(resp)
+                try:
+                    with logger.span("generation.parse"):
+                        data = json.loads(resp.text)
+                    if not isinstance(data, dict): raise ValueError("response is not an object")
+                except ValueError:
+                    shared["parse_failures"] = 1
+                    logger.incr("generation.parse_failures")
+                    data = {}
+                # 章IDごとに振り分け、各章のファイル (バッファキー) に追加する
+                for i, n in alloc:
+                    qs = data.get(task_specs[i].file_id)
+                    if not isinstance(qs, list): qs = []
+                    fresh_qs = _filter_new_questions(qs, known_by_path[state[i]["json_path"]], per_chapter[i], task_specs[i].num)
+                    if fresh_qs: accepted.append((i, fresh_qs))
+                if not accepted:
                     failures += 1
                     time.sleep(1) # 少し待機
-
             except Exception as e:
                 failures += 1
+                shared["failed_requests"] = 1
+                shared.setdefault("latency_ms", (time.perf_counter() - t_req) * 1000)
                 log_cmd(f"API Error: {e}", is_error=True)
                 if "429" in str(e):
-                    task["status"] = "⏳ 制限待機中"
+                    shared["rate_limited"] = 1
+                    logger.incr("generation.rate_limited")
+                    for i, _ in alloc: tasks[i]["status"] = "⏳ 制限待機中"
+                    _buffer_write(buffer.flush)  # 長い待機の前に溜まっている分を書き出す
                     time.sleep(60)
-            
+                    for i, _ in alloc: tasks[i]["status"] = "🔄 生成中..."
+            # 書き込みの失敗は API エラーとは扱わない (問題はバッファに残り、次回の書き出しで再試行される)
+            for i, fresh_qs in accepted:
+                _buffer_write(buffer.add, state[i]["buffer_key"], fresh_qs)
+                state[i]["added"] += len(fresh_qs)
+                got += len(fresh_qs)
+            if got > 0:
+                group_added += got
+                failures = 0
+            if got == 0: shared["wasted_requests"] = 1  # 1問も採用できなかったリクエスト
+            shared["wall_ms"] = (time.perf_counter() - t_req) * 1000
+            for i, n in alloc:
+                share = n / requested
+                values = {k: v * share for k, v in shared.items()}
+                values.update(per_chapter[i])
+                telemetry.record(level, tasks[i]["chapter"], **values)
+
             if failures >= 5:
-                # 無限ループ防止: 生成できなくても次へ進む
+                # 無限ループ防止: 生成できなくても次のセット・レベルへ進む
                 break
-        
-        task["status"] = "✅ 完了"
-        task["progress_text"] = f"{target_count}/{target_count} (100%)"
-        update_ui_callback(tasks, time_info, {'total': (i + 1) / total_tasks, 'chapter': 1.0})
 
-    return None
\ No newline at end of file
+        # セット×レベル完了時に書き出し、追加分を試験側のキャッシュに反映させる
+        _buffer_write(buffer.flush)
+        telemetry.flush()
+        if group_added > 0: data_cache.bump_data_version("generation")
+        for i in idxs:
+            tasks[i]["status"] = "✅ 完了"
+            tasks[i]["progress_text"] = f"{state[i]['added']}/{tasks[i]['target_count']}"
+        time_info["write_behind"] = buffer.get_metrics()
+        update_ui_callback(tasks, time_info, {'total': min(1.0, added_total() / total_target), 'chapter': 1.0})
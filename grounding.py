@@ -0,0 +1,230 @@
+import os
+import re
+import hashlib
+import threading
+from collections import Counter
+import numpy as np
+import logger
+import exam_config
+import text_utils
+
+# 教則PDF (rules.pdf) との照合 (グラウンディングチェック)
+# PDF の本文を章ごとに抽出して約300字のパッセージに分け、文字バイグラムの BM25 転置インデックスを作る。
+# インデックスは PDF の SHA-1 をキーに data/grounding_index.npz へ保存し、PDF が変わった時だけ作り直す。
+# 問題ごとに「どの章に最も近いか」と「PDF に現れるバイグラムの割合」を求め、
+# 指定章から外れた問題 (off_chapter) と PDF に根拠の見当たらない問題 (ungrounded) に印を付ける。
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.path.join(BASE_DIR, "data")
+PDF_PATH = os.path.join(BASE_DIR, "rules.pdf")
+INDEX_FILE = os.path.join(DATA_DIR, "grounding_index.npz")
+INDEX_VERSION = 1
+
+PASSAGE_CHARS = 300   # パッセージの長さ (正規化後の文字数)
+PASSAGE_STEP = 200    # パッセージの開始位置の間隔 (前後100字を重ねる)
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# 判定のしきい値 (PDF の本文を切り出して語順を崩した疑似問題で較正:
+# 正しい章の比率は常に 1.0、他の章を指定した場合の比率は 99% が 0.42 未満。
+# 被覆率は疑似問題で 0.86 以上、無関係な文章で 0.37〜0.66)
+OFF_CHAPTER_RATIO = 0.6  # 指定章のスコアが最良章のこの割合未満なら章外の疑い
+MIN_COVERAGE = 0.7       # PDF に現れるバイグラムの割合がこれ未満なら根拠不明
+MIN_TERMS = 8            # これより短い問題は判定しない
+
+FLAG_LABELS = {"off_chapter": "章外の疑い", "ungrounded": "根拠不明"}
+
+# 目次の行: "4. 無人航空機のシステム ........ 34" (節番号 "4.1" の行は対象外)
+_TOC_RE = re.compile(r'^\s*(\d+)\.\s*([^\s.\d][^.]*?)\s*\.{4,}\s*(\d+)\s*$', re.MULTILINE)
+_CH_FILE_RE = re.compile(r'ch(\d+)')
+
+def chapter_of(label):
+    """
+    "第4章 ..." / "ch4" → "4" (判定できなければ None)
+    """
+    if not label: return None
+    num = exam_config.chapter_num(label)
+    if num: return num
+    m = _CH_FILE_RE.search(str(label))
+    return m.group(1) if m else None
+
+def _pdf_hash(path):
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b""): h.update(block)
+    return h.hexdigest()
+
+def _extract_chapters(path):
+    """
+    PDF から {章番号: 本文} を取り出す。
+    目次の「章番号. 章名 ..... 印刷ページ」と、各ページ先頭行の印刷ページ番号を突き合わせて章の範囲を決める
+    """
+    from pypdf import PdfReader  # 重いので必要になった時だけ読み込む
+    pages = [p.extract_text() or "" for p in PdfReader(path).pages]
+
+    starts = {}
+    for text in pages[:10]:
+        for num, _title, printed in _TOC_RE.findall(text):
+            starts.setdefault(num, int(printed))
+    printed_to_index = {}
+    for i, text in enumerate(pages):
+        first = next((line.strip() for line in text.splitlines() if line.strip()), "")
+        if first.isdigit(): printed_to_index.setdefault(int(first), i)
+    if not starts or not printed_to_index:
+        raise ValueError("table of contents not found")
+
+    offsets = Counter(i - p for p, i in printed_to_index.items())
+    offset = offsets.most_common(1)[0][0]  # 番号の抜けたページ用 (印刷ページ → ページ位置の差)
+    order = sorted(starts.items(), key=lambda kv: kv[1])
+    chapters = {}
+    for k, (num, printed) in enumerate(order):
+        begin = printed_to_index.get(printed, printed + offset)
+        end = printed_to_index.get(order[k + 1][1], order[k + 1][1] + offset) if k + 1 < len(order) else len(pages)
+        chapters[num] = "\n".join(pages[begin:max(begin + 1, end)])
+    return chapters
+
+def _passages(text):
+    s = text_utils.normalize(text)
+    if len(s) <= PASSAGE_CHARS: return [s] if s else []
+    return [s[i:i + PASSAGE_CHARS] for i in range(0, len(s) - PASSAGE_STEP, PASSAGE_STEP)]
+
+def build_index(path=PDF_PATH):
+    """
+    PDF から BM25 転置インデックスを作り、numpy 配列の dict で返す。
+    語 (バイグラム) ごとのポスティングは CSR 形式 (term_ptr で区切った post_passage / post_weight)
+    """
+    chapters = _extract_chapters(path)
+    chapter_ids = sorted(chapters, key=int)
+    passage_terms = []
+    passage_chapter = []
+    for c, num in enumerate(chapter_ids):
+        for p in _passages(chapters[num]):
+            passage_terms.append(Counter(text_utils.bigrams(p, normalized=True)))
+            passage_chapter.append(c)
+    n = len(passage_terms)
+    lengths = np.array([sum(tf.values()) for tf in passage_terms], dtype=np.float64)
+    avg_len = lengths.mean() if n else 1.0
+
+    postings = {}
+    for pid, tf in enumerate(passage_terms):
+        for term, count in tf.items():
+            postings.setdefault(term, []).append((pid, count))
+    terms = sorted(postings)
+    term_ptr = np.zeros(len(terms) + 1, dtype=np.int64)
+    post_passage = []
+    post_weight = []
+    for t, term in enumerate(terms):
+        plist = postings[term]
+        idf = np.log(1 + (n - len(plist) + 0.5) / (len(plist) + 0.5))
+        for pid, count in plist:
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * lengths[pid] / avg_len)
+            post_passage.append(pid)
+            post_weight.append(idf * count * (BM25_K1 + 1) / (count + norm))
+        term_ptr[t + 1] = len(post_passage)
+    return {
+        "terms": np.array(terms),
+        "term_ptr": term_ptr,
+        "post_passage": np.array(post_passage, dtype=np.int32),
+        "post_weight": np.array(post_weight, dtype=np.float32),
+        "passage_chapter": np.array(passage_chapter, dtype=np.int16),
+        "chapter_ids": np.array(chapter_ids),
+    }
+
+class GroundingIndex:
+    """
+    読み込み済みのインデックス。score() は1問あたり数十マイクロ秒
+    """
+    def __init__(self, arrays):
+        self.terms = arrays["terms"]
+        self.term_ptr = arrays["term_ptr"]
+        self.post_passage = arrays["post_passage"]
+        self.post_weight = arrays["post_weight"]
+        self.passage_chapter = arrays["passage_chapter"]
+        self.chapter_ids = [str(c) for c in arrays["chapter_ids"]]
+        self.term_id = {t: i for i, t in enumerate(self.terms.tolist())}
+        self.n_passages = len(self.passage_chapter)
+        # パッセージは章順に並んでいるので、章ごとの最大値は reduceat で取れる
+        self.chapter_starts = np.searchsorted(self.passage_chapter, np.arange(len(self.chapter_ids)))
+
+    def score(self, text, chapter=None):
+        """
+        {"best": 最も近い章, "ratio": 指定章のスコア / 最良章のスコア, "coverage": PDF に現れるバイグラムの割合, "flags": [...]}
+        (短すぎる問題は None)
+        """
+        query = set(text_utils.bigrams(text))
+        if len(query) < MIN_TERMS: return None
+        ids = np.fromiter((i for i in map(self.term_id.get, query) if i is not None), dtype=np.int64)
+        coverage = len(ids) / len(query)
+        if len(ids) == 0:
+            return {"best": None, "ratio": None, "coverage": 0.0, "flags": ["ungrounded"]}
+
+        starts = self.term_ptr[ids]
+        counts = self.term_ptr[ids + 1] - starts
+        # 各語のポスティング範囲を1本の添字配列にまとめる
+        pos = np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+        scores = np.bincount(self.post_passage[pos], weights=self.post_weight[pos], minlength=self.n_passages)
+        by_chapter = np.maximum.reduceat(scores, self.chapter_starts)
+        best = int(by_chapter.argmax())
+        result = {"best": self.chapter_ids[best], "ratio": None, "coverage": round(coverage, 3), "flags": []}
+
+        if chapter in self.chapter_ids and by_chapter[best] > 0:
+            ratio = by_chapter[self.chapter_ids.index(chapter)] / by_chapter[best]
+            result["ratio"] = round(float(ratio), 3)
+            if ratio < OFF_CHAPTER_RATIO: result["flags"].append("off_chapter")
+        if coverage < MIN_COVERAGE: result["flags"].append("ungrounded")
+        return result
+
+    def check_question(self, q, chapter=None):
+        return self.score(text_utils.question_text(q), chapter)
+
+_index = None
+_index_key = None
+_index_lock = threading.Lock()
+
+def get_index():
+    """
+    PDF に対応するインデックスを返す (保存済みなら読み込み、無ければ作って保存)。
+    PDF や pypdf が無い・抽出できない場合は None (照合をスキップする)
+    """
+    global _index, _index_key
+    if not os.path.exists(PDF_PATH): return None
+    stat_key = None
+    try:
+        st = os.stat(PDF_PATH)
+        stat_key = (st.st_mtime_ns, st.st_size)
+        if _index_key == stat_key: return _index
+        with _index_lock:
+            if _index_key == stat_key: return _index
+            pdf_sha1 = _pdf_hash(PDF_PATH)
+            arrays = None
+            if os.path.exists(INDEX_FILE):
+                with np.load(INDEX_FILE) as saved:
+                    if str(saved["pdf_sha1"]) == pdf_sha1 and int(saved["version"]) == INDEX_VERSION:
+                        arrays = {k: saved[k] for k in saved.files}
+            if arrays is None:
+                with logger.span("grounding.build_index"):
+                    arrays = build_index(PDF_PATH)
+                os.makedirs(DATA_DIR, exist_ok=True)
+                tmp = INDEX_FILE + ".tmp.npz"
+                np.savez_compressed(tmp, pdf_sha1=np.array(pdf_sha1), version=np.array(INDEX_VERSION), **arrays)
+                os.replace(tmp, INDEX_FILE)
+                logger.log(f"Grounding index built: {len(arrays['terms'])} terms, {len(arrays['passage_chapter'])} passages", "GROUND")
+            _index = GroundingIndex(arrays)
+            _index_key = stat_key
+    except ImportError:
+        logger.log("pypdf not installed; grounding check skipped", "WARN")
+        _index, _index_key = None, stat_key
+    except Exception as e:
+        logger.error(e, "Grounding index unavailable")
+        _index, _index_key = None, stat_key
+    return _index
+
+def check_questions(questions, chapter=None):
+    """
+    問題のリストをまとめて照合し、同じ長さの結果リストを返す (インデックスが無ければ None)
+    """
+    index = get_index()
+    if index is None: return None
+    chapter = chapter_of(chapter) or chapter
+    with logger.span("grounding.check", count=len(questions)):
+        return [index.check_question(q, chapter) if isinstance(q, dict) else None for q in questions]
@@ -5,19 +5,23 @@ import shutil
 import glob
 import datetime
 import logger  # 共通ログを使用
+import data_cache
+import storage
+import catalog
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 DATA_DIR = os.path.join(BASE_DIR, "data")
 CSV_DIR = os.path.join(DATA_DIR, "csv_review")
 BACKUP_DIR = os.path.join(DATA_DIR, "backup_json")
 
+@logger.span("review.import")
 def run_import():
     logger.log("Starting Import...", "IMPORT")
     if not os.path.exists(CSV_DIR): return 0, 0
     if not os.path.exists(BACKUP_DIR): os.makedirs(BACKUP_DIR)
 
     csv_files = glob.glob(os.path.join(CSV_DIR, "*.csv"))
-    json_files = glob.glob(os.path.join(DATA_DIR, "db_*.json"))
+    json_files = catalog.list_db_files()
     json_filenames = {os.path.basename(p) for p in json_files}
     
     updates_by_file = {}
@@ -40,31 +44,13 @@ def run_import():
 
     for filename, rows in updates_by_file.items():
         json_path = os.path.join(DATA_DIR, filename)
-        file_updated_items = 0
         try:
-            shutil.copy2(json_path, os.path.join(BACKUP_DIR, f"{filename}_{now_str}.bak"))
-            
-            with open(json_path, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-            
-            data_map = {str(q['id']): q for q in data if 'id' in q}
-            
-            for row in rows:
-                q_id = str(row.get("ID", -1))
-                if q_id in data_map:
-                    target = data_map[q_id]
-                    target['question'] = row.get("問題文", target.get('question',''))
-                    target['answer'] = row.get("正解", target.get('answer',''))
-                    target['explanation'] = row.get("解説", target.get('explanation',''))
-                    if 'options' not in target: target['options'] = {}
-                    target['options']['1'] = row.get("選択肢1", target['options'].get('1',''))
-                    target['options']['2'] = row.get("選択肢2", target['options'].get('2',''))
-                    target['options']['3'] = row.get("選択肢3", target['options'].get('3',''))
-                    file_updated_items += 1
+            # 生成中の追記とぶつからないよう、バックアップ〜書き戻しまでをロック下で行う
+            with storage.file_lock(json_path):
+                shutil.copy2(json_path, os.path.join(BACKUP_DIR, f"{filename}_{now_str}.bak"))
+                file_updated_items = _apply_rows(json_path, rows)
             
             if file_updated_items > 0:
-                with open(json_path, 'w', encoding='utf-8') as f:
-                    json.dump(data, f, indent=4, ensure_ascii=False)
                 file_count += 1
                 total_update_count += file_updated_items
                 logger.log(f"Updated {filename}: {file_updated_items} items", "IMPORT")
@@ -73,7 +59,36 @@ def run_import():
             logger.error(e, f"Update failed {filename}")
         
     logger.log(f"Import finished: {file_count} files", "IMPORT")
+    if file_count > 0: data_cache.bump_data_version("import")
     return file_count, total_update_count
 
+def _apply_rows(json_path, rows):
+    """
+    CSVの行を JSON に反映し、更新件数を返す (ロック下で呼ぶこと)
+    """
+    with open(json_path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    
+    data_map = {str(q['id']): q for q in data if 'id' in q}
+    file_updated_items = 0
+    
+    for row in rows:
+        q_id = str(row.get("ID", -1))
+        if q_id in data_map:
+            target = data_map[q_id]
+            target['question'] = row.get("問題文", target.get('question',''))
+            target['answer'] = row.get("正解", target.get('answer',''))
+            target['explanation'] = row.get("解説", target.get('explanation',''))
+            if 'options' not in target: target['options'] = {}
+            target['options']['1'] = row.get("選択肢1", target['options'].get('1',''))
+            target['options']['2'] = row.get("選択肢2", target['options'].get('2',''))
+            target['options']['3'] = row.get("選択肢3", target['options'].get('3',''))
+            file_updated_items += 1
+    
+    if file_updated_items > 0:
+        text = storage.atomic_write_json(json_path, data)
+        catalog.record(json_path, data, text)
+    return file_updated_items
+
 if __name__ == "__main__":
     run_import()
\ No newline at end of file
@@ -0,0 +1,145 @@
+import os
+import time
+import numpy as np
+import logger
+import storage
+import data_cache
+import attempt_log
+
+# 項目分析バッチ
+# 受験ログ (attempt_log) 全体から問題ごとの 正答率 (p値)・点双列相関 (識別力)・選択肢ごとの選択率 を
+# ベクトル演算で求め、data/item_stats.json に書き出す。quiz_logic / view_manager が参照する。
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.path.join(BASE_DIR, "data")
+STATS_FILE = os.path.join(DATA_DIR, "item_stats.json")
+
+MIN_ANSWERS = 20        # 判定に必要な最低回答数
+EASY_P = 0.95           # これ以上の正答率は「易しすぎ」
+HARD_P = 0.20           # これ以下の正答率は「難しすぎ」(三択の当て推量 ≒ 0.33 を下回る)
+LOW_DISCRIMINATION = 0.1
+NEGATIVE_DISCRIMINATION = -0.1  # これ未満は「できる人ほど間違える」= 正解キー誤りの疑い
+
+# 出題から除外する条件 (正解キーの誤りが疑われるもの)。
+# 誤答肢が多く選ばれるだけなら単に難しい問題のこともあるので、識別力が負のときだけ除外する
+FLAG_LABELS = {
+    "too_easy": "易しすぎ",
+    "too_hard": "難しすぎ",
+    "low_discrimination": "識別力が低い",
+    "negative_discrimination": "識別力が負 (正解キー誤りの疑い)",
+    "distractor_dominant": "誤答肢が正解より多く選ばれている",
+}
+
+def compute_item_stats(table):
+    """
+    AttemptTable から {ref: {"n", "p", "r_pb", "choice_rates", "flags", "excluded"}} を計算する。
+    excluded (出題から除外するか) は分析時に決めて結果に含める (出題側は判定規則を持たない)
+    """
+    cols = table.cols
+    if len(table) == 0: return {}
+    ref = cols["ref_code"].astype(np.int64)
+    correct = cols["correct"].astype(np.float64)
+    choice = cols["choice"].astype(np.int64)
+
+    # 受験ごとの「その問題を除いた正答率」(rest score)
+    _, a_idx = np.unique(cols["attempt"], return_inverse=True)
+    att_n = np.bincount(a_idx)
+    att_c = np.bincount(a_idx, weights=correct)
+    rest_n = att_n[a_idx] - 1
+    valid = rest_n > 0
+    rest = np.zeros(len(ref))
+    rest[valid] = (att_c[a_idx][valid] - correct[valid]) / rest_n[valid]
+
+    size = int(ref.max()) + 1
+    n = np.bincount(ref, minlength=size)
+    nv = np.bincount(ref[valid], minlength=size)
+    p = np.bincount(ref, weights=correct, minlength=size) / np.maximum(n, 1)
+
+    # 点双列相関 r_pb = (M1 - M0) / s * sqrt(p q)  (rest score との相関)
+    rv, cv, xv = ref[valid], correct[valid], rest[valid]
+    n1 = np.bincount(rv, weights=cv, minlength=size)
+    n0 = nv - n1
+    sx = np.bincount(rv, weights=xv, minlength=size)
+    sx2 = np.bincount(rv, weights=xv * xv, minlength=size)
+    sx1 = np.bincount(rv, weights=xv * cv, minlength=size)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean = sx / nv
+        sd = np.sqrt(np.maximum(sx2 / nv - mean * mean, 0))
+        m1 = sx1 / n1
+        m0 = (sx - sx1) / n0
+        pv = n1 / nv
+        r_pb = (m1 - m0) / sd * np.sqrt(pv * (1 - pv))
+    r_pb = np.where(np.isfinite(r_pb), r_pb, np.nan)
+
+    # 選択肢ごとの選択率 (choice: 0=不明, 1〜3)
+    choice_counts = np.bincount(ref * 4 + np.clip(choice, 0, 3), minlength=size * 4).reshape(size, 4)
+    # 正解肢は「正解した回答の選択肢」から推定する
+    correct_choice = np.bincount(ref * 4 + np.clip(choice, 0, 3), weights=correct, minlength=size * 4).reshape(size, 4).argmax(axis=1)
+
+    names = table.strings.get("ref", [])
+    out = {}
+    for code in np.nonzero(n)[0]:
+        if code >= len(names): continue
+        counts = choice_counts[code]
+        total = int(n[code])
+        rates = {str(k): round(float(counts[k] / total), 3) for k in (1, 2, 3)}
+        rp = None if np.isnan(r_pb[code]) else round(float(r_pb[code]), 3)
+        flags = []
+        if total >= MIN_ANSWERS:
+            if p[code] >= EASY_P: flags.append("too_easy")
+            if p[code] <= HARD_P: flags.append("too_hard")
+            if rp is not None:
+                if rp < NEGATIVE_DISCRIMINATION: flags.append("negative_discrimination")
+                elif rp < LOW_DISCRIMINATION: flags.append("low_discrimination")
+            ans = int(correct_choice[code])
+            if ans and max(counts[k] for k in (1, 2, 3) if k != ans) > counts[ans]:
+                flags.append("distractor_dominant")
+        out[names[code]] = {
+            "n": total, "p": round(float(p[code]), 3), "r_pb": rp,
+            "choice_rates": rates, "flags": flags,
+            "excluded": is_excluded({"flags": flags, "r_pb": rp}),
+        }
+    return out
+
+def run_item_analysis():
+    logger.log("Starting item analysis...", "ITEM")
+    t0 = time.perf_counter()
+    # 通常の試験だけを使う (復習・間違えた問題の再受験は出題が偏り、解説を見た直後の回答なので p値・識別力を歪める)
+    table = attempt_log.load_table()
+    table = table.subset(table.mask(kind=attempt_log.KIND_EXAM))
+    items = compute_item_stats(table)
+    result = {
+        "generated_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "answers": len(table),
+        "items": items,
+    }
+    storage.atomic_write_json(STATS_FILE, result)
+    flagged = sum(1 for v in items.values() if v["flags"])
+    logger.log(f"Item analysis finished: {len(items)} items, {flagged} flagged ({(time.perf_counter() - t0) * 1000:.0f}ms)", "ITEM")
+    # 出題側 (quiz_logic) のフィルタに反映させる
+    data_cache.bump_data_version("item_analysis")
+    return len(items), flagged
+
+def is_excluded(item):
+    """
+    正解キーの誤りが疑われ、出題から除外すべき問題か
+    """
+    flags = item.get("flags", [])
+    if "negative_discrimination" in flags: return True
+    rp = item.get("r_pb")
+    return "distractor_dominant" in flags and rp is not None and rp < 0
+
+def quality_sort_key(item):
+    """
+    問題の悪い順に並べるためのキー: 除外対象 → フラグ数 → 識別力の低い順
+    """
+    flags = item.get("flags", [])
+    rp = item.get("r_pb")
+    return (
+        0 if item.get("excluded") else 1,
+        -len(flags),
+        rp if rp is not None else 1.0,
+    )
+
+if __name__ == "__main__":
+    run_item_analysis()
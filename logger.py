@@ -1,6 +1,32 @@
+import os
+import sys
+import json
+import math
 import time
+import threading
 import traceback
-import sys
+import contextlib
+from collections import defaultdict, deque
+
+# 計測: カウンタ・ヒストグラム・タイミングスパン
+# 環境変数 DRONE_LOG_JSON にファイルパスを指定すると、ログ/スパン/エラーを JSON Lines でも出力する。
+JSON_LOG_FILE = os.environ.get("DRONE_LOG_JSON", "")
+HIST_MAX_SAMPLES = 5000  # ヒストグラムごとに保持する直近サンプル数
+
+_lock = threading.Lock()
+_json_lock = threading.Lock()
+_counters = defaultdict(int)
+_histograms = defaultdict(lambda: {"count": 0, "sum": 0.0, "max": 0.0, "samples": deque(maxlen=HIST_MAX_SAMPLES)})
+
+def _emit_json(record):
+    if not JSON_LOG_FILE: return
+    record = dict(record, ts=round(time.time(), 3), pid=os.getpid())
+    try:
+        line = json.dumps(record, ensure_ascii=False, default=str)
+        with _json_lock:
+            with open(JSON_LOG_FILE, 'a', encoding='utf-8') as f:
+                f.write(line + "\n")
+    except Exception: pass
 
 def log(msg, level="INFO"):
     """
@@ -8,6 +34,7 @@ def log(msg, level="INFO"):
     """
     timestamp = time.strftime("%H:%M:%S")
     print(f"[{timestamp}] [{level}] {msg}", flush=True)
+    _emit_json({"type": "log", "level": level, "msg": str(msg)})
 
 def error(e, msg="An error occurred"):
     """
@@ -16,5 +43,128 @@ def error(e, msg="An error occurred"):
     timestamp = time.strftime("%H:%M:%S")
     print(f"[{timestamp}] [ERROR] {msg}: {str(e)}", flush=True)
     print("--- Error Traceback ---", flush=True)
-    traceback.print_exc() 
-    print("-----------------------", flush=True)
\ No newline at end of file
+    traceback.print_exc()
+    print("-----------------------", flush=True)
+    incr("errors")
+    _emit_json({"type": "error", "msg": msg, "error": str(e)})
+
+def incr(name, value=1):
+    """
+    カウンタを加算する
+    """
+    with _lock:
+        _counters[name] += value
+
+def observe(name, value):
+    """
+    ヒストグラムに値 (通常はミリ秒) を1件記録する
+    """
+    with _lock:
+        h = _histograms[name]
+        h["count"] += 1
+        h["sum"] += value
+        h["max"] = max(h["max"], value)
+        h["samples"].append(value)
+
+class span(contextlib.ContextDecorator):
+    """
+    処理時間を計測してヒストグラム name に記録する。
+    with logger.span("gen.request", model=m): ...  または  @logger.span("render.exam")
+    """
+    def __init__(self, name, **attrs):
+        self.name = name
+        self.attrs = attrs
+        self.t0 = None
+
+    def _recreate_cm(self):
+        # デコレータとして使う場合は呼び出しごとに新しいインスタンスで計測する
+        return span(self.name, **self.attrs)
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        ms = (time.perf_counter() - self.t0) * 1000
+        observe(self.name, ms)
+        # Streamlit の st.rerun() などの制御用例外 (BaseException) はエラーに数えない
+        if exc_type is not None and issubclass(exc_type, Exception):
+            incr(f"{self.name}.errors")
+        _emit_json({"type": "span", "name": self.name, "ms": round(ms, 3), "ok": exc_type is None, **self.attrs})
+        return False
+
+def percentile(sorted_values, p):
+    """
+    最近順位法 (nearest-rank) の分位点。確認: python -m doctest logger.py
+
+    >>> percentile(list(range(1, 11)), 50)
+    5
+    >>> percentile(list(range(1, 21)), 95)
+    19
+    >>> percentile(list(range(1, 21)), 100), percentile([7], 50), percentile([], 50)
+    (20, 7, 0.0)
+    """
+    if not sorted_values: return 0.0
+    idx = min(len(sorted_values) - 1, max(0, math.ceil(p / 100 * len(sorted_values)) - 1))
+    return sorted_values[idx]
+
+def _summarize(values, count=None, total=None, vmax=None):
+    vals = sorted(values)
+    count = len(vals) if count is None else count
+    total = sum(vals) if total is None else total
+    return {
+        "count": count,
+        "avg": round(total / count, 2) if count else 0.0,
+        "p50": round(percentile(vals, 50), 2),
+        "p95": round(percentile(vals, 95), 2),
+        "max": round(max(vals) if vmax is None and vals else (vmax or 0.0), 2),
+    }
+
+def get_metrics():
+    """
+    {"counters": {name: value}, "histograms": {name: {"count", "avg", "p50", "p95", "max"}}} を返す
+    """
+    with _lock:
+        counters = dict(_counters)
+        hists = {name: (list(h["samples"]), h["count"], h["sum"], h["max"]) for name, h in _histograms.items()}
+    return {
+        "counters": counters,
+        "histograms": {name: _summarize(s, c, t, m) for name, (s, c, t, m) in hists.items()},
+    }
+
+def summary_report(metrics=None):
+    """
+    スパン/ヒストグラムごとの p50/p95 をテキスト表にする
+    """
+    metrics = metrics or get_metrics()
+    lines = [f"{'span':<36}{'count':>8}{'avg(ms)':>10}{'p50(ms)':>10}{'p95(ms)':>10}{'max(ms)':>10}"]
+    for name, h in sorted(metrics["histograms"].items()):
+        lines.append(f"{name:<36}{h['count']:>8}{h['avg']:>10.1f}{h['p50']:>10.1f}{h['p95']:>10.1f}{h['max']:>10.1f}")
+    if metrics.get("counters"):
+        lines.append("")
+        for name, v in sorted(metrics["counters"].items()):
+            lines.append(f"{name:<36}{v:>8}")
+    return "\n".join(lines)
+
+def summarize_file(path):
+    """
+    JSON Lines 出力 (DRONE_LOG_JSON) からスパンの集計を作る (複数プロセス分もまとめて集計できる)
+    """
+    spans = defaultdict(list)
+    counters = defaultdict(int)
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try: rec = json.loads(line)
+            except ValueError: continue
+            if rec.get("type") == "span":
+                spans[rec["name"]].append(float(rec["ms"]))
+                if not rec.get("ok", True): counters[f"{rec['name']}.errors"] += 1
+            elif rec.get("type") == "error":
+                counters["errors"] += 1
+    return {"counters": dict(counters), "histograms": {n: _summarize(v) for n, v in spans.items()}}
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("使い方: python logger.py <DRONE_LOG_JSON で出力したファイル>")
+        sys.exit(1)
+    print(summary_report(summarize_file(sys.argv[1])))
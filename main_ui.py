@@ -2,11 +2,11 @@
 import streamlit as st
 import os
 import time
-import json
 import ui_parts
-import view_exam
-import view_generator
-import view_manager
+import data_cache
+# 各画面 (view_*) は選択時に遅延読み込みする。
+# view_generator / view_manager は pandas や google.generativeai を読み込むため、
+# 模擬試験だけを使う場合の起動・再実行コストを抑える。(計測: python bench_startup.py)
 
 st.set_page_config(page_title="ドローン試験システム", layout="wide")
 
@@ -18,21 +18,16 @@ defaults = {
     "exam_state": "MENU", "questions": [], "score": 0, "current_index": 0,
     "user_answers": [], "start_time": 0.0, "total_consumed": 0.0, "time_limit": 0,
     "is_explaining": False, "mode_real": False, "is_generating": False,
-    "gen_success": False, "gen_error": None, "db_errors": None, "maintenance_msg": None
+    "gen_success": False, "gen_error": None, "db_errors": None, "maintenance_msg": None,
+    "exam_id": 0, "timer_seq": 0, "user_name": "ゲスト", "logged_exam_id": 0,
+    "exam_code": None, "exam_code_note": None, "exam_kind": None
 }
 for key, val in defaults.items():
     if key not in st.session_state: st.session_state[key] = val
 
-# DBエラー状態の初期ロード
-BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-STATUS_FILE = os.path.join(BASE_DIR, "data", "db_status.json")
+# DBエラー状態の初期ロード (プロセス全体でキャッシュ済みの診断結果を使う)
 if st.session_state.db_errors is None:
-    if os.path.exists(STATUS_FILE):
-        try:
-            with open(STATUS_FILE, 'r', encoding='utf-8') as f:
-                st.session_state.db_errors = json.load(f)
-        except: st.session_state.db_errors = []
-    else: st.session_state.db_errors = []
+    st.session_state.db_errors = data_cache.get_db_status()
 
 # ロック状態の判定: 生成中 または 試験中(EXAM)の場合は操作をロック
 locked = st.session_state.is_generating or (st.session_state.exam_state == "EXAM")
@@ -40,7 +35,7 @@ locked = st.session_state.is_generating or (st.session_state.exam_state == "EXAM
 with st.sidebar:
     st.title("🚁 メニュー")
     # lockedがTrueの場合、ラジオボタンが無効化され移動できなくなる
-    mode = st.radio("機能を選択", ["📚 模擬試験", "📝 問題作成", "📊 データ管理・保守"], disabled=locked)
+    mode = st.radio("機能を選択", ["📚 模擬試験", "📈 学習分析", "📝 問題作成", "📊 データ管理・保守"], disabled=locked)
     
     if st.session_state.db_errors:
         st.warning(f"⚠️ データ不備: {len(st.session_state.db_errors)}件")
@@ -51,10 +46,16 @@ with st.sidebar:
         time.sleep(1)
         os._exit(0)
 
-# 機能ルーティング
+# 機能ルーティング (import は初回のみ実行され、以降は sys.modules から取得される)
 if mode == "📚 模擬試験":
+    import view_exam
     view_exam.render()
+elif mode == "📈 学習分析":
+    import view_analytics
+    view_analytics.render()
 elif mode == "📝 問題作成":
+    import view_generator
     view_generator.render(locked)
 elif mode == "📊 データ管理・保守":
+    import view_manager
     view_manager.render(locked)
\ No newline at end of file
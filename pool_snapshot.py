@@ -0,0 +1,240 @@
+import os
+import glob
+import json
+import mmap
+import time
+import struct
+import hashlib
+import numpy as np
+import logger
+import storage
+import exam_config
+import catalog
+import text_utils
+
+# 問題プールのバイナリスナップショット (data/pool_{署名}.bin)
+# 全問題ファイルを1ファイルにまとめ、読み取り専用で mmap して使う。
+# 複数のサーバープロセスが同じスナップショットを開けば、OS のページキャッシュ上の1コピーを共有できる。
+#
+# 形式: MAGIC(8) | ヘッダ長 u32 | ヘッダ JSON (文字列表・件数・各領域の位置) | レコード配列 | 問題本文 (UTF-8 JSON の連結)
+# レコードは固定長で、モデル・レベル・章は文字列表の添字、本文は (offset, length) で指す。
+# 絞り込みはレコード配列 (numpy, コピーなし) だけで行い、出題する問題の本文だけを JSON として読む。
+# 署名はカタログの (ファイル名, 内容ハッシュ) から作るため、問題ファイルが変わると別名のスナップショットになる。
+# 複数モデルが同じ問題文 (正規化後) を持つ場合は、レベルごとに最初のレコード (ファイル名順) を代表とし、
+# 他のレコードの canon に代表のレコード番号を入れる (「全モデル」出題の重複除去に使う)。
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.path.join(BASE_DIR, "data")
+MAGIC = b"DQPOOL01"
+FORMAT_VERSION = 2
+KEEP_SNAPSHOTS = 2  # 古いスナップショットはこの数だけ残す (開いているプロセスがあるため)
+
+RECORD_DTYPE = np.dtype([
+    ("model", "<u4"), ("level", "<u4"), ("chapter", "<u4"), ("chnum", "<u4"),
+    ("id", "<i8"), ("offset", "<u8"), ("length", "<u4"), ("canon", "<u4"),
+])
+NO_ID = -1
+
+def signature(entries):
+    """
+    カタログ {ファイル名: エントリ} からスナップショットの署名を作る
+    """
+    h = hashlib.sha1(f"v{FORMAT_VERSION}".encode())
+    for fname, entry in sorted(entries.items()):
+        h.update(f"{fname}:{entry.get('hash')}\n".encode("utf-8"))
+    return h.hexdigest()[:16]
+
+def snapshot_path(sig):
+    return os.path.join(DATA_DIR, f"pool_{sig}.bin")
+
+def _align(n, size=8):
+    return (n + size - 1) // size * size
+
+def build(entries, path):
+    """
+    カタログに載っている問題ファイルを読み、スナップショットを書き出す。問題数を返す
+    """
+    strings = [""]
+    string_ids = {"": 0}
+    def sid(text):
+        text = "" if text is None else str(text)
+        i = string_ids.get(text)
+        if i is None:
+            i = string_ids[text] = len(strings)
+            strings.append(text)
+        return i
+
+    rows = []
+    blob = bytearray()
+    canon_of = {}  # (レベル, 正規化した問題文) → 代表のレコード番号
+    for fname, entry in sorted(entries.items()):
+        try:
+            with open(os.path.join(DATA_DIR, fname), 'r', encoding='utf-8') as fp:
+                data = json.load(fp)
+        except Exception as e:
+            logger.error(e, f"Read error {fname}")
+            continue
+        if not isinstance(data, list): continue
+        model = sid(entry["model"])
+        for q in data:
+            if not isinstance(q, dict): continue
+            body = json.dumps(q, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+            qid = q.get("id")
+            canon = canon_of.setdefault((q.get("level"), text_utils.normalize(str(q.get("question", "")))), len(rows))
+            rows.append((
+                model, sid(q.get("level")), sid(q.get("chapter")), sid(exam_config.chapter_num(q.get("chapter", "")) or ""),
+                qid if isinstance(qid, int) and not isinstance(qid, bool) else NO_ID, len(blob), len(body), canon,
+            ))
+            blob += body
+
+    records = np.array(rows, dtype=RECORD_DTYPE)
+    header = {"format": FORMAT_VERSION, "count": len(records), "strings": strings, "built_at": time.strftime("%Y-%m-%d %H:%M:%S")}
+    # ヘッダの長さが決まらないと各領域の位置が決まらないため、位置を仮置きして2回組み立てる
+    header.update(records_offset=0, blob_offset=0)
+    for _ in range(2):
+        head = json.dumps(header, ensure_ascii=False).encode("utf-8")
+        records_offset = _align(len(MAGIC) + 4 + len(head))
+        header.update(records_offset=records_offset, blob_offset=records_offset + records.nbytes)
+    head = json.dumps(header, ensure_ascii=False).encode("utf-8")
+    out = bytearray(MAGIC + struct.pack("<I", len(head)) + head)
+    out += b"\0" * (header["records_offset"] - len(out))
+    out += records.tobytes()
+    out += blob
+    storage.atomic_write_bytes(path, bytes(out), fsync=False)
+    return len(records)
+
+class PoolSnapshot:
+    """
+    mmap したスナップショット。レコード配列はファイルの内容をそのまま参照する (読み取り専用)
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mm[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"not a pool snapshot: {os.path.basename(path)}")
+        (head_len,) = struct.unpack_from("<I", self._mm, len(MAGIC))
+        start = len(MAGIC) + 4
+        header = json.loads(self._mm[start:start + head_len].decode("utf-8"))
+        if header.get("format") != FORMAT_VERSION:
+            raise ValueError(f"unsupported snapshot format: {header.get('format')}")
+        self.count = header["count"]
+        self.strings = header["strings"]
+        self.built_at = header.get("built_at")
+        self._blob_offset = header["blob_offset"]
+        self.records = np.frombuffer(self._mm, dtype=RECORD_DTYPE, count=self.count, offset=header["records_offset"])
+        self._string_ids = {s: i for i, s in enumerate(self.strings)}
+        self._duplicates = None
+
+    def __len__(self):
+        return self.count
+
+    def string_id(self, text):
+        """
+        文字列表の添字 (スナップショットに無い文字列は -1)
+        """
+        return self._string_ids.get(text, -1)
+
+    def select(self, level=None, model=None, unique=False):
+        """
+        条件に合うレコードの添字配列 (本文は読まない)。unique=True なら重複する問題は代表のレコードだけ
+        """
+        mask = np.ones(self.count, dtype=bool)
+        if level is not None: mask &= self.records["level"] == self.string_id(level)
+        if model is not None: mask &= self.records["model"] == self.string_id(model)
+        if unique: mask &= self.records["canon"] == np.arange(self.count, dtype=np.uint32)
+        return np.flatnonzero(mask)
+
+    def source_models(self, i):
+        """
+        i 番目の問題と同じ問題を持つモデルの一覧 (i のモデルが先頭)
+        """
+        if self._duplicates is None:
+            # 重複は少ないため、代表 → 重複レコードの対応を初回に1回だけ作る
+            canon = self.records["canon"]
+            dup = np.flatnonzero(canon != np.arange(self.count, dtype=np.uint32))
+            duplicates = {}
+            for d, c in zip(dup.tolist(), canon[dup].tolist()): duplicates.setdefault(c, []).append(d)
+            self._duplicates = duplicates
+        c = int(self.records["canon"][i])
+        return list(dict.fromkeys(self.strings[self.records["model"][j]] for j in [i, c] + self._duplicates.get(c, [])))
+
+    def group_by_chapter(self, indices):
+        """
+        レコード番号を章番号ごとに分ける {章番号 (無ければ "others"): [レコード番号]}
+        """
+        indices = np.asarray(indices, dtype=np.int64)
+        chnums = self.records["chnum"][indices]
+        order = np.argsort(chnums, kind="stable")
+        keys, starts = np.unique(chnums[order], return_index=True)
+        groups = {}
+        for key, part in zip(keys.tolist(), np.split(indices[order], starts[1:])):
+            groups[self.strings[key] or "others"] = part.tolist()
+        return groups
+
+    def ref(self, i):
+        """
+        data_cache.question_ref と同じ参照キーを本文を読まずに作る
+        """
+        r = self.records[i]
+        qid = int(r["id"])
+        return f"{self.strings[r['model']]}|{self.strings[r['level']]}|{self.strings[r['chnum']] or 'X'}|{qid if qid != NO_ID else ''}"
+
+    def lookup(self, refs):
+        """
+        参照キーのリストをレコード番号のリストにする (見つからないキーは None)
+        """
+        out = []
+        for ref in refs:
+            model, level, chnum, qid = (str(ref).split("|") + ["", "", "", ""])[:4]
+            try: qid = int(qid)
+            except ValueError: qid = NO_ID
+            ids = [self.string_id(model), self.string_id(level), self.string_id("" if chnum == "X" else chnum)]
+            if min(ids) < 0:
+                out.append(None)
+                continue
+            r = self.records
+            hit = np.flatnonzero((r["id"] == qid) & (r["model"] == ids[0]) & (r["level"] == ids[1]) & (r["chnum"] == ids[2]))
+            out.append(int(hit[0]) if len(hit) else None)
+        return out
+
+    def question(self, i):
+        """
+        i 番目の問題を dict として返す (呼び出しごとに新しい dict。source_model を付ける)
+        """
+        r = self.records[i]
+        start = self._blob_offset + int(r["offset"])
+        q = json.loads(self._mm[start:start + int(r["length"])].decode("utf-8"))
+        q["source_model"] = self.strings[r["model"]]
+        return q
+
+def _cleanup(keep_path):
+    """
+    古いスナップショットを新しい順に KEEP_SNAPSHOTS 個まで残して消す (開いているプロセスがあれば失敗するので無視)
+    """
+    paths = sorted(glob.glob(os.path.join(DATA_DIR, "pool_*.bin")), key=os.path.getmtime, reverse=True)
+    for p in [p for p in paths if p != keep_path][KEEP_SNAPSHOTS - 1:]:
+        for target in (p, p + ".lock"):
+            try: os.remove(target)
+            except OSError: pass
+
+def open_snapshot(entries):
+    """
+    カタログに対応するスナップショットを開く (無ければ作る)。
+    複数プロセスが同時に呼んでも作るのは1プロセスだけで、他はそれを待って開く
+    """
+    path = snapshot_path(signature(entries))
+    if not os.path.exists(path):
+        with storage.file_lock(path):
+            if not os.path.exists(path):
+                t0 = time.perf_counter()
+                with logger.span("cache.build_snapshot"):
+                    count = build(entries, path)
+                logger.log(f"Pool snapshot built: {count} questions -> {os.path.basename(path)} ({(time.perf_counter() - t0) * 1000:.0f}ms)", "CACHE")
+                _cleanup(path)
+    return PoolSnapshot(path)
+
+if __name__ == "__main__":
+    # デプロイ時などに事前にスナップショットを作っておく: python pool_snapshot.py
+    snap = open_snapshot(catalog.get_entries())
+    print(f"{os.path.basename(snap.path)}: {len(snap)} questions (built {snap.built_at})")
@@ -0,0 +1,73 @@
+# 問題データのスキーマ (生成時の response_schema と、取り込み・診断時のローカル検証で共通に使う)
+# 1問 = {"question": 非空文字列, "options": {"1","2","3": 非空文字列}, "answer": "1"|"2"|"3", "explanation": 非空文字列}
+
+OPTION_KEYS = ("1", "2", "3")
+REQUIRED_KEYS = ("question", "options", "answer", "explanation")
+
+QUESTION_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "question": {"type": "string"},
+        "options": {
+            "type": "object",
+            "properties": {k: {"type": "string"} for k in OPTION_KEYS},
+            "required": list(OPTION_KEYS),
+        },
+        "answer": {"type": "string", "format": "enum", "enum": list(OPTION_KEYS)},
+        "explanation": {"type": "string"},
+    },
+    "required": list(REQUIRED_KEYS),
+}
+
+def list_schema():
+    """
+    1章分の問題配列のスキーマ
+    """
+    return {"type": "array", "items": QUESTION_SCHEMA}
+
+def batch_schema(chapter_ids):
+    """
+    章ID (ch4 など) をキー、問題の配列を値とするオブジェクトのスキーマ
+    """
+    return {
+        "type": "object",
+        "properties": {cid: list_schema() for cid in chapter_ids},
+        "required": list(chapter_ids),
+    }
+
+def normalize_question(q):
+    """
+    軽微な揺れ (数値の正解・前後の空白) を直した問題を返す (元の dict は変更しない)
+    """
+    if not isinstance(q, dict): return q
+    q = dict(q)
+    for k in ("question", "explanation"):
+        if isinstance(q.get(k), str): q[k] = q[k].strip()
+    if isinstance(q.get("answer"), (int, str)) and not isinstance(q.get("answer"), bool):
+        q["answer"] = str(q["answer"]).strip()
+    if isinstance(q.get("options"), dict):
+        q["options"] = {str(k): (v.strip() if isinstance(v, str) else v) for k, v in q["options"].items()}
+    return q
+
+def validate_question(q):
+    """
+    スキーマ違反の項目名のリストを返す (問題なければ空リスト)。
+    check_db の「不備項目」にもそのまま使う
+    """
+    if not isinstance(q, dict): return ["(形式)"]
+    problems = [k for k in REQUIRED_KEYS if not q.get(k)]
+    options = q.get("options")
+    if isinstance(options, dict):
+        if any(not isinstance(options.get(k), str) or not options.get(k) for k in OPTION_KEYS):
+            problems.append("options(1-3)")
+    elif "options" not in problems:
+        problems.append("options")
+    if q.get("answer") and str(q.get("answer")) not in OPTION_KEYS:
+        problems.append("answer(1-3)")
+    for k in ("question", "explanation"):
+        if q.get(k) and not isinstance(q[k], str) and k not in problems:
+            problems.append(k)
+    return problems
+
+def is_valid_question(q):
+    return not validate_question(q)
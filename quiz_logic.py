@@ -1,130 +1,130 @@
 import os
-import json
-import glob
 import random
-import re
 from collections import defaultdict
 import logger
+import data_cache
+import srs
+import exam_config
+import text_utils
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 DATA_DIR = os.path.join(BASE_DIR, "data")
-CONFIG_FILE = os.path.join(BASE_DIR, "exam_config.json")
-
-def load_config():
-    if os.path.exists(CONFIG_FILE):
-        try:
-            with open(CONFIG_FILE, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except Exception as e:
-            logger.error(e, "Config load failed")
-    return {}
 
 def get_available_models_info():
     logger.log("Scanning stock...", "QUIZ")
-    files = glob.glob(os.path.join(DATA_DIR, "db_*.json"))
-    stats = defaultdict(lambda: {'total': 0, '二等': 0, '一等': 0})
-    
-    for f in files:
-        fname = os.path.basename(f)
-        if not fname.startswith("db_"): continue
-        
-        # ファイル名解析: db_{model}_{level}_{chapter}.json
-        # split('_') だとモデル名の中のアンダースコアで崩れるため、後ろから解析する等の工夫が必要だが
-        # ここでは簡易的に「拡張子除去」「先頭db_除去」してから分解を試みる
-        core_name = fname[3:-5] # "db_" と ".json" を除く
-        parts = core_name.split('_')
-        
-        if len(parts) >= 3:
-            chapter = parts[-1]
-            level = parts[-2]
-            # 残りがモデル名
-            model_name = "_".join(parts[:-2])
-            
-            try:
-                with open(f, 'r', encoding='utf-8') as fp:
-                    data = json.load(fp)
-                    count = len(data)
-                    stats[model_name]['total'] += count
-                    if level in stats[model_name]:
-                        stats[model_name][level] += count
-            except: pass
-    return dict(stats)
+    return data_cache.get_stock_stats()["models"]
 
 def count_total_questions():
     info = get_available_models_info()
     return sum(m['total'] for m in info.values())
 
-def get_exam_questions(level, total_count_request, target_model=None):
-    logger.log(f"Exam Req: {level}, {total_count_request}qs, Model={target_model}", "QUIZ")
-    
-    files = glob.glob(os.path.join(DATA_DIR, "db_*.json"))
-    candidates = []
+# 出題ソース「全モデル」: 全モデルの問題を1つのプールとして出題する。
+# 同じ問題文 (正規化後) が複数モデルにあれば1問として扱い、出典は source_model (代表) と source_models (全モデル) に残す
+ALL_MODELS = "__all__"
+
+def unique_questions(questions):
+    """
+    問題文の重複を除く (最初の問題を残し、重複していたモデルを source_models に集める)
+    """
+    unique = {}
+    for q in questions:
+        key = text_utils.normalize(str(q.get('question', '')))
+        first = unique.get(key)
+        if first is None:
+            unique[key] = (q, [q.get('source_model')])
+        elif q.get('source_model') not in first[1]:
+            first[1].append(q.get('source_model'))
+    return [dict(q, source_models=models) for q, models in unique.values()]
+
+def get_all_models_info():
+    """
+    「全モデル」の在庫 (重複を除いた問題数) {'total', レベル: 問題数}
+    """
+    levels = exam_config.get_config().levels
+    snap = data_cache.get_pool_snapshot()
+    if snap is not None:
+        counts = {level: len(snap.select(level, unique=True)) for level in levels}
+    else:
+        counts = {level: len(unique_questions(q for entry in data_cache.get_question_pool() for q in entry["questions"] if q.get('level') == level)) for level in levels}
+    return dict(counts, total=sum(counts.values()))
+
+# 出題モード: ランダム / 復習優先 (回答履歴に基づく間隔反復)
+MODE_RANDOM = "random"
+MODE_REVIEW = "review"
+
+
+def _group_by_chapter(questions):
+    grouped = defaultdict(list)
+    for q in questions:
+        grouped[exam_config.chapter_num(q.get('chapter', '')) or "others"].append(q)
+    return grouped
+
+@logger.span("quiz.get_exam_questions")
+def get_exam_questions(level, total_count_request, target_model=None, mode=MODE_RANDOM, user=None, exclude_flagged=True, seed=None):
+    """
+    試験の問題リストを返す。seed を指定すると、同じデータバージョンでは同じ試験 (問題と順序) になる (ランダム出題のみ)。
+    項目分析の除外結果もデータバージョンに含まれる (分析の実行でバージョンが変わる) ため、分析の前後では同じ seed でも試験は変わる
+    """
+    logger.log(f"Exam Req: {level}, {total_count_request}qs, Model={target_model}, Mode={mode}, Seed={seed}", "QUIZ")
+    rng = random.Random(seed) if seed is not None else random
     
-    for f in files:
-        fname = os.path.basename(f)
-        
-        # ファイル名からモデル名を抽出
-        # db_{model}_{level}_{ch}.json
-        core_name = fname[3:-5]
-        parts = core_name.split('_')
-        if len(parts) >= 3:
-            current_file_model = "_".join(parts[:-2])
-        else:
-            current_file_model = "unknown"
-
-        # モデル指定がある場合のフィルタリング
-        if target_model and current_file_model != target_model:
-            continue
-        
-        try:
-            with open(f, 'r', encoding='utf-8') as fp:
-                data = json.load(fp)
-                # レベル一致チェック
-                for q in data:
-                    if q.get('level') == level:
-                        # ★重要: 出典情報をデータに注入する
-                        q['source_model'] = current_file_model
-                        candidates.append(q)
-                        
-        except Exception as e:
-            logger.error(e, f"Read error {fname}")
+    # 項目分析で「正解キー誤りの疑い」とされた問題 (分析結果の excluded) は出題しない
+    excluded = set()
+    if exclude_flagged:
+        excluded = {ref for ref, item in data_cache.get_item_stats().items() if item.get("excluded")}
+
+    # 候補は mmap スナップショットのレコード番号 (本文は出題する問題だけ読む)。
+    # スナップショットが使えなければ共有の問題プール (dict) から選ぶ
+    all_models = target_model == ALL_MODELS
+    snap = data_cache.get_pool_snapshot()
+    if snap is not None:
+        candidates = snap.select(level, None if all_models else target_model, unique=all_models).tolist()
+        ref_of, group_by_chapter, load = snap.ref, snap.group_by_chapter, snap.question
+        if all_models:
+            load = lambda i: dict(snap.question(i), source_models=snap.source_models(i))
+    else:
+        candidates = []
+        for entry in data_cache.get_question_pool():
+            # モデル指定がある場合のフィルタリング
+            if target_model and not all_models and entry["model"] != target_model:
+                continue
+            # レベル一致チェック
+            candidates.extend(q for q in entry["questions"] if q.get('level') == level)
+        # 問題プールはプロセス全体で共有されるため、出題に使う問題はコピーして返す
+        ref_of, group_by_chapter, load = data_cache.question_ref, _group_by_chapter, dict
+        if all_models: candidates = unique_questions(candidates)
+    if excluded:
+        candidates = [c for c in candidates if ref_of(c) not in excluded]
     
     if not candidates:
         logger.log("No candidates.", "WARN")
         return []
 
-    # 以下、ウェイト処理等は変更なし
-    config = load_config()
-    weights = {}
-    if level in config:
-        weights = config[level].get("weights", {})
-    
-    if not weights:
-        if len(candidates) <= total_count_request:
-            random.shuffle(candidates)
-            return candidates
-        return random.sample(candidates, total_count_request)
+    # 章ごとの抽出方法: ランダム抽出 or 履歴の優先度キュー (期限切れ・苦手な問題を優先)
+    picker = rng.sample
+    if mode == MODE_REVIEW and user:
+        picker = srs.make_picker(user, ref_of=ref_of)
 
-    grouped_qs = defaultdict(list)
-    def extract_chapter_num(text):
-        m = re.search(r'第(\d+)章', str(text))
-        return m.group(1) if m else "others"
+    config = exam_config.get_config()
+    chapters = config.level(level).chapters if level in config else ()
+    
+    if not chapters:
+        selected = picker(candidates, min(len(candidates), total_count_request))
+        rng.shuffle(selected)
+        return [load(c) for c in selected]
 
-    for q in candidates:
-        ch_num = extract_chapter_num(q.get('chapter', ''))
-        grouped_qs[ch_num].append(q)
+    grouped_qs = group_by_chapter(candidates)
 
     final_questions = []
-    for ch_key, count in weights.items():
-        ch_num = extract_chapter_num(ch_key)
-        target_group = grouped_qs.get(ch_num, [])
+    for spec in chapters:
+        target_group = grouped_qs.get(spec.num or "others", [])
         
-        k = min(len(target_group), count)
+        k = min(len(target_group), spec.weight)
         if k > 0:
-            selected = random.sample(target_group, k)
+            selected = picker(target_group, k)
             final_questions.extend(selected)
-            for s in selected:
-                if s in target_group: target_group.remove(s)
+            chosen = {id(s) for s in selected}
+            target_group[:] = [q for q in target_group if id(q) not in chosen]
 
     shortage = total_count_request - len(final_questions)
     if shortage > 0:
@@ -133,7 +133,7 @@ def get_exam_questions(level, total_count_request, target_model=None):
             remainders.extend(q_list)
         if remainders:
             k = min(len(remainders), shortage)
-            final_questions.extend(random.sample(remainders, k))
+            final_questions.extend(picker(remainders, k))
 
-    random.shuffle(final_questions)
-    return final_questions
\ No newline at end of file
+    rng.shuffle(final_questions)
+    return [load(c) for c in final_questions]
\ No newline at end of file
@@ -0,0 +1,170 @@
+import os
+import json
+import threading
+import itertools
+import numpy as np
+import logger
+import text_utils
+import grounding
+
+# 問題の全文検索インデックス (問題文・選択肢・解説の文字バイグラム)
+# 問題ファイル1つを1セグメントとし、カタログの内容ハッシュが変わったファイルだけを作り直す。
+# セグメントは バイグラムID → 問題番号 の CSR 配列と、表示用の問題本文 (UTF-8 JSON の連結) を持つ。
+# 検索は キーワードごとのバイグラムを全て含む問題 (AND) を返し、表示するページの問題だけを JSON として読む。
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.path.join(BASE_DIR, "data")
+
+class Segment:
+    """
+    1ファイル分の索引 (作成後は変更しない)
+    """
+    def __init__(self, fname, entry, questions, vocab):
+        self.fname = fname
+        self.hash = entry.get("hash")
+        self.model = entry.get("model")
+        self.level = entry.get("level")
+        self.chapter = entry.get("chapter")
+        self.chapter_num = grounding.chapter_of(self.chapter)
+        bodies = [json.dumps(q, ensure_ascii=False, separators=(",", ":")).encode("utf-8") for q in questions]
+        self.offsets = np.cumsum([0] + [len(b) for b in bodies], dtype=np.int64)
+        self.blob = b"".join(bodies)
+        self.count = len(bodies)
+
+        term_ids = []
+        doc_ids = []
+        for d, q in enumerate(questions):
+            ids = {vocab.setdefault(t, len(vocab)) for t in text_utils.bigrams(text_utils.question_text(q))}
+            term_ids.extend(ids)
+            doc_ids.extend([d] * len(ids))
+        term_ids = np.array(term_ids, dtype=np.int32)
+        doc_ids = np.array(doc_ids, dtype=np.int32)
+        order = np.lexsort((doc_ids, term_ids))
+        self.terms, starts = np.unique(term_ids[order], return_index=True)
+        self.ptr = np.append(starts, len(order)).astype(np.int64)
+        self.docs = doc_ids[order]
+
+    def postings(self, term_ids):
+        """
+        いずれかの語を含む問題番号 (OR)。1つも無ければ空配列
+        """
+        if len(self.terms) == 0: return np.empty(0, dtype=np.int32)  # 問題が無いファイル
+        pos = np.searchsorted(self.terms, term_ids)
+        pos = pos[(pos < len(self.terms)) & (self.terms[np.minimum(pos, len(self.terms) - 1)] == term_ids)]
+        if len(pos) == 0: return np.empty(0, dtype=np.int32)
+        if len(pos) == 1: return self.docs[self.ptr[pos[0]]:self.ptr[pos[0] + 1]]
+        return np.unique(np.concatenate([self.docs[self.ptr[p]:self.ptr[p + 1]] for p in pos]))
+
+    def question(self, d):
+        q = json.loads(self.blob[self.offsets[d]:self.offsets[d + 1]].decode("utf-8"))
+        q["source_model"] = self.model
+        return q
+
+class SearchIndex:
+    """
+    全問題ファイルの検索インデックス。refresh() で変更のあったファイルだけを作り直す
+    """
+    def __init__(self):
+        self.vocab = {}  # バイグラム → 語ID (全セグメント共通、増える一方)
+        self.char_terms = {}  # 文字 → その文字を含むバイグラムの語ID一覧 (1文字の検索語用。vocab と一緒に増える)
+        self._indexed = 0  # char_terms に反映済みの語数
+        self.segments = {}
+        self.version = None
+        self._lock = threading.Lock()
+
+    def refresh(self, entries, version=None):
+        """
+        entries はカタログ {ファイル名: エントリ}。内容ハッシュの変わったファイルだけ読み直す
+        """
+        with self._lock:
+            if version is not None and version == self.version: return self
+            segments = {}
+            rebuilt = 0
+            for fname, entry in sorted(entries.items()):
+                seg = self.segments.get(fname)
+                if seg is None or seg.hash != entry.get("hash"):
+                    try:
+                        with open(os.path.join(DATA_DIR, fname), 'r', encoding='utf-8') as f:
+                            data = json.load(f)
+                    except Exception as e:
+                        logger.error(e, f"Search index read error {fname}")
+                        continue
+                    if not isinstance(data, list): continue
+                    seg = Segment(fname, entry, [q for q in data if isinstance(q, dict)], self.vocab)
+                    rebuilt += 1
+                segments[fname] = seg
+            # 新しく増えた語を文字 → 語ID の表に加える (語IDは vocab への追加順の連番)
+            for i, t in enumerate(itertools.islice(self.vocab, self._indexed, None), self._indexed):
+                for ch in set(t):
+                    self.char_terms.setdefault(ch, []).append(i)
+            self._indexed = len(self.vocab)
+            if rebuilt or len(segments) != len(self.segments):
+                logger.log(f"Search index refreshed: {rebuilt} rebuilt, {len(segments)} files, {sum(s.count for s in segments.values())} questions", "SEARCH")
+            self.segments = segments  # 検索側は参照を取ってから使うので、丸ごと差し替える
+            self.version = version
+        return self
+
+    def _query_groups(self, query):
+        """
+        検索語 (空白区切り) をキーワードごとの語IDの配列にする。
+        1文字のキーワードはその文字を含む全バイグラムの OR。索引に無い語があれば None (該当なし)
+        """
+        groups = []
+        for word in str(query or "").split():
+            word = text_utils.normalize(word)
+            if not word: continue
+            if len(word) == 1:
+                ids = self.char_terms.get(word)
+                if not ids: return None
+                groups.append(np.array(ids, dtype=np.int32))
+                continue
+            for t in set(text_utils.bigrams(word, normalized=True)):
+                i = self.vocab.get(t)
+                if i is None: return None
+                groups.append(np.array([i], dtype=np.int32))
+        return groups
+
+    def search(self, query="", model=None, level=None, chapter=None, page=0, page_size=50):
+        """
+        条件に一致する問題のうち page ページ目を返す: {"total": 件数, "items": [問題dict + "_file"]}
+        chapter は章番号 ("4")。並び順はファイル名 → ファイル内の順
+        """
+        segments = self.segments
+        groups = self._query_groups(query)
+        if groups is None: return {"total": 0, "items": []}
+
+        hits = []
+        for fname, seg in segments.items():
+            if not seg.count: continue
+            if model and seg.model != model: continue
+            if level and seg.level != level: continue
+            if chapter and seg.chapter_num != chapter: continue
+            if not groups:
+                hits.append((seg, None))
+                continue
+            # 全キーワード (のバイグラム) を含む問題: 出現回数がグループ数と一致するもの
+            counts = np.zeros(seg.count, dtype=np.int32)
+            for ids in groups:
+                docs = seg.postings(ids)
+                if len(docs) == 0: break
+                counts[docs] += 1
+            else:
+                docs = np.flatnonzero(counts == len(groups))
+                if len(docs): hits.append((seg, docs))
+
+        total = sum(seg.count if docs is None else len(docs) for seg, docs in hits)
+        items = []
+        skip = page * page_size
+        for seg, docs in hits:
+            n = seg.count if docs is None else len(docs)
+            if skip >= n:
+                skip -= n
+                continue
+            for d in (range(skip, n) if docs is None else docs[skip:].tolist()):
+                if len(items) >= page_size: break
+                q = seg.question(d)
+                q["_file"] = seg.fname
+                items.append(q)
+            skip = 0
+            if len(items) >= page_size: break
+        return {"total": total, "items": items}
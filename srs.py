@@ -0,0 +1,129 @@
+import os
+import re
+import json
+import time
+import heapq
+import random
+import threading
+import logger
+import storage
+import data_cache
+
+# ユーザーごとの回答履歴と、間隔反復 (Leitner方式) による出題スケジューラ
+# 履歴は data/history/{user}.jsonl に1回答1行で追記し、メモリ上の索引は追記分だけを差分読み込みする。
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.path.join(BASE_DIR, "data")
+HISTORY_DIR = os.path.join(DATA_DIR, "history")
+
+# Leitnerの箱ごとの復習間隔 (日)。正解で1つ上の箱へ、不正解で箱0 (即復習) へ戻る
+BOX_INTERVALS_DAYS = [0, 1, 3, 7, 14, 30]
+DAY_SEC = 86400
+
+def history_path(user):
+    safe = re.sub(r'[^\w\-]', '_', str(user).strip()) or "guest"
+    return os.path.join(HISTORY_DIR, f"{safe}.jsonl")
+
+def record_answer(user, q, ok, ts=None):
+    """
+    1回答を履歴に追記する (索引には次回の get_index で差分だけ反映される)
+    """
+    row = {"ts": round(ts or time.time(), 3), "ref": data_cache.question_ref(q), "ok": bool(ok)}
+    try:
+        storage.append_line(history_path(user), json.dumps(row, ensure_ascii=False))
+    except Exception as e:
+        logger.error(e, "History write failed")
+
+class HistoryIndex:
+    """
+    1ユーザー分の回答履歴の索引 {ref: [box, due_ts, seen, wrong, last_ts]}。
+    refresh() でファイルの前回読み込み位置以降だけを読み込む
+    """
+    def __init__(self, path):
+        self.path = path
+        self.offset = 0
+        self.states = {}
+        self._lock = threading.Lock()
+
+    def _apply(self, row):
+        st = self.states.get(row["ref"])
+        if st is None:
+            st = self.states[row["ref"]] = [0, 0.0, 0, 0, 0.0]
+        if row["ok"]:
+            st[0] = min(st[0] + 1, len(BOX_INTERVALS_DAYS) - 1)
+        else:
+            st[0] = 0
+            st[3] += 1
+        st[1] = row["ts"] + BOX_INTERVALS_DAYS[st[0]] * DAY_SEC
+        st[2] += 1
+        st[4] = row["ts"]
+
+    def refresh(self):
+        with self._lock:
+            if not os.path.exists(self.path): return self
+            size = os.path.getsize(self.path)
+            if size < self.offset:  # ファイルが作り直された
+                self.offset, self.states = 0, {}
+            if size == self.offset: return self
+            with open(self.path, 'rb') as f:
+                f.seek(self.offset)
+                chunk = f.read()
+            # 書き込み途中の末尾行は次回に回す
+            end = chunk.rfind(b"\n") + 1
+            for line in chunk[:end].splitlines():
+                try: self._apply(json.loads(line))
+                except (ValueError, KeyError): continue
+            self.offset += end
+        return self
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+def get_index(user):
+    """
+    ユーザーの履歴索引を返す (プロセス内で共有し、差分だけ追加読み込みする)
+    """
+    path = history_path(user)
+    with _indexes_lock:
+        idx = _indexes.get(path)
+        if idx is None:
+            idx = _indexes[path] = HistoryIndex(path)
+    return idx.refresh()
+
+def priority(state, now):
+    """
+    優先度キー (小さいほど先に出題)。
+    0: 期限切れ (苦手なもの・期限を大きく過ぎたものほど先) / 1: 未出題 / 2: 期限前
+    """
+    if state is None:
+        return (1, 0.0)
+    box, due, seen, wrong, _ = state
+    weakness = wrong / seen if seen else 0.0
+    if due <= now:
+        return (0, -weakness - (now - due) / DAY_SEC / 30)
+    return (2, due - now)
+
+def make_picker(user, now=None, ref_of=None):
+    """
+    quiz_logic の選択関数 picker(group, k) を返す。
+    group を優先度キーでヒープ化して k 件取り出す: O(n + k log n)。
+    ref_of は group の要素から参照キーを得る関数 (スナップショットのレコード番号を渡す場合など)
+    """
+    states = get_index(user).states
+    now = now or time.time()
+    ref_of = ref_of or data_cache.question_ref
+    def picker(group, k):
+        heap = [(priority(states.get(ref_of(q)), now), random.random(), i) for i, q in enumerate(group)]
+        heapq.heapify(heap)
+        return [group[heapq.heappop(heap)[2]] for _ in range(min(k, len(heap)))]
+    return picker
+
+def get_summary(user, now=None):
+    """
+    {"seen": 出題済み数, "due": 期限切れ数, "weak": 直近で間違えたままの数}
+    """
+    states = get_index(user).states
+    now = now or time.time()
+    due = sum(1 for s in states.values() if s[1] <= now)
+    weak = sum(1 for s in states.values() if s[0] == 0)
+    return {"seen": len(states), "due": due, "weak": weak}
@@ -0,0 +1,292 @@
+import os
+import sys
+import csv
+import json
+import time
+import atexit
+import tempfile
+import threading
+import contextlib
+from collections import deque
+import logger
+
+# data/ 配下への書き込みを安全に行うためのストレージ層
+# ・アドバイザリロック: 対象ファイルと同じ場所の "<file>.lock" をOSのファイルロックで排他する
+# ・アトミック置換: 同じフォルダの一時ファイルに書いて fsync してから os.replace で差し替える
+# これにより生成・インポート・診断を別プロセスで並行実行しても、読み手は常に完全なファイルを見る。
+
+try:
+    import fcntl  # Linux / macOS
+except ImportError:
+    fcntl = None
+try:
+    import msvcrt  # Windows
+except ImportError:
+    msvcrt = None
+
+LOCK_TIMEOUT = 120  # 秒
+LOCK_POLL = 0.05
+
+class LockTimeout(Exception):
+    pass
+
+def _try_lock(fp):
+    try:
+        if fcntl:
+            fcntl.flock(fp.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        elif msvcrt:
+            fp.seek(0)
+            msvcrt.locking(fp.fileno(), msvcrt.LK_NBLCK, 1)
+        return True
+    except OSError:
+        return False
+
+def _unlock(fp):
+    try:
+        if fcntl:
+            fcntl.flock(fp.fileno(), fcntl.LOCK_UN)
+        elif msvcrt:
+            fp.seek(0)
+            msvcrt.locking(fp.fileno(), msvcrt.LK_UNLCK, 1)
+    except OSError: pass
+
+@contextlib.contextmanager
+def file_lock(path, timeout=LOCK_TIMEOUT):
+    """
+    path に対する排他ロックを取得する (プロセス間・スレッド間で有効、再入不可)。
+    timeout=0 の場合は取得できなければ即座に LockTimeout を送出する
+    """
+    lock_path = path + ".lock"
+    lock_dir = os.path.dirname(lock_path)
+    if lock_dir and not os.path.exists(lock_dir): os.makedirs(lock_dir, exist_ok=True)
+    fp = open(lock_path, 'a+')
+    try:
+        deadline = time.time() + timeout
+        while not _try_lock(fp):
+            if time.time() >= deadline:
+                raise LockTimeout(f"Lock timeout: {os.path.basename(path)}")
+            time.sleep(LOCK_POLL)
+        try:
+            yield
+        finally:
+            _unlock(fp)
+    finally:
+        fp.close()
+
+def _replace(tmp_path, path):
+    # Windowsでは読み手がファイルを開いていると置換に失敗することがあるため少し待って再試行する
+    for i in range(10):
+        try:
+            os.replace(tmp_path, path)
+            return
+        except PermissionError:
+            if i == 9: raise
+            time.sleep(0.1)
+
+def _fsync_dir(folder):
+    # rename 自体を永続化するためにフォルダも fsync する (Windowsでは不可のため省略)
+    if os.name == "nt" or not folder: return
+    try:
+        fd = os.open(folder, os.O_RDONLY)
+        try: os.fsync(fd)
+        finally: os.close(fd)
+    except OSError: pass
+
+def atomic_write_text(path, text, encoding='utf-8', fsync=True):
+    folder = os.path.dirname(path)
+    if folder and not os.path.exists(folder): os.makedirs(folder, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(prefix=os.path.basename(path) + ".", suffix=".tmp", dir=folder or None)
+    try:
+        with os.fdopen(fd, 'w', encoding=encoding, newline='') as f:
+            f.write(text)
+            f.flush()
+            if fsync: os.fsync(f.fileno())
+        _replace(tmp_path, path)
+        if fsync: _fsync_dir(folder)
+    except BaseException:
+        try: os.remove(tmp_path)
+        except OSError: pass
+        raise
+
+def atomic_write_bytes(path, data, fsync=True):
+    folder = os.path.dirname(path)
+    if folder and not os.path.exists(folder): os.makedirs(folder, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(prefix=os.path.basename(path) + ".", suffix=".tmp", dir=folder or None)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+            f.flush()
+            if fsync: os.fsync(f.fileno())
+        _replace(tmp_path, path)
+        if fsync: _fsync_dir(folder)
+    except BaseException:
+        try: os.remove(tmp_path)
+        except OSError: pass
+        raise
+
+def atomic_write_json(path, data, fsync=True):
+    """
+    JSON を原子的に書き込み、書き込んだテキストを返す
+    """
+    text = json.dumps(data, indent=4, ensure_ascii=False)
+    atomic_write_text(path, text, fsync=fsync)
+    return text
+
+def read_json(path, default=None):
+    if not os.path.exists(path): return default
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def update_json(path, updater, default=None, on_write=None):
+    """
+    ロック下で JSON を読み込み updater(data) を適用して書き戻す (read-modify-write)。
+    updater が None を返した場合は書き込まない。updater の戻り値を返す。
+    on_write(path, data, text) は書き込み後、ロックを保持したまま呼ばれる (カタログ更新など)
+    """
+    with file_lock(path):
+        data = read_json(path, default)
+        new_data = updater(data)
+        if new_data is not None:
+            text = atomic_write_json(path, new_data)
+            if on_write: on_write(path, new_data, text)
+        return new_data
+
+def remove_file(path):
+    with file_lock(path):
+        if os.path.exists(path):
+            os.remove(path)
+
+def append_csv_row(path, header, row, encoding='utf-8-sig'):
+    """
+    ロック下で CSV に1行追記する (ファイルが無ければヘッダ付きで作成)
+    """
+    folder = os.path.dirname(path)
+    if folder and not os.path.exists(folder): os.makedirs(folder, exist_ok=True)
+    with file_lock(path):
+        file_exists = os.path.exists(path) and os.path.getsize(path) > 0
+        with open(path, 'a', newline='', encoding=encoding) as f:
+            writer = csv.writer(f)
+            if not file_exists: writer.writerow(header)
+            writer.writerow(row)
+            f.flush()
+            os.fsync(f.fileno())
+
+def append_line(path, line, fsync=False):
+    """
+    ロック下でテキストファイルに1行追記する (JSON Lines のログ用)
+    """
+    folder = os.path.dirname(path)
+    if folder and not os.path.exists(folder): os.makedirs(folder, exist_ok=True)
+    with file_lock(path):
+        with open(path, 'a', encoding='utf-8', newline='\n') as f:
+            f.write(line.rstrip("\n") + "\n")
+            if fsync:
+                f.flush()
+                os.fsync(f.fileno())
+
+def cleanup_temp_files(folder, max_age_sec=3600):
+    """
+    異常終了で残った一時ファイル (*.tmp) を削除する
+    """
+    removed = 0
+    if not os.path.exists(folder): return 0
+    now = time.time()
+    for name in os.listdir(folder):
+        if not name.endswith(".tmp"): continue
+        p = os.path.join(folder, name)
+        try:
+            if now - os.path.getmtime(p) > max_age_sec:
+                os.remove(p)
+                removed += 1
+        except OSError: pass
+    if removed: logger.log(f"Removed {removed} stale temp files", "STORAGE")
+    return removed
+
+LATENCY_SAMPLES = 1000  # WriteBehindBuffer が保持する直近の書き込み時間の件数
+
+class WriteBehindBuffer:
+    """
+    書き込みを遅延・集約するバッファ (write-behind)。
+    add(key, items) でメモリに溜め、件数 (max_items) / 経過時間 (max_age_sec) の閾値、
+    または flush() / close() 時にキーごとに flush_fn(key, items) を1回だけ呼ぶ。
+    flush_fn は書き込んだ件数を返すこと。正常終了時 (atexit) にも残りを書き出す
+    """
+    def __init__(self, flush_fn, max_items=20, max_age_sec=30.0):
+        self.flush_fn = flush_fn
+        self.max_items = max_items
+        self.max_age_sec = max_age_sec
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._oldest = None
+        self._closed = False
+        self.metrics = {"flushes": 0, "items": 0, "written": 0, "latencies_ms": deque(maxlen=LATENCY_SAMPLES)}
+        atexit.register(self.close)
+
+    def add(self, key, items):
+        if not items: return
+        with self._lock:
+            self._pending.setdefault(key, []).extend(items)
+            if self._oldest is None: self._oldest = time.time()
+        self.maybe_flush()
+
+    def pending_count(self, key=None):
+        with self._lock:
+            if key is not None: return len(self._pending.get(key, []))
+            return sum(len(v) for v in self._pending.values())
+
+    def maybe_flush(self):
+        with self._lock:
+            count = sum(len(v) for v in self._pending.values())
+            age = time.time() - self._oldest if self._oldest else 0
+        if count >= self.max_items or (count and age >= self.max_age_sec):
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending, self._oldest = self._pending, {}, None
+        error = None
+        for key, items in pending.items():
+            t0 = time.perf_counter()
+            try:
+                written = self.flush_fn(key, items)
+            except Exception as e:
+                # 失敗した分はバッファに戻して次回のflushで再試行し、他のキーの書き込みは続ける
+                with self._lock:
+                    self._pending.setdefault(key, [])[:0] = items
+                    if self._oldest is None: self._oldest = time.time()
+                if error is None: error = e
+                continue
+            latency_ms = (time.perf_counter() - t0) * 1000
+            logger.observe("storage.flush", latency_ms)
+            with self._lock:
+                self.metrics["flushes"] += 1
+                self.metrics["items"] += len(items)
+                self.metrics["written"] += written or 0
+                self.metrics["latencies_ms"].append(latency_ms)
+            logger.log(f"Flushed {len(items)} items -> {os.path.basename(str(key[0] if isinstance(key, tuple) else key))} ({latency_ms:.1f}ms)", "STORAGE")
+        if error is not None: raise error
+
+    def close(self):
+        """
+        残りを書き出して閉じる。別の例外の処理中 (finally など) に呼ばれた場合、書き出しの失敗は記録するだけで送出しない
+        """
+        if self._closed: return
+        propagating = sys.exc_info()[1] is not None
+        try:
+            self.flush()
+        except Exception as e:
+            if not propagating: raise
+            logger.error(e, f"Write-behind flush failed on close ({self.pending_count()} items not written)")
+        finally:
+            self._closed = True
+            try: atexit.unregister(self.close)
+            except Exception: pass
+
+    def get_metrics(self):
+        with self._lock:
+            lat = sorted(self.metrics["latencies_ms"])
+            m = {k: v for k, v in self.metrics.items() if k != "latencies_ms"}
+        m["avg_ms"] = round(sum(lat) / len(lat), 1) if lat else 0.0
+        m["p95_ms"] = round(logger.percentile(lat, 95), 1)
+        m["max_ms"] = round(lat[-1], 1) if lat else 0.0
+        return m
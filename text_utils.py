@@ -0,0 +1,34 @@
+import re
+import unicodedata
+
+# 日本語テキストの正規化と文字バイグラム (分かち書き不要の索引用トークン)
+
+# 英数字・かな・漢字の連続部分 (記号・句読点をまたぐバイグラムは作らない)
+_RUN_RE = re.compile(r'[0-9a-z\u3040-\u30ff\u3400-\u9fff\uf900-\ufaff]+')
+
+def normalize(text):
+    """
+    NFKC 正規化 (全角英数→半角など)・小文字化・空白除去
+    """
+    s = str(text or "")
+    if not unicodedata.is_normalized("NFKC", s): s = unicodedata.normalize("NFKC", s)
+    return "".join(s.lower().split())
+
+def bigrams(text, normalized=False):
+    """
+    文字バイグラムのリスト (重複あり)。1文字だけの連続部分はその1文字をトークンにする
+    """
+    s = text if normalized else normalize(text)
+    out = []
+    for run in _RUN_RE.findall(s):
+        if len(run) == 1: out.append(run)
+        else: out.extend(map(str.__add__, run, run[1:]))
+    return out
+
+def question_text(q):
+    """
+    索引・照合に使う問題のテキスト (問題文 + 選択肢 + 解説)
+    """
+    options = q.get("options") if isinstance(q.get("options"), dict) else {}
+    parts = [q.get("question", "")] + [options.get(k, "") for k in ("1", "2", "3")] + [q.get("explanation", "")]
+    return "\n".join(str(p) for p in parts if p)
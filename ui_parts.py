@@ -2,7 +2,7 @@ import streamlit as st
 import streamlit.components.v1 as components
 import os
 import time
-import csv
+import storage
 
 # 定数定義
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -22,8 +22,17 @@ def inject_custom_css():
     </style>
     """, unsafe_allow_html=True)
 
-# JSタイマー表示
-def render_timer(remaining_sec, is_running):
+# 試験タイマー (双方向コンポーネント)
+# 試験ごとに1度だけマウントされ、再実行時は exam_id / seq / running / remaining の小さな差分のみ送る。
+# フロント側は exam_id (開始) か seq (一時停止・再開) が変わった時だけ残り時間を同期する。
+TIMER_COMPONENT_DIR = os.path.join(BASE_DIR, "components", "exam_timer")
+_exam_timer = components.declare_component("exam_timer", path=TIMER_COMPONENT_DIR)
+TIMER_REPORT_SEC = 30  # 実行中のタイマーが残り時間を報告する間隔 (タブの切り替え時にも報告する)
+
+def render_timer(remaining_sec, is_running, exam_id=0, seq=0):
+    """
+    タイマーを表示し、フロントから報告された状態 ({"exam_id", "seq", "remaining", "expired", "n"}) を返す
+    """
     # 復習モード判定 (例: 10時間=36000秒以上なら復習モードとみなす)
     if remaining_sec > 36000:
         st.markdown("""
@@ -35,73 +44,25 @@ def render_timer(remaining_sec, is_running):
             ∞ 復習モード（時間無制限）
         </div>
         """, unsafe_allow_html=True)
-        return
+        return None
 
-    # 解説中などのステータス表示
-    status_text = ""
-    if not is_running:
-        status_text = " ⏸️(解説中)"
-    
-    # JS埋め込み
-    # isRunningがtrueのときだけカウントダウンし、falseなら停止したまま表示する
-    js_code = f"""
-    <div id="timer_display" style="
-        font-size: 1.5rem; font-weight: bold; text-align: right;
-        padding: 10px; color: {'#333' if remaining_sec > 60 else '#d32f2f'};
-        background-color: #f0f2f6; border-radius: 5px; margin-bottom: 10px;
-    ">
-        残り時間: --:--
-    </div>
-    <script>
-        let timeLeft = {remaining_sec};
-        let isRunning = {'true' if is_running else 'false'};
-        let statusText = "{status_text}";
-        const display = document.getElementById("timer_display");
-        
-        function updateDisplay() {{
-            let m = Math.floor(timeLeft / 60);
-            let s = Math.floor(timeLeft % 60);
-            let timeStr = m + "分 " + (s < 10 ? "0" : "") + s + "秒";
-            display.innerText = "残り時間: " + timeStr + statusText;
-            if (timeLeft <= 60) display.style.color = "#d32f2f";
-        }}
-        
-        updateDisplay();
-        
-        if (isRunning && timeLeft > 0) {{
-            const interval = setInterval(() => {{
-                timeLeft--;
-                updateDisplay();
-                if (timeLeft <= 0) {{
-                    clearInterval(interval);
-                    display.innerText = "時間切れ！";
-                }}
-            }}, 1000);
-        }}
-    </script>
-    """
-    components.html(js_code, height=60)
+    return _exam_timer(
+        exam_id=exam_id, seq=seq, remaining=max(0, int(remaining_sec)),
+        running=bool(is_running), report_sec=TIMER_REPORT_SEC, key="exam_timer", default=None
+    )
 
 # 問題報告機能
 def report_question(q, reason="ユーザー報告"):
-    if not os.path.exists(os.path.dirname(REPORT_FILE)):
-        os.makedirs(os.path.dirname(REPORT_FILE))
-    
-    file_exists = os.path.exists(REPORT_FILE)
+    # 複数セッションから同時に報告されても行が混ざらないようロック下で追記する
     try:
-        with open(REPORT_FILE, 'a', newline='', encoding='utf-8-sig') as f:
-            writer = csv.writer(f)
-            if not file_exists:
-                writer.writerow(["日時", "理由", "モデル", "章", "ID", "問題文"])
-            
-            writer.writerow([
-                time.strftime("%Y-%m-%d %H:%M:%S"),
-                reason,
-                q.get('source_model','?'),
-                q.get('chapter','?'),
-                q.get('id','?'),
-                q.get('question','')
-            ])
+        storage.append_csv_row(REPORT_FILE, ["日時", "理由", "モデル", "章", "ID", "問題文"], [
+            time.strftime("%Y-%m-%d %H:%M:%S"),
+            reason,
+            q.get('source_model','?'),
+            q.get('chapter','?'),
+            q.get('id','?'),
+            q.get('question','')
+        ])
         return True
     except:
         return False
@@ -118,4 +79,23 @@ def check_pdf_exists():
         3. このアプリのフォルダ（`start.bat`がある場所）に置いてください。
         """)
         st.warning("※ ファイルを配置後、画面を更新してください。")
-        st.stop()
\ No newline at end of file
+        st.stop()
+
+# ページ番号の入力欄
+def _sync_page(state_key, widget_key):
+    st.session_state[state_key] = st.session_state[widget_key]
+
+def page_input(state_key, pages):
+    """
+    ページ番号の入力欄を表示して現在のページを返す。
+    ページはウィジェットではないキー state_key に保持する (ウィジェットの値は表示されない実行で消えるため)。
+    呼び出し側は state_key を書き換えて (例: 条件が変わったら 1) ページを移動できる
+    """
+    page = min(max(1, int(st.session_state.get(state_key, 1))), pages)
+    st.session_state[state_key] = page
+    widget_key = state_key + "_input"
+    if st.session_state.get(widget_key) != page:
+        st.session_state.pop(widget_key, None)  # 呼び出し側が移動したページで入力欄を作り直す
+    st.number_input(f"ページ (全{pages}ページ)", min_value=1, max_value=pages, step=1, value=page,
+                    key=widget_key, on_change=_sync_page, args=(state_key, widget_key))
+    return page
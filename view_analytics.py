@@ -0,0 +1,69 @@
+import streamlit as st
+import logger
+import pandas as pd
+import time
+import attempt_log
+
+def _to_df(rows):
+    df = pd.DataFrame(rows)
+    df["accuracy"] = (df["accuracy"] * 100).round(1)
+    df = df.rename(columns={
+        "name": "項目", "answers": "回答数", "correct": "正解数", "accuracy": "正解率(%)",
+        "time_mean": "平均(秒)", "time_p50": "中央値(秒)", "time_p90": "90%点(秒)"
+    })
+    return df.round(1)
+
+@logger.span("render.analytics")
+def render():
+    st.header("📈 学習分析")
+    st.caption("全セッションの受験結果 (data/attempts/) を集計します。")
+
+    t0 = time.perf_counter()
+    table = attempt_log.load_table()
+    if len(table) == 0:
+        st.info("まだ受験結果がありません。模擬試験を最後まで解くと記録されます。")
+        return
+
+    # 絞り込み
+    c1, c2, c3 = st.columns(3)
+    users = ["(全員)"] + table.strings.get("user", [])
+    levels = ["(全レベル)"] + table.strings.get("level", [])
+    models = ["(全モデル)"] + table.strings.get("model", [])
+    with c1: user = st.selectbox("👤 ユーザー", users)
+    with c2: level = st.selectbox("🎓 レベル", levels)
+    with c3: model = st.selectbox("🤖 モデル", models)
+    mask = table.mask(
+        user=None if user == users[0] else user,
+        level=None if level == levels[0] else level,
+        model=None if model == models[0] else model,
+    )
+
+    by_chapter = table.aggregate("chapter", mask)
+    by_model = table.aggregate("model", mask)
+    by_user = table.aggregate("user", mask)
+    elapsed_ms = (time.perf_counter() - t0) * 1000
+
+    answers = int(mask.sum())
+    correct = int(table.cols["correct"][mask].sum())
+    m1, m2, m3 = st.columns(3)
+    m1.metric("📝 受験回数", f"{table.attempt_count(mask)} 回")
+    m2.metric("✍️ 回答数", f"{answers} 問")
+    m3.metric("🎯 正解率", f"{(correct / answers * 100) if answers else 0:.1f}%")
+    st.caption(f"集計時間: {elapsed_ms:.1f}ms (全{len(table)}回答)")
+
+    if not by_chapter:
+        st.info("条件に一致する回答がありません。")
+        return
+
+    st.subheader("📖 分野別")
+    df_ch = _to_df(sorted(by_chapter, key=lambda r: r["name"]))
+    st.bar_chart(df_ch.set_index("項目")["正解率(%)"])
+    st.dataframe(df_ch, use_container_width=True, hide_index=True)
+
+    c_m, c_u = st.columns(2)
+    with c_m:
+        st.subheader("🤖 モデル別")
+        st.dataframe(_to_df(by_model), use_container_width=True, hide_index=True)
+    with c_u:
+        st.subheader("👤 ユーザー別")
+        st.dataframe(_to_df(by_user), use_container_width=True, hide_index=True)
@@ -1,43 +1,86 @@
 import streamlit as st
+import logger
 import time
 from collections import defaultdict
 import quiz_logic
+import exam_queue
+import exam_codes
+import srs
+import exam_config
 import ui_parts  # 共通部品読み込み
 
+REVIEW_PAGE_SIZE = 10  # 結果画面の回答詳細の1ページあたりの問題数
+
+@logger.span("render.exam")
 def render():
     # MENU: 試験設定画面
     if st.session_state.exam_state == "MENU":
         st.header("📚 模擬試験メニュー")
         stock_info = quiz_logic.get_available_models_info()
+        exam_queue.get_queue()  # 設定を選んでいる間に試験を作り置きしておく
         
         if not stock_info:
             st.warning("問題データがありません。「問題作成」で生成してください。")
         else:
             st.subheader("1. 出題ソース選択")
             model_opts = list(stock_info.keys())
+            if len(model_opts) > 1:
+                stock_info = dict(stock_info, **{quiz_logic.ALL_MODELS: quiz_logic.get_all_models_info()})
+                model_opts.append(quiz_logic.ALL_MODELS)
             def fmt_src(m):
                 d = stock_info[m]
+                if m == quiz_logic.ALL_MODELS:
+                    return f"🌐 全モデル (重複を除き計{d['total']}問: 二等{d.get('二等', 0)} / 一等{d.get('一等', 0)})"
                 return f"🤖 {m} (計{d['total']}問: 二等{d['二等']} / 一等{d['一等']})"
             selected_src = st.radio("出題セット:", model_opts, format_func=fmt_src)
             
             st.divider()
             st.subheader("2. 試験設定")
             c1, c2 = st.columns(2)
-            with c1: exam_type = st.radio("試験タイプ", ["二等 (30分/50問)", "一等 (75分/70問)"])
+            config = exam_config.get_config()
+            with c1:
+                level = st.radio("試験タイプ", ["二等", "一等"],
+                                 format_func=lambda lv: f"{lv} ({config.level(lv).time_limit_min}分/{config.level(lv).exam_size}問)")
             with c2:
                 is_real = st.checkbox("🔥 本番モード (解説なし・ノンストップ)", value=False)
                 st.caption("OFF: 練習モード (解説あり・タイマー一時停止)")
 
+            c3, c4 = st.columns(2)
+            with c3:
+                st.session_state.user_name = st.text_input("👤 ユーザー名 (回答履歴の保存先)", value=st.session_state.user_name).strip() or "ゲスト"
+            with c4:
+                select_mode = st.radio("出題方法", [quiz_logic.MODE_RANDOM, quiz_logic.MODE_REVIEW],
+                                       format_func=lambda m: "🎲 ランダム" if m == quiz_logic.MODE_RANDOM else "🧠 復習優先 (期限切れ・苦手な問題から)")
+                if select_mode == quiz_logic.MODE_REVIEW:
+                    summ = srs.get_summary(st.session_state.user_name)
+                    st.caption(f"履歴: {summ['seen']}問 / 復習期限 {summ['due']}問 / 苦手 {summ['weak']}問")
+            code_in = st.text_input("🔑 試験コード (任意: 共有された試験と同じ問題で受験する)", placeholder="例: K7QX-2MPA").strip()
+
             st.divider()
             if st.button("試験開始", type="primary", use_container_width=True):
-                level = "二等" if "二等" in exam_type else "一等"
-                q_count = 50 if level == "二等" else 70
-                limit_min = 30 if level == "二等" else 75
-                qs = quiz_logic.get_exam_questions(level, q_count, selected_src)
-                if not qs:
-                    st.error(f"選択されたモデルには「{level}」の問題データがありません。")
+                if code_in:
+                    entry, qs = exam_codes.resolve(code_in)
+                    code = exam_codes.normalize_code(code_in)
+                    if entry is not None: level = entry["level"]  # レベル・制限時間はコードの試験に合わせる
                 else:
+                    entry = None
+                    qs, code = exam_queue.get_exam(level, config.level(level).exam_size, selected_src, mode=select_mode, user=st.session_state.user_name)
+                limit_min = config.level(level).time_limit_min
+                if code_in and entry is None:
+                    st.error(f"試験コード「{code_in}」が見つかりません。")
+                elif not qs:
+                    st.error(f"選択されたモデルには「{level}」の問題データがありません。" if not code_in else "この試験コードの問題は削除されています。")
+                else:
+                    import attempt_log
                     st.session_state.questions = qs
+                    st.session_state.exam_code = code
+                    # コードの試験を作成後に問題データが更新・削除されていれば試験中に知らせる
+                    note = None
+                    if entry is not None and (exam_codes.is_outdated(entry) or len(qs) < len(entry["refs"])):
+                        missing = len(entry["refs"]) - len(qs)
+                        note = "作成後に問題データが更新されています" + (f" (削除された{missing}問を除いて出題)" if missing else "")
+                    st.session_state.exam_code_note = note
+                    st.session_state.exam_kind = attempt_log.KIND_REVIEW if select_mode == quiz_logic.MODE_REVIEW and not code_in else attempt_log.KIND_EXAM
                     st.session_state.time_limit = limit_min * 60
                     st.session_state.mode_real = is_real
                     st.session_state.exam_state = "EXAM"
@@ -47,6 +90,8 @@ def render():
                     st.session_state.total_consumed = 0.0
                     st.session_state.is_explaining = False
                     st.session_state.start_time = time.time()
+                    st.session_state.exam_id += 1
+                    st.session_state.timer_seq = 0
                     st.rerun()
 
     # EXAM: 試験中画面
@@ -66,9 +111,24 @@ def render():
             st.rerun()
 
         st.progress((q_idx) / total_q)
+        if st.session_state.exam_code:
+            st.caption(f"🔑 試験コード: {st.session_state.exam_code}")
+            if st.session_state.exam_code_note: st.warning(f"⚠️ {st.session_state.exam_code_note}")
         
         timer_running = not st.session_state.is_explaining
-        ui_parts.render_timer(int(rem), timer_running)
+        timer_state = ui_parts.render_timer(int(rem), timer_running, st.session_state.exam_id, st.session_state.timer_seq)
+        # フロント側タイマーの時間切れ報告を正とする
+        if timer_state and timer_state.get("expired") and timer_state.get("exam_id") == st.session_state.exam_id:
+            if not st.session_state.is_explaining:
+                st.session_state.exam_state = "RESULT"
+                st.rerun()
+        # 残り時間の報告 (定期・タブ切り替え時) もフロント側を正とし、サーバー側の消費時間を合わせる。
+        # 問題ごとの回答時間 (start_time 起点) は変えない
+        elif (timer_state and timer_state.get("exam_id") == st.session_state.exam_id
+              and timer_state.get("seq") == st.session_state.timer_seq and timer_running
+              and timer_state.get("n") != st.session_state.get("timer_report_n")):
+            st.session_state.timer_report_n = timer_state.get("n")
+            st.session_state.total_consumed = st.session_state.time_limit - float(timer_state.get("remaining", 0)) - (time.time() - st.session_state.start_time)
 
         st.subheader(f"Q{q_idx+1}. {q['question']}")
         
@@ -90,7 +150,7 @@ def render():
             st.markdown("---")
             c_src, c_rep = st.columns([4, 1])
             with c_src:
-                src_txt = f"🤖 {q.get('source_model','?')} | 📖 {q.get('chapter','?')} | 🆔 {q.get('id','?')}"
+                src_txt = f"🤖 {' / '.join(q.get('source_models') or [q.get('source_model','?')])} | 📖 {q.get('chapter','?')} | 🆔 {q.get('id','?')}"
                 st.caption(src_txt)
 
             st.info(f"💡 解説:\n\n{q['explanation']}")
@@ -101,6 +161,7 @@ def render():
             with col_next:
                 if st.button("次へ ➡", type="primary", use_container_width=True):
                     st.session_state.is_explaining = False
+                    st.session_state.timer_seq += 1  # resume
                     st.session_state.current_index += 1
                     if st.session_state.current_index >= total_q:
                         st.session_state.exam_state = "RESULT"
@@ -125,7 +186,8 @@ def render():
                 st.session_state.total_consumed += elapsed
                 is_ok = (ans == str(q['answer']))
                 if is_ok: st.session_state.score += 1
-                st.session_state.user_answers.append({"q": q, "u": ans, "ok": is_ok})
+                st.session_state.user_answers.append({"q": q, "u": ans, "ok": is_ok, "t": round(elapsed, 1)})
+                srs.record_answer(st.session_state.user_name, q, is_ok)
                 
                 if st.session_state.mode_real:
                     st.session_state.current_index += 1
@@ -136,6 +198,7 @@ def render():
                     st.rerun()
                 else:
                     st.session_state.is_explaining = True
+                    st.session_state.timer_seq += 1  # pause
                     st.rerun()
         
         # ★ 中断ボタンを追加
@@ -147,6 +210,13 @@ def render():
     # RESULT: 結果画面
     elif st.session_state.exam_state == "RESULT":
         st.header("🏁 結果発表")
+        # 受験結果を全セッション共通の列ログへ1回だけ追記する (numpy を使うため試験開始・結果画面でのみ読み込む)
+        if st.session_state.logged_exam_id != st.session_state.exam_id:
+            import attempt_log
+            attempt_log.append_attempt(st.session_state.user_answers, st.session_state.user_name, kind=st.session_state.exam_kind or attempt_log.KIND_EXAM)
+            st.session_state.logged_exam_id = st.session_state.exam_id
+        if st.session_state.exam_code:
+            st.caption(f"🔑 試験コード: {st.session_state.exam_code} (同じ問題で受験・共有できます)")
         sc = st.session_state.score
         tot = len(st.session_state.questions)
         per = int((sc / tot) * 100) if tot > 0 else 0
@@ -174,7 +244,10 @@ def render():
         wrong_list = [log for log in st.session_state.user_answers if not log['ok']]
         if wrong_list:
             if st.button(f"🔥 間違えた問題({len(wrong_list)}問)だけ復習する", type="primary"):
+                import attempt_log
                 st.session_state.questions = [x['q'] for x in wrong_list]
+                st.session_state.exam_code = None
+                st.session_state.exam_kind = attempt_log.KIND_RETEST
                 st.session_state.time_limit = 99999
                 st.session_state.mode_real = False
                 st.session_state.exam_state = "EXAM"
@@ -183,16 +256,40 @@ def render():
                 st.session_state.user_answers = []
                 st.session_state.total_consumed = 0
                 st.session_state.start_time = time.time()
+                st.session_state.exam_id += 1
+                st.session_state.timer_seq = 0
                 st.rerun()
         
         st.subheader("📝 回答詳細")
-        for i, log in enumerate(st.session_state.user_answers):
+        # 詳細は絞り込んだうえで1ページ分だけ描画する (問題数が多くても再実行のコストを一定にする)
+        answers = st.session_state.user_answers
+        chapters = ["(全章)"] + sorted({log['q'].get('chapter', 'その他') for log in answers})
+        c1, c2 = st.columns(2)
+        with c1: only_wrong = st.radio("表示", ["すべて", "間違いのみ"], horizontal=True, key="review_filter") == "間違いのみ"
+        with c2: chapter = st.selectbox("📖 章", chapters, key="review_chapter")
+        shown = [(i, log) for i, log in enumerate(answers)
+                 if not (only_wrong and log['ok']) and (chapter == chapters[0] or log['q'].get('chapter', 'その他') == chapter)]
+
+        # 条件・試験が変わったら1ページ目に戻す
+        cond = (st.session_state.exam_id, only_wrong, chapter)
+        if st.session_state.get("review_cond") != cond:
+            st.session_state.review_cond = cond
+            st.session_state.review_page = 1
+        pages = max(1, -(-len(shown) // REVIEW_PAGE_SIZE))
+        start = 0
+        if not shown:
+            st.info("条件に一致する問題はありません。")
+        else:
+            start = (ui_parts.page_input("review_page", pages) - 1) * REVIEW_PAGE_SIZE
+            st.caption(f"{len(shown)} 問中 {start + 1}〜{min(start + REVIEW_PAGE_SIZE, len(shown))} 問目")
+
+        for i, log in shown[start:start + REVIEW_PAGE_SIZE]:
             q = log['q']
             icon = "✅" if log['ok'] else "❌"
             u_sel = log['u']
             c_ans = str(q['answer'])
             ops = q['options']
-            src_txt = f"🤖 {q.get('source_model','?')} | 📖 {q.get('chapter','?')} | 🆔 {q.get('id','?')}"
+            src_txt = f"🤖 {' / '.join(q.get('source_models') or [q.get('source_model','?')])} | 📖 {q.get('chapter','?')} | 🆔 {q.get('id','?')}"
 
             with st.expander(f"Q{i+1} {icon} : {q['question'][:30]}..."):
                 st.caption(src_txt)
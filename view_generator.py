@@ -1,9 +1,35 @@
 import streamlit as st
+import logger
 import pandas as pd
 import os
+import time
 import generator_logic
+import gen_telemetry
+import exam_config
 import ui_parts  # 共通部品
 
+def _levels_from_mode(level_mode):
+    if "両方" in level_mode: return ["二等", "一等"]
+    if "一等" in level_mode: return ["一等"]
+    return ["二等"]
+
+def _render_telemetry_report():
+    rows = gen_telemetry.get_report()
+    with st.expander("📡 生成実績 (モデル × 章)"):
+        if not rows:
+            st.info("まだ生成実績がありません。")
+            return
+        df = pd.DataFrame(rows).rename(columns={
+            "model": "モデル", "key": "レベル|章", "requests": "リクエスト", "accepted": "採用数",
+            "per_min": "採用/分", "per_1k_tokens": "採用/1kトークン", "per_request": "採用/リクエスト",
+            "avg_latency_sec": "平均応答(秒)", "tokens_per_question": "トークン/問",
+            "duplicate_rate": "重複率", "parse_fail_rate": "解析失敗率", "invalid_rate": "スキーマ違反率",
+            "wasted_rate": "空振り率", "off_chapter_rate": "章外率", "ungrounded_rate": "根拠不明率",
+            "rate_limited": "429回数",
+        })
+        st.dataframe(df, use_container_width=True, hide_index=True)
+
+@logger.span("render.generator")
 def render(locked):
     st.header("📝 AI問題作成")
     
@@ -25,14 +51,30 @@ def render(locked):
         with open(key_file, 'r', encoding='utf-8-sig') as f: api_key = f.read().strip()
     user_key = st.text_input("API Key", value=api_key, type="password", disabled=locked)
     
-    if st.button("モデルリスト取得 (推奨モデルのみ)", disabled=locked):
+    # モデル一覧はディスクキャッシュから即座に表示する (期限切れなら裏で再取得される)
+    cached_models, fetched_at = generator_logic.get_cached_models(user_key)
+    c_btn, c_info = st.columns([1, 2])
+    with c_btn:
+        refresh = st.button("🔄 モデルリスト更新" if cached_models else "モデルリスト取得 (推奨モデルのみ)", disabled=locked)
+    if refresh:
         with st.spinner("取得中..."):
-            st.session_state.models = generator_logic.get_models(user_key)
+            st.session_state.models = generator_logic.get_models(user_key, force_refresh=True)
+        cached_models, fetched_at = generator_logic.get_cached_models(user_key)
+    elif user_key and not locked:
+        st.session_state.models = generator_logic.get_models(user_key) if cached_models else st.session_state.get("models", [])
+    if fetched_at:
+        with c_info: st.caption(f"モデル一覧の取得日時: {time.strftime('%Y-%m-%d %H:%M', time.localtime(fetched_at))}")
     
     models = st.session_state.get("models", [])
     if models:
         st.info("💡 **ヒント**: 精度重視なら **Pro**、速度重視なら **Flash** がおすすめです。")
+        totals = gen_telemetry.load_totals()
         def fmt(m):
+            icon = "🤖" if "pro" in m.lower() else "⚡" if "flash" in m.lower() else ""
+            s = gen_telemetry.model_summary(m, totals)
+            if s and s["per_min"]:
+                # 過去の生成実績からの値
+                return f"{icon} {m} (実績: {s['per_min']:.1f}問/分 · {s['per_request']:.1f}問/リクエスト)".strip()
             if "pro" in m.lower(): return f"🤖 {m} (推奨:高精度/1日約2セット)"
             if "flash" in m.lower(): return f"⚡ {m} (高速/1日50セット以上)"
             return m
@@ -41,10 +83,41 @@ def render(locked):
         c1, c2 = st.columns(2)
         with c1: level_mode = st.radio("作成レベル", ["二等 (基礎)", "一等 (応用)", "両方 (二等+一等)"], disabled=locked)
         with c2: sets = st.number_input("作成セット数", 1, 5, 1, disabled=locked)
+        batch_mode = st.checkbox("📦 まとめて生成 (複数の章を1リクエストで作成し、リクエスト数と入力トークンを節約)", value=False, disabled=locked)
+        c3, c4 = st.columns(2)
+        with c3: fill_gaps = st.checkbox("📉 在庫の少ない章だけ補充 (セット数は使わない)", value=False, disabled=locked)
+        with c4: depth = st.number_input("目標在庫 (出題数の何倍)", 1, 100, generator_logic.DEFAULT_DEPTH_FACTOR, disabled=locked or not fill_gaps)
+
+        # 実績ベースの所要時間見積もり
+        config = exam_config.get_config()
+        gap_targets = None
+        if fill_gaps:
+            # 章ごとの目標在庫 (出題数 × 倍率) に足りない分だけを作る
+            gap_targets = generator_logic.plan_gaps([target_model], _levels_from_mode(level_mode), depth=depth)[target_model]
+            plan = [
+                (lv, ch.name, generator_logic.chapter_count(ch, lv, gap_targets))
+                for lv in gap_targets
+                for ch in config.level(lv).chapters
+            ]
+        else:
+            plan = [
+                (lv, ch.name, ch.weight * sets)
+                for lv in _levels_from_mode(level_mode)
+                for ch in config.level(lv).chapters
+            ]
+        est = gen_telemetry.estimate_seconds(generator_logic.telemetry_name(target_model, batch_mode), plan, totals)
+        if est is not None:
+            st.caption(f"⏱️ 見積もり: 約{generator_logic.format_time(est)} ({sum(n for _, _, n in plan)}問 · {target_model} の過去実績から算出)")
+        else:
+            st.caption("⏱️ 見積もり: このモデルの生成実績がまだ少ないため算出できません。")
         
-        if not locked and st.button("🚀 生成開始", type="primary"):
+        if fill_gaps and not gap_targets:
+            st.success(f"✅ 全ての章が目標在庫 (出題数の{depth}倍) に達しています。")
+        elif not locked and st.button("🚀 生成開始", type="primary"):
             st.session_state.is_generating = True
             st.rerun()
+
+    if not locked: _render_telemetry_report()
     
     if locked:
         st.markdown("---")
@@ -67,18 +140,27 @@ def render(locked):
             chapter_bar = st.progress(0)
             chapter_metrics_ph = st.empty()
 
-        if "両方" in level_mode: target_levels = ["二等", "一等"]
-        elif "一等" in level_mode: target_levels = ["一等"]
-        else: target_levels = ["二等"]
+        target_levels = _levels_from_mode(level_mode)
         
         def ui_updater(tasks_data, time_info, progress_dict):
             total_bar.progress(progress_dict.get('total', 0.0))
             chapter_bar.progress(progress_dict.get('chapter', 0.0))
             if isinstance(time_info, dict):
                 with total_metrics_ph.container():
-                    c_t1, c_t2 = st.columns(2)
+                    c_t1, c_t2, c_t3 = st.columns(3)
                     c_t1.metric("⏳ 全体経過", time_info.get('elapsed_total', '--'))
                     c_t2.metric("🏁 完了目安", time_info.get('eta_total', '--'))
+                    wb = time_info.get('write_behind')
+                    if wb:
+                        c_t3.metric("💾 書き込み", f"{wb['flushes']}回 / {wb['written']}問", f"平均 {wb['avg_ms']}ms · p95 {wb['p95_ms']}ms", delta_color="off")
+                    tm = time_info.get('telemetry')
+                    if tm and tm.get('requests'):
+                        st.caption(
+                            f"📡 {tm['requests']}リクエスト · 採用 {tm['accepted']}問"
+                            f" · {tm['per_min'] or 0:.1f}問/分 · {tm['per_request'] or 0:.1f}問/リクエスト"
+                            + (f" · {tm['per_1k_tokens']:.2f}問/1kトークン" if tm['per_1k_tokens'] else "")
+                            + (f" · 429: {tm['rate_limited']}回" if tm['rate_limited'] else "")
+                        )
                 with chapter_status_ph.container():
                     st.info(f"**{time_info.get('status', '準備中...')}**")
                 with chapter_metrics_ph.container():
@@ -91,7 +173,10 @@ def render(locked):
                 df_show.columns = ["タスク名", "状態", "進捗"]
                 table_ph.table(df_show)
 
-        err = generator_logic.run_generation(user_key, target_model, target_levels, sets, ui_updater)
+        if gap_targets is not None:
+            err = generator_logic.run_generation(user_key, target_model, list(gap_targets), 1, ui_updater, batch_mode=batch_mode, chapter_targets=gap_targets)
+        else:
+            err = generator_logic.run_generation(user_key, target_model, target_levels, sets, ui_updater, batch_mode=batch_mode)
         st.session_state.is_generating = False
         if err: st.session_state.gen_error = err
         else: st.session_state.gen_success = True
@@ -1,13 +1,77 @@
 import streamlit as st
+import logger
 import pandas as pd
-import glob
 import os
-import json
+import sys
 import time
 import check_db
+import data_cache
+import exam_config
+import storage
 import export_review
 import import_review
+import item_analysis
+import ui_parts
 
+BROWSER_PAGE_SIZES = [20, 50, 100]
+
+def _render_browser():
+    st.subheader("🔎 問題の検索・閲覧")
+    st.caption("問題文・選択肢・解説から検索します (空白区切りで全てを含む問題)。報告された問題や診断で見つかった問題の確認に使えます。")
+    models = ["(全モデル)"] + sorted({e["model"] for e in data_cache.get_catalog().values() if e.get("model")})
+    config = exam_config.get_config()
+    levels = ["(全レベル)"] + list(config.levels)
+    chapters = ["(全章)"] + sorted({spec.num for name in config.levels for spec in config.level(name).chapters if spec.num}, key=int)
+
+    query = st.text_input("検索語", key="browser_query", placeholder="例: 目視外飛行 許可")
+    c1, c2, c3, c4 = st.columns(4)
+    with c1: model = st.selectbox("🤖 モデル", models, key="browser_model")
+    with c2: level = st.selectbox("🎓 レベル", levels, key="browser_level")
+    with c3: chapter = st.selectbox("📖 章", chapters, key="browser_chapter", format_func=lambda c: c if c == chapters[0] else f"第{c}章")
+    with c4: page_size = st.selectbox("表示件数", BROWSER_PAGE_SIZES, key="browser_page_size")
+
+    # 条件が変わったら1ページ目に戻す
+    cond = (query, model, level, chapter, page_size)
+    if st.session_state.get("browser_cond") != cond:
+        st.session_state.browser_cond = cond
+        st.session_state.browser_page = 1
+
+    t0 = time.perf_counter()
+    index = data_cache.get_search_index()
+    def run(page):
+        return index.search(
+            query,
+            model=None if model == models[0] else model,
+            level=None if level == levels[0] else level,
+            chapter=None if chapter == chapters[0] else chapter,
+            page=page - 1, page_size=page_size,
+        )
+    page = st.session_state.setdefault("browser_page", 1)
+    result = run(page)
+    pages = max(1, -(-result["total"] // page_size))
+    if page > pages:
+        # データが減って範囲外になった場合は最終ページを表示する
+        page = st.session_state.browser_page = pages
+        result = run(pages)
+    elapsed_ms = (time.perf_counter() - t0) * 1000
+
+    if not result["total"]:
+        st.info("条件に一致する問題はありません。")
+        return
+    ui_parts.page_input("browser_page", pages)
+    st.caption(f"{result['total']} 件中 {(page - 1) * page_size + 1}〜{(page - 1) * page_size + len(result['items'])} 件目 (検索 {elapsed_ms:.1f}ms)")
+    rows = []
+    for q in result["items"]:
+        options = q.get("options") if isinstance(q.get("options"), dict) else {}
+        rows.append({
+            "ファイル名": q["_file"], "ID": q.get("id", ""), "章": q.get("chapter", ""),
+            "問題文": q.get("question", ""),
+            "選択肢1": options.get("1", ""), "選択肢2": options.get("2", ""), "選択肢3": options.get("3", ""),
+            "正解": q.get("answer", ""), "解説": q.get("explanation", ""),
+        })
+    st.dataframe(pd.DataFrame(rows), use_container_width=True, hide_index=True)
+
+@logger.span("render.manager")
 def render(locked):
     st.header("📊 データ管理")
     
@@ -32,7 +96,7 @@ def render(locked):
                 
                 # 履歴クリアボタン
                 if st.button("🗑️ 報告履歴を全て消去", type="secondary"):
-                    os.remove(report_path)
+                    storage.remove_file(report_path)
                     st.success("履歴を消去しました。画面を更新します...")
                     time.sleep(1)
                     st.rerun()
@@ -54,17 +118,12 @@ def render(locked):
     st.subheader("⚠️ データ整合性チェック (システムの不備)")
     st.caption("ファイルの破損や必須項目の欠落など、システム的な不備を診断した結果です。")
 
-    # ファイル数の集計
-    files = glob.glob(os.path.join(data_dir, "db_*.json"))
-    files = [f for f in files if "db_status.json" not in f]
-    total_q_count = 0
-    for f in files:
-        try:
-            with open(f,'r',encoding='utf-8') as fp: total_q_count += len(json.load(fp))
-        except: pass
+    # ファイル数の集計 (キャッシュ済みの在庫統計を使う)
+    stock = data_cache.get_stock_stats()
+    total_q_count = sum(m['total'] for m in stock["models"].values())
     
     m1, m2, m3 = st.columns(3)
-    m1.metric("📁 総ファイル数", f"{len(files)} ファイル")
+    m1.metric("📁 総ファイル数", f"{stock['files']} ファイル")
     m2.metric("📝 総問題数", f"{total_q_count} 問")
 
     msg = st.session_state.maintenance_msg
@@ -78,6 +137,18 @@ def render(locked):
         st.dataframe(df_err, use_container_width=True)
     else:
         st.success("✅ データ構造に問題はありません。")
+
+    # 教則PDFとの照合結果 (推定のため不備とは別に表示する)
+    grounding_flags = data_cache.get_grounding_status()
+    if grounding_flags:
+        with st.expander(f"📖 教則との照合: 章外・根拠不明の疑い {len(grounding_flags)} 件 (参考)"):
+            st.caption("問題文が指定の章の記述と一致しにくいものです。誤りとは限らないため、内容を確認してください。")
+            st.dataframe(pd.DataFrame(grounding_flags), use_container_width=True, hide_index=True)
+
+    # 試験設定 (exam_config.json) の検証結果
+    config_errors = exam_config.get_config().errors
+    if config_errors:
+        st.warning("⚙️ **試験設定 (exam_config.json) に問題があります**\n\n" + "\n".join(f"- {e}" for e in config_errors))
         
     st.markdown("---")
     
@@ -127,4 +198,71 @@ def render(locked):
                     st.session_state.maintenance_msg = {'type': 'warning', 'content': txt}
             else:
                 st.session_state.maintenance_msg = {'type': 'warning', 'content': "⚠️ CSVが見つかりません。"}
-            st.rerun()
\ No newline at end of file
+            st.rerun()
+
+    # ------------------------------------------------
+    # 4. 問題の品質分析 (項目分析)
+    # ------------------------------------------------
+    st.markdown("---")
+    st.subheader("🔬 問題の品質分析")
+    st.caption("受験結果から問題ごとの正答率・識別力・選択肢の選択率を計算し、品質の低い問題から表示します。正解キーの誤りが疑われる問題は出題から除外されます。")
+    if st.button("分析を実行 (Item Analysis)", disabled=locked):
+        n_items, n_flagged = item_analysis.run_item_analysis()
+        st.session_state.maintenance_msg = {'type': 'success', 'content': f"✅ **分析完了**: {n_items}問を分析し、{n_flagged}問に要確認フラグを付けました。"}
+        st.rerun()
+
+    items = data_cache.get_item_stats()
+    worst = sorted(((ref, v) for ref, v in items.items() if v["flags"]), key=lambda x: item_analysis.quality_sort_key(x[1]))
+    if worst:
+        rows = []
+        for ref, v in worst[:100]:
+            model, level, ch, qid = (ref.split("|") + ["", "", "", ""])[:4]
+            rows.append({
+                "モデル": model, "レベル": level, "章": f"第{ch}章", "ID": qid,
+                "回答数": v["n"], "正答率": v["p"], "識別力": v["r_pb"],
+                "選択率(1/2/3)": " / ".join(f"{v['choice_rates'].get(k, 0):.0%}" for k in ("1", "2", "3")),
+                "判定": "、".join(item_analysis.FLAG_LABELS.get(f, f) for f in v["flags"]),
+                "出題除外": "○" if v.get("excluded") else "",
+            })
+        st.warning(f"⚠️ **{len(worst)} 問に要確認フラグがあります** (悪い順・最大100件)")
+        st.dataframe(pd.DataFrame(rows), use_container_width=True, hide_index=True)
+    elif items:
+        st.success(f"✅ 分析済みの{len(items)}問に問題は見つかりませんでした。")
+    else:
+        st.info("まだ分析結果がありません。")
+
+    # ------------------------------------------------
+    # 5. 問題の検索・閲覧
+    # ------------------------------------------------
+    st.markdown("---")
+    _render_browser()
+
+    # ------------------------------------------------
+    # 6. キャッシュ統計
+    # ------------------------------------------------
+    with st.expander("🧮 キャッシュ統計 (プロセス全体)"):
+        st.caption(f"データバージョン: {data_cache.get_data_version()}")
+        metrics = data_cache.get_metrics()
+        if metrics:
+            df_cache = pd.DataFrame.from_dict(metrics, orient="index")
+            st.dataframe(df_cache, use_container_width=True)
+        else:
+            st.info("まだキャッシュは使用されていません。")
+        if "exam_queue" in sys.modules:  # 模擬試験画面を開くまではキュー (補充スレッド) を起動しない
+            q = sys.modules["exam_queue"].get_queue().get_metrics()
+            st.caption(f"作成済み試験キュー: 取り出し {q['hit']} / 在庫切れ (その場で作成) {q['miss']} / 作成 {q['built']} / 破棄 {q['dropped']}")
+            if q["ready"]: st.dataframe(pd.DataFrame.from_dict(q["ready"], orient="index", columns=["待機中の試験"]), use_container_width=True)
+    # ------------------------------------------------
+    # 7. 処理時間 (スパン計測)
+    # ------------------------------------------------
+    with st.expander("⏱️ 処理時間 (p50 / p95)"):
+        st.caption("このプロセスで計測した主要処理の所要時間です。環境変数 DRONE_LOG_JSON を指定すると JSON Lines にも記録され、`python logger.py <ファイル>` で集計できます。")
+        perf = logger.get_metrics()
+        if perf["histograms"]:
+            df_span = pd.DataFrame.from_dict(perf["histograms"], orient="index").sort_index()
+            df_span = df_span.rename(columns={"count": "回数", "avg": "平均(ms)", "p50": "p50(ms)", "p95": "p95(ms)", "max": "最大(ms)"})
+            st.dataframe(df_span, use_container_width=True)
+        else:
+            st.info("まだ計測結果がありません。")
+        if perf["counters"]:
+            st.dataframe(pd.DataFrame.from_dict(perf["counters"], orient="index", columns=["件数"]).sort_index(), use_container_width=True)